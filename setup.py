@@ -15,6 +15,9 @@ setuptools.setup(
      download_url = 'https://github.com/heindelj/pyMD/archive/v_035.tar.gz',
      install_requires=['numpy', 'tidynamics', 'ase'],
      packages=setuptools.find_packages(),
+     entry_points={
+         "console_scripts": ["mbe_batch=src.Batch:main"],
+     },
      classifiers=[
          "Programming Language :: Python :: 3"
      ],
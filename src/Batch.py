@@ -0,0 +1,205 @@
+"""
+Runs many MBE jobs in one process, so the potentials are only loaded and the worker pool only
+started once. The jobs are described by a JSON manifest:
+
+{
+    "nproc": 8,
+    "output": "results.jsonl",
+    "potentials": {
+        "ttm":   {"type": "TTM", "kwargs": {"path_to_library": "/path/to/MBE_Toolkit/bin/", "model": 21}},
+        "mbpol": {"type": "MBPol", "args": ["/path/to/MBE_Toolkit/bin/"]},
+        "hf":    {"type": "NWChem", "kwargs": {"theory": "scf", "basis": "sto-3g"}},
+        "mine":  {"type": "my_potential:My_Potential", "path": "/path/to/dir", "kwargs": {}}
+    },
+    "defaults": {"order": 3, "potential": "ttm", "parallel": true},
+    "jobs": [
+        {"xyz": "w20_fragmented.xyz"},
+        {"xyz": "trajectory.xyz", "fragmentation": "connectivity", "frames": [0, 10, 20], "order": 4, "forces": true}
+    ]
+}
+
+Each potential is made by Potential.make_potential() from its "type", either a name registered with
+Potential.register_potential() or a "module:attribute", and its "args" and "kwargs". "path" is added
+to sys.path first, for modules which aren't importable otherwise. ASE calculators are used as such.
+
+Each job takes the keys of "defaults" unless it sets them itself:
+    xyz                    (str): xyz file of the job
+    name                   (str): name of the job in the results, defaults to the xyz file
+    potential              (str): name of an entry of "potentials"
+    order                  (int): order of the MBE
+    parallel              (bool): evaluate the n-mers on the shared worker pool
+    fragmentation          (str): "delimited" for fragments separated by '--' (one geometry),
+                                  or "connectivity" to find the molecules of each frame
+    frames           (list|str): frames evaluated with connectivity fragmentation, or "all". Defaults to [0].
+    molecules_per_fragment (int): molecules per fragment for connectivity fragmentation
+    forces                (bool): include the forces in the results
+    export                 (str): directory of an n-mer dataset (see NMer_Dataset.py) which every n-mer
+                                  of the job is added to, with its energy, forces and n-body increment
+
+Every frame of every job writes one JSON line with its energy, n-body energies and wall time,
+or the error if it failed, so a failed job doesn't stop the batch.
+"""
+import sys, os
+import argparse
+import json
+import time
+import numpy as np
+from .Fragments import Fragments
+from .read_geometries import read_geoms
+from .MBE_Potential import ASE_MBE_Potential, Classical_MBE_Potential
+from .Pools import acquire_pool, release_pool
+from .NMer_Dataset import NMer_Dataset_Writer
+
+__all__ = ['load_manifest', 'load_potential', 'run_batch', 'main']
+
+def load_manifest(manifest_file):
+    """Reads a job manifest and resolves the xyz files of the jobs relative to it."""
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Couldn't read the job manifest {manifest_file}: {e}")
+        sys.exit(1)
+    if not manifest.get("jobs"):
+        print(f"The job manifest {manifest_file} has no jobs.")
+        sys.exit(1)
+
+    root = os.path.dirname(os.path.abspath(manifest_file))
+    defaults = manifest.get("defaults", {})
+    jobs = []
+    for job in manifest["jobs"]:
+        job = {**defaults, **job}
+        job["xyz"] = os.path.join(root, job["xyz"])
+        if job.get("export"):
+            job["export"] = os.path.join(root, job["export"])
+        job.setdefault("name", os.path.basename(job["xyz"]))
+        jobs.append(job)
+    manifest["jobs"] = jobs
+    return manifest
+
+def load_potential(spec):
+    """Builds a potential from its manifest entry with Potential.make_potential(). Returns (potential, is_ase_calculator)."""
+    from .Potential import make_potential
+    from ase.calculators.calculator import BaseCalculator
+    if "type" not in spec:
+        print("Every potential of the manifest needs a type.")
+        sys.exit(1)
+    if spec.get("path"):
+        sys.path.insert(0, os.path.abspath(spec["path"]))
+    potential = make_potential(spec["type"], *spec.get("args", []), **spec.get("kwargs", {}))
+    return potential, isinstance(potential, BaseCalculator)
+
+def get_job_fragments(job, calculator):
+    """Yields (frame, Fragments) for every frame of a job."""
+    fragmentation = job.get("fragmentation", "delimited")
+    if fragmentation == "delimited":
+        yield 0, Fragments(job["xyz"], calculator)
+    elif fragmentation == "connectivity":
+        frames = job.get("frames", [0])
+        if frames == "all":
+            frames = range(len(read_geoms(job["xyz"])[0]))
+        for frame in frames:
+            yield frame, Fragments.from_connectivity(job["xyz"], calculator, job.get("molecules_per_fragment", 1), frame=frame)
+    else:
+        raise ValueError(f"Unknown fragmentation {fragmentation}. Options are delimited and connectivity.")
+
+def evaluate_job_frame(job, fragments, potential, is_ase, nproc, frame=0, writer=None):
+    """Evaluates one frame of a job and returns its results as a JSON-serializable dict.
+    If writer is given, the n-mers are added to it as well."""
+    order = job["order"]
+    if is_ase:
+        mbe = ASE_MBE_Potential(order, fragments, nproc=nproc, return_mb_terms=True)
+    else:
+        mbe = Classical_MBE_Potential(order, fragments, potential, nproc=nproc, return_mb_terms=True)
+    try:
+        if writer is not None:
+            energy, forces, mb_terms = mbe.evaluate_on_fragments_exported(writer, frame, job["xyz"], job.get("parallel", True))
+        elif job.get("parallel", True):
+            energy, forces, mb_terms = mbe.evaluate_on_fragments_parallel()
+        else:
+            energy, forces, mb_terms = mbe.evaluate_on_fragments()
+    finally:
+        mbe.close()
+    result = {"energy": float(energy),
+              "nbody_energies": [float(mb_terms[str(n + 1) + "body_energy"]) for n in range(order)]}
+    if job.get("forces", False):
+        result["forces"] = np.asarray(forces).tolist()
+    return result
+
+def run_batch(manifest, output=None, nproc=None):
+    """
+    Runs every job of a manifest from load_manifest() and writes one JSON line per frame to output.
+    The worker pool is held for the whole batch, so every MBE shares the same warm pool.
+    Returns the list of results.
+    """
+    output = output or manifest.get("output", "results.jsonl")
+    nproc = nproc or manifest.get("nproc", 8)
+    results = []
+    # one writer per dataset, so jobs exporting to the same dataset append to it
+    writers = {}
+
+    # the workers are forked with whatever is imported when the pool starts, so the potentials
+    # (and the modules they load) have to come first
+    start = time.perf_counter()
+    potentials = {}
+    for name in sorted({job.get("potential") for job in manifest["jobs"]}):
+        load_start = time.perf_counter()
+        try:
+            potentials[name] = load_potential(manifest["potentials"][name])
+            print(f"Loaded potential {name} in {time.perf_counter() - load_start:.2f} s", file=sys.stderr)
+        except (Exception, SystemExit) as e:
+            # reported by every job which uses it
+            potentials[name] = e
+            print(f"Couldn't load potential {name}", file=sys.stderr)
+
+    pool_start = time.perf_counter()
+    pool = acquire_pool(nproc)
+    print(f"Started {nproc} workers in {time.perf_counter() - pool_start:.2f} s", file=sys.stderr)
+    try:
+        with open(output, 'w') as f:
+            for job in manifest["jobs"]:
+                job_start = time.perf_counter()
+                try:
+                    name = job["potential"]
+                    if isinstance(potentials[name], BaseException):
+                        raise potentials[name]
+                    potential, is_ase = potentials[name]
+                    writer = None
+                    if job.get("export"):
+                        if job["export"] not in writers:
+                            writers[job["export"]] = NMer_Dataset_Writer(job["export"])
+                        writer = writers[job["export"]]
+                    for frame, fragments in get_job_fragments(job, potential if is_ase else None):
+                        frame_start = time.perf_counter()
+                        result = {"name": job["name"], "xyz": job["xyz"], "frame": frame, "order": job["order"], "potential": name}
+                        result.update(evaluate_job_frame(job, fragments, potential, is_ase, nproc, frame, writer))
+                        result["seconds"] = time.perf_counter() - frame_start
+                        results.append(result)
+                        f.write(json.dumps(result) + '\n')
+                        f.flush()
+                except (Exception, SystemExit) as e:
+                    # the library reports most problems by exiting, which shouldn't end the whole batch
+                    error = f"exited with status {e.code}, see the output above" if isinstance(e, SystemExit) else f"{type(e).__name__}: {e}"
+                    result = {"name": job.get("name"), "xyz": job.get("xyz"), "error": error,
+                              "seconds": time.perf_counter() - job_start}
+                    results.append(result)
+                    f.write(json.dumps(result) + '\n')
+                    f.flush()
+    finally:
+        release_pool(pool)
+        for writer in writers.values():
+            writer.close()
+    print(f"Ran {len(manifest['jobs'])} jobs in {time.perf_counter() - start:.2f} s, results in {output}", file=sys.stderr)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs a manifest of MBE jobs with one set of loaded potentials and one worker pool.")
+    parser.add_argument("manifest", help="JSON job manifest")
+    parser.add_argument("-o", "--output", help="JSON lines file for the results, overrides the manifest")
+    parser.add_argument("-n", "--nproc", type=int, help="number of worker processes, overrides the manifest")
+    args = parser.parse_args(argv)
+    results = run_batch(load_manifest(args.manifest), args.output, args.nproc)
+    return 1 if any("error" in result for result in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,21 +1,29 @@
-from numpy.lib.function_base import gradient
-from Fragments import Fragments
-from Potential import *
-from MBE_Potential import MBE_Potential
+from .Fragments import Fragments
+from .Potential import *
+from .MBE_Potential import Classical_MBE_Potential
+from .Executors import Executor, Process_Executor
+import numpy as np
 
 class Composite_Potential:
     """
     A composition of multiple Potential objects which are used to construct MBE_Potentials
     that are used to calculate all orders of the MBE.
     """
-    def __init__(self, orders_and_potentials: dict, fragments: Fragments, full_background_potential=True):
+    def __init__(self, orders_and_potentials: dict, fragments: Fragments, full_background_potential=True, nproc=8, multilevel_cutoff=None, executor: Executor=None):
         """
         Takes a dictionary of integers specifying the maximum order of the MBE and corresponding potential which
-        will be used for this method.
+        will be used for this method. All of the member MBE potentials share one executor, by default a pool of nproc workers.
+
+        If multilevel_cutoff is given, the potential of the highest order (usually the cheapest) screens
+        the n-mers for all of the other potentials. See get_energy_and_gradients_multilevel().
         """
         self.orders_and_potentials = orders_and_potentials
         self.fragments = fragments
         self.full_background_potential = full_background_potential
+        self.nproc = nproc
+        self.multilevel_cutoff = multilevel_cutoff
+        self.owns_executor = executor is None
+        self.executor = executor if executor is not None else Process_Executor(nproc)
         self.mbe_potentials = []
         self.create_member_potentials()
 
@@ -28,25 +36,31 @@ class Composite_Potential:
         # get the minimum order which should return 
         # the sum up to minimum order
         min_order = min(self.orders_and_potentials.keys())
-        self.mbe_potentials.append(MBE_Potential(min_order, self.fragments, self.orders_and_potentials[min_order]))
+        self.mbe_potentials.append(Classical_MBE_Potential(min_order, self.fragments, self.orders_and_potentials[min_order], nproc=self.nproc, executor=self.executor))
         for mbe_order, mbe_potential in self.orders_and_potentials.items():
             if mbe_order != max_order and mbe_order != min_order:
-                self.mbe_potentials.append(MBE_Potential(mbe_order, self.fragments, mbe_potential, return_order_n=mbe_order))
+                self.mbe_potentials.append(Classical_MBE_Potential(mbe_order, self.fragments, mbe_potential, nproc=self.nproc, return_order_n=mbe_order, executor=self.executor))
         # First potential does MBE up to max_order - 1. Second potential does the full calculation and then subtracts out the difference
-        self.full_system_potential = (MBE_Potential(max_order-1, self.fragments, max_order_potential), max_order_potential)
+        self.full_system_potential = (Classical_MBE_Potential(max_order-1, self.fragments, max_order_potential, nproc=self.nproc, executor=self.executor), max_order_potential)
 
     def get_energy_and_gradients(self, coords, parallel_MBE=False):
         """
         Calls all of the potentials contained in self.mbe_potentials and self.full_system_potential
         to get the total energy for this composite potential.
+
+        If parallel_MBE is True, the member MBEs, the residual MBE and the full system calculation
+        are all queued on self.executor at once and only combined at the end, so the slowest of
+        them (usually the full system calculation) overlaps with everything else.
         """
+        if self.multilevel_cutoff is not None:
+            return self.get_energy_and_gradients_multilevel(coords, parallel_MBE)
+        if parallel_MBE:
+            return self.get_energy_and_gradients_concurrent(coords)
+
         nbody_energies = np.zeros(len(self.mbe_potentials)+1)
         total_gradients = np.zeros_like(coords)
         for (i, potential) in enumerate(self.mbe_potentials):
-            if parallel_MBE:
-                energy, gradients = potential.evaluate_on_geometry_parallel(coords)
-            else:
-                energy, gradients = potential.evaluate_on_geometry(coords)
+            energy, gradients = potential.evaluate_on_geometry(coords)
             nbody_energies[i] = energy
             total_gradients += gradients
         
@@ -55,6 +69,70 @@ class Composite_Potential:
         nbody_energies[-1] = residual_energy_full - residual_energy_mbe
         total_gradients   += residual_gradients_full - residual_gradients_mbe
         return np.sum(nbody_energies), total_gradients
+
+    def get_energy_and_gradients_concurrent(self, coords):
+        """
+        Evaluates the composite potential as a small task graph on self.executor.
+        Every member MBE, the residual MBE and the full system calculation are independent,
+        so they are all submitted before waiting on any of them. Only the final sum depends on all of them.
+        """
+        # all of the member MBEs share self.fragments, so it only needs to be set once
+        self.fragments.fragment_geometry(coords)
+        residual_mbe, full_potential = self.full_system_potential
+
+        # the full system calculation is usually the longest task, so it goes on the executor first
+        full_result = self.executor.apply_async(full_potential.evaluate, (coords,))
+        member_results = [potential.submit_on_fragments() for potential in self.mbe_potentials]
+        residual_result = residual_mbe.submit_on_fragments()
+
+        nbody_energies = np.zeros(len(self.mbe_potentials)+1)
+        total_gradients = np.zeros_like(coords)
+        for (i, (potential, async_result)) in enumerate(zip(self.mbe_potentials, member_results)):
+            energy, gradients = potential.collect_results(async_result)
+            nbody_energies[i] = energy
+            total_gradients += gradients
+
+        residual_energy_mbe, residual_gradients_mbe = residual_mbe.collect_results(residual_result)
+        residual_energy_full, residual_gradients_full = full_result.get()
+        nbody_energies[-1] = residual_energy_full - residual_energy_mbe
+        total_gradients   += residual_gradients_full - residual_gradients_mbe
+        return np.sum(nbody_energies), total_gradients
+
+    def get_energy_and_gradients_multilevel(self, coords, parallel_MBE=False):
+        """
+        The residual MBE already evaluates every n-mer up to max_order - 1 with the highest order potential,
+        so its per n-mer increments are used to decide which n-mers each member potential has to evaluate.
+        Only n-mers whose cheap increment is at least self.multilevel_cutoff go to the member potentials,
+        and the cheap increment fills in for the rest. The selected fraction and estimated error of each
+        member are collected in self.multilevel_report.
+        """
+        self.fragments.fragment_geometry(coords)
+        residual_mbe, full_potential = self.full_system_potential
+
+        cheap_increments = residual_mbe.compute_increments(parallel_MBE)
+        residual_energy_mbe = 0.0
+        residual_gradients_mbe = np.zeros_like(coords)
+        for combination, (energy, gradients) in cheap_increments.items():
+            residual_energy_mbe += energy
+            residual_gradients_mbe[self.fragments.get_atom_indices(combination)] += gradients
+
+        nbody_energies = np.zeros(len(self.mbe_potentials)+1)
+        total_gradients = np.zeros_like(coords)
+        for (i, potential) in enumerate(self.mbe_potentials):
+            energy, gradients = potential.evaluate_on_fragments_multilevel(cheap_increments, self.multilevel_cutoff, parallel_MBE)
+            nbody_energies[i] = energy
+            total_gradients += gradients
+        self.multilevel_report = [potential.multilevel_report for potential in self.mbe_potentials]
+
+        residual_energy_full, residual_gradients_full = full_potential.evaluate(coords)
+        nbody_energies[-1] = residual_energy_full - residual_energy_mbe
+        total_gradients   += residual_gradients_full - residual_gradients_mbe
+        return np.sum(nbody_energies), total_gradients
+
+    def close(self):
+        """Closes the executor shared by the member potentials, unless it was passed in."""
+        if self.owns_executor:
+            self.executor.close()
     
 if __name__ == '__main__':
     import sys
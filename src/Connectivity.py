@@ -0,0 +1,147 @@
+import numpy as np
+import itertools
+from ase.data import covalent_radii, atomic_numbers
+
+__all__ = ['get_covalent_radii', 'find_bonds', 'find_molecules', 'group_molecules', 'fragment_by_connectivity']
+
+def get_covalent_radii(atom_labels):
+    """Returns the covalent radius in angstrom of each atom label (e.g. 'O', 'H', 'Cl')."""
+    return np.array([covalent_radii[atomic_numbers[label.capitalize()]] for label in atom_labels])
+
+def find_bonds(atom_labels, coords, bond_scale=1.2):
+    """Finds all pairs of atoms closer than bond_scale times the sum of their covalent radii.
+
+    Atoms are binned into a cell list with cells as wide as the longest possible bond,
+    so each atom only has to be compared against the atoms in its own and neighboring cells.
+    All of the cells are handled at once by padding every cell to the largest occupancy,
+    which keeps the cost linear in the number of atoms. Only occupied cells are stored, so a sparse
+    system with a large bounding box, e.g. a few molecules far apart, costs no more than a dense one.
+
+    Args:
+        atom_labels (list): element symbol of each atom
+        coords   (ndarray): Nx3 array of cartesian coordinates in angstrom
+        bond_scale (float): scaling of the covalent radii which decides what counts as a bond
+    Returns:
+        ndarray: Mx2 array of the indices of bonded atoms, with i < j in every row
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    natoms = len(coords)
+    if natoms < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    radii = get_covalent_radii(atom_labels) * bond_scale
+    cell_size = 2.0 * np.max(radii)
+
+    # number the cells of a grid padded by one empty layer on every side,
+    # so neighbor lookups never have to check the edges of the grid
+    cell_coords = np.floor((coords - coords.min(axis=0)) / cell_size).astype(np.int64) + 1
+    grid_shape = cell_coords.max(axis=0) + 2
+    cell_ids = np.ravel_multi_index(cell_coords.T, grid_shape)
+
+    order = np.argsort(cell_ids, kind='stable')
+    sorted_ids = cell_ids[order]
+    occupied, first_atom, occupancy = np.unique(sorted_ids, return_index=True, return_counts=True)
+    max_occupancy = np.max(occupancy)
+
+    # cell_atoms[c, k] is the kth atom in occupied cell c, or -1
+    slot = np.arange(natoms) - np.repeat(first_atom, occupancy)
+    cell_atoms = np.full((len(occupied), max_occupancy), -1, dtype=np.int64)
+    cell_atoms[np.repeat(np.arange(len(occupied)), occupancy), slot] = order
+    strides = np.array([grid_shape[1] * grid_shape[2], grid_shape[2], 1])
+    # each pair of neighboring cells only needs to be visited once, so only take half of the offsets
+    offsets = [np.array(offset) for offset in itertools.product((-1, 0, 1), repeat=3) if offset > (0, 0, 0)]
+
+    bonds = []
+    for offset in [np.zeros(3, dtype=np.int64)] + offsets:
+        # occupied is sorted, so the neighboring cell is found by binary search rather than in a table over the whole grid
+        neighbor_ids = occupied + np.dot(strides, offset)
+        neighbor_cells = np.minimum(np.searchsorted(occupied, neighbor_ids), len(occupied) - 1)
+        has_neighbor = occupied[neighbor_cells] == neighbor_ids
+        atoms_i = cell_atoms[has_neighbor][:, :, np.newaxis]
+        atoms_j = cell_atoms[neighbor_cells[has_neighbor]][:, np.newaxis, :]
+        atoms_i, atoms_j = np.broadcast_arrays(atoms_i, atoms_j)
+        valid = (atoms_i >= 0) & (atoms_j >= 0)
+        if not offset.any():
+            valid &= atoms_i < atoms_j
+        i = atoms_i[valid]
+        j = atoms_j[valid]
+        distances = np.linalg.norm(coords[i] - coords[j], axis=1)
+        bonded = distances < radii[i] + radii[j]
+        bonds.append(np.stack((np.minimum(i, j)[bonded], np.maximum(i, j)[bonded]), axis=1))
+    return np.concatenate(bonds)
+
+def find_molecules(atom_labels, coords, bond_scale=1.2):
+    """Splits a system into molecules, i.e. the connected components of the covalent bonding graph.
+
+    Returns:
+        list of ndarray: the (sorted) atom indices of each molecule, ordered by their first atom.
+    """
+    natoms = len(coords)
+    bonds = find_bonds(atom_labels, coords, bond_scale)
+    # scipy.sparse.csgraph is slow to import and only needed here
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    graph = coo_matrix((np.ones(len(bonds)), (bonds[:, 0], bonds[:, 1])), shape=(natoms, natoms))
+    nmolecules, molecule_of_atom = connected_components(graph, directed=False)
+
+    order = np.argsort(molecule_of_atom, kind='stable')
+    molecules = np.split(order, np.cumsum(np.bincount(molecule_of_atom, minlength=nmolecules))[:-1])
+    molecules.sort(key=lambda molecule: molecule[0])
+    return molecules
+
+def group_molecules(molecules, coords, molecules_per_fragment: int):
+    """Greedily groups molecules into fragments of molecules_per_fragment molecules. Starting from
+    the first molecule which is not in a fragment yet, its nearest unassigned neighbors (by centroid distance)
+    are added to its fragment. The last fragment may be smaller if the molecules don't divide evenly.
+
+    The neighbors come from a k-d tree of the centroids, which is asked for more of them until enough are
+    unassigned. Once half of the molecules in the tree are assigned, it is rebuilt over the unassigned ones,
+    so the nearest molecules are rarely all taken already.
+
+    Returns:
+        list of ndarray: the atom indices of each fragment
+    """
+    if molecules_per_fragment <= 1:
+        return molecules
+    # scipy.spatial is slow to import and only needed here
+    from scipy.spatial import cKDTree
+    centroids = np.array([np.mean(coords[molecule], axis=0) for molecule in molecules])
+    unassigned = np.ones(len(molecules), dtype=bool)
+    nunassigned = len(molecules)
+    tree_molecules = np.arange(len(molecules))
+    tree = cKDTree(centroids)
+    fragments = []
+    for seed in range(len(molecules)):
+        if not unassigned[seed]:
+            continue
+        if 2 * nunassigned <= len(tree_molecules):
+            tree_molecules = np.flatnonzero(unassigned)
+            tree = cKDTree(centroids[tree_molecules])
+        k = molecules_per_fragment
+        while True:
+            k = min(k, len(tree_molecules))
+            distances, neighbors = tree.query(centroids[seed], k=k)
+            distances, neighbors = np.atleast_1d(distances), tree_molecules[np.atleast_1d(neighbors)]
+            free = unassigned[neighbors]
+            if np.count_nonzero(free) >= molecules_per_fragment or k == len(tree_molecules):
+                break
+            k *= 2
+        candidates, distances = neighbors[free], distances[free]
+        # ties in distance go to the lower index
+        members = np.sort(candidates[np.lexsort((candidates, distances))][:molecules_per_fragment])
+        unassigned[members] = False
+        nunassigned -= len(members)
+        fragments.append(np.concatenate([molecules[member] for member in members]))
+    return fragments
+
+def fragment_by_connectivity(atom_labels, coords, molecules_per_fragment=1, bond_scale=1.2):
+    """Returns the atom indices of each fragment of a system which has not been fragmented by hand.
+
+    Args:
+        atom_labels            (list): element symbol of each atom
+        coords              (ndarray): Nx3 array of cartesian coordinates in angstrom
+        molecules_per_fragment  (int): number of molecules grouped into each fragment
+        bond_scale            (float): scaling of the covalent radii which decides what counts as a bond
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    molecules = find_molecules(atom_labels, coords, bond_scale)
+    return group_molecules(molecules, coords, molecules_per_fragment)
@@ -0,0 +1,73 @@
+import numpy as np
+from .Integrator import Integrator, ANGSTROM_TO_BOHR, FS_TO_AU_TIME
+from .read_geometries import Trajectory_Writer
+
+# boltzmann constant in hartree / kelvin
+KB_HARTREE = 3.166811563e-6
+
+class Dynamics:
+    """
+    Runs molecular dynamics with any Integrator, e.g. Velocity_Verlet on an MBE potential
+    or RESPA with the low orders of the MBE as the fast forces.
+    """
+    def __init__(self, integrator: Integrator, positions, velocities=None, temperature=None, trajectory_file=None, write_every=1, seed=None):
+        """
+        Args:
+            integrator  (Integrator): takes the steps
+            positions      (ndarray): Nx3 initial coordinates in angstrom
+            velocities     (ndarray): Nx3 initial velocities in bohr / a.u. time. Overrides temperature.
+            temperature      (float): draw initial velocities from a Maxwell-Boltzmann distribution at this temperature (K)
+            trajectory_file    (str): if given, write every write_every-th geometry here with its energies
+            write_every        (int): how often to write the geometry
+            seed               (int): seed for the initial velocities
+        """
+        self.integrator = integrator
+        self.positions = np.array(positions, dtype=np.float64).reshape(-1, 3) * ANGSTROM_TO_BOHR
+        if velocities is not None:
+            self.velocities = np.array(velocities, dtype=np.float64).reshape(self.positions.shape)
+        elif temperature is not None:
+            self.velocities = self.maxwell_boltzmann_velocities(temperature, seed)
+        else:
+            self.velocities = np.zeros_like(self.positions)
+        self.trajectory_file = trajectory_file
+        self.write_every = write_every
+        self.time = 0.0 # fs
+        self.energies = [] # (time in fs, potential energy, kinetic energy) after each step
+
+    def maxwell_boltzmann_velocities(self, temperature, seed=None):
+        """Draws velocities at temperature and removes the center of mass motion."""
+        rng = np.random.default_rng(seed)
+        masses = self.integrator.masses[:, np.newaxis]
+        velocities = rng.normal(size=self.positions.shape) * np.sqrt(KB_HARTREE * temperature / masses)
+        velocities -= np.sum(masses * velocities, axis=0) / np.sum(masses)
+        return velocities
+
+    def temperature(self):
+        """Instantaneous temperature in K, ignoring the 3 center of mass degrees of freedom."""
+        dof = max(1, 3 * len(self.positions) - 3)
+        return 2.0 * self.integrator.kinetic_energy(self.velocities) / (dof * KB_HARTREE)
+
+    def run(self, nsteps: int):
+        """
+        Takes nsteps steps of the integrator. For RESPA a step is one outer step.
+        Returns the positions in angstrom at the end.
+        """
+        writer = None
+        if self.trajectory_file is not None:
+            writer = Trajectory_Writer(self.trajectory_file, mode='a' if self.energies else 'w', background=True)
+        # the time covered by one call to step()
+        step_time = self.integrator.dt / FS_TO_AU_TIME * getattr(self.integrator, "n_inner", 1)
+        try:
+            for step in range(nsteps):
+                self.positions, self.velocities = self.integrator.step(self.positions, self.velocities)
+                self.time += step_time
+                potential_energy = self.integrator.potential_energy
+                kinetic_energy = self.integrator.kinetic_energy(self.velocities)
+                self.energies.append((self.time, potential_energy, kinetic_energy))
+                if writer is not None and (step + 1) % self.write_every == 0:
+                    writer.write(self.integrator.atom_labels, self.positions / ANGSTROM_TO_BOHR, f"time={self.time:.4f}",
+                                 energy=potential_energy, info={"kinetic_energy": kinetic_energy})
+        finally:
+            if writer is not None:
+                writer.close()
+        return self.positions / ANGSTROM_TO_BOHR
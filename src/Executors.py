@@ -0,0 +1,187 @@
+from multiprocessing.pool import ThreadPool
+from .Pools import pool_registry, acquire_pool, release_pool
+
+__all__ = ['Executor', 'Serial_Executor', 'Process_Executor', 'Thread_Executor', 'Futures_Executor', 'serial_executor']
+
+class Completed_Result:
+    """Handle of work which already ran, with the same get() as multiprocessing's AsyncResult."""
+    def __init__(self, value):
+        self.value = value
+
+    def get(self, timeout=None):
+        return self.value
+
+class Futures_Result:
+    """Handle of work submitted to a concurrent.futures executor. get() waits for every future in order."""
+    def __init__(self, futures, single=False):
+        self.futures = futures
+        self.single = single
+
+    def get(self, timeout=None):
+        results = [future.result(timeout) for future in self.futures]
+        return results[0] if self.single else results
+
+class Executor:
+    """
+    Runs the tasks of the MBE potentials. Every evaluate path hands its work to an executor through
+    the same contract, so a new parallel backend only has to implement this class:
+
+        starmap_async(function, arguments) queues function(*args) for every tuple in arguments and returns
+                                           a handle whose get() returns the list of results, in order
+        apply_async(function, args)        queues a single call and returns a handle whose get() returns its result
+        map(function, tasks)               evaluates function on every task and returns the list of results
+
+    Handles may be collected in any order, so several evaluations can be in flight at once.
+    Functions and arguments must be picklable for executors which run them in other processes.
+
+    nworkers is how many tasks run at once. get_nchunks() uses it to decide how finely the
+    MBE splits its n-mers into the batches that are summed on the workers.
+    """
+    nworkers = 1
+
+    def starmap_async(self, function, arguments):
+        raise NotImplementedError
+
+    def apply_async(self, function, args=()):
+        raise NotImplementedError
+
+    def map(self, function, tasks):
+        return self.starmap_async(function, [(task,) for task in tasks]).get()
+
+    def get_nchunks(self, nitems, chunks_per_worker):
+        """Number of batches to split nitems tasks into."""
+        return max(1, min(nitems, self.nworkers * chunks_per_worker))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class Serial_Executor(Executor):
+    """Runs everything immediately in the calling process. This is what the serial evaluate paths use."""
+    def starmap_async(self, function, arguments):
+        return Completed_Result([function(*args) for args in arguments])
+
+    def apply_async(self, function, args=()):
+        return Completed_Result(function(*args))
+
+    def map(self, function, tasks):
+        return [function(task) for task in tasks]
+
+    def get_nchunks(self, nitems, chunks_per_worker):
+        # batches only matter for load balancing, so a single one saves the partial sums
+        return 1
+
+serial_executor = Serial_Executor()
+
+class Process_Executor(Executor):
+    """
+    Runs tasks on a multiprocessing pool from the shared pool registry, see Pools.py.
+    The pool is only acquired on first use, and executors which ask for the same
+    configuration share the same pool.
+    """
+    def __init__(self, nproc, threads_per_worker=None, cpu_sets=None):
+        """
+        Args:
+            nproc              (int): number of worker processes
+            threads_per_worker (int): BLAS/OpenMP threads per worker, None leaves the defaults
+            cpu_sets                : core sets the workers are pinned to, or 'auto'. See Pools.get_core_sets().
+        """
+        self.nproc = nproc
+        self.nworkers = nproc
+        self.threads_per_worker = threads_per_worker
+        self.cpu_sets = cpu_sets
+        self._pool = None
+
+    @property
+    def pool(self):
+        # the registry may have shut the pool down underneath us, e.g. at the end of a with-block
+        if self._pool is None or not pool_registry.holds(self._pool):
+            self._pool = acquire_pool(self.nproc, threads_per_worker=self.threads_per_worker, cpu_sets=self.cpu_sets)
+        return self._pool
+
+    def starmap_async(self, function, arguments):
+        return self.pool.starmap_async(function, arguments)
+
+    def apply_async(self, function, args=()):
+        return self.pool.apply_async(function, tuple(args))
+
+    def map(self, function, tasks):
+        return self.pool.map(function, tasks)
+
+    def close(self):
+        """Hands the pool back to the registry, which shuts it down once nothing else uses it."""
+        if self._pool is not None and pool_registry.holds(self._pool):
+            release_pool(self._pool)
+        self._pool = None
+
+    def __getstate__(self):
+        d = dict(self.__dict__)
+        d['_pool'] = None
+        return d
+
+class Thread_Executor(Executor):
+    """
+    Runs tasks on a pool of threads in this process. Nothing is pickled, so this suits ASE calculators which
+    run an external program and wait on it without holding the GIL. Pure python potentials gain nothing,
+    and a compiled potential only gains if its library releases the GIL and is thread-safe. Fortran and C
+    potentials often keep global state, and TTM even changes the working directory, so check a threaded
+    evaluation against a serial one before relying on it, and use a Process_Executor otherwise.
+    Threads share the potential, so an ASE MBE needs a calculator per n-mer, e.g. from NMer_Warm_Start.
+    """
+    def __init__(self, nthreads):
+        self.nworkers = nthreads
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPool(self.nworkers)
+        return self._pool
+
+    def starmap_async(self, function, arguments):
+        return self.pool.starmap_async(function, arguments)
+
+    def apply_async(self, function, args=()):
+        return self.pool.apply_async(function, tuple(args))
+
+    def map(self, function, tasks):
+        return self.pool.map(function, tasks)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __getstate__(self):
+        d = dict(self.__dict__)
+        d['_pool'] = None
+        return d
+
+class Futures_Executor(Executor):
+    """
+    Runs tasks on any concurrent.futures executor, e.g. a ProcessPoolExecutor, an MPIPoolExecutor
+    from mpi4py or a dask client's executor. The executor is shut down by close().
+    """
+    def __init__(self, executor, nworkers=None):
+        """
+        Args:
+            executor      : a concurrent.futures.Executor
+            nworkers (int): number of tasks it runs at once, read from the executor if possible
+        """
+        self.executor = executor
+        self.nworkers = nworkers or getattr(executor, "_max_workers", 1)
+
+    def starmap_async(self, function, arguments):
+        return Futures_Result([self.executor.submit(function, *args) for args in arguments])
+
+    def apply_async(self, function, args=()):
+        return Futures_Result([self.executor.submit(function, *args)], single=True)
+
+    def close(self):
+        self.executor.shutdown()
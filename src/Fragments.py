@@ -2,17 +2,85 @@ import numpy as np
 from tempfile import NamedTemporaryFile
 from ase.atoms import Atoms
 import itertools
+from .read_geometries import read_geoms, format_frame
+from .Connectivity import fragment_by_connectivity
 
 class Fragments:
     def __init__(self, xyz_file, calculator):
         self.xyz_file = xyz_file
-        header, self.atom_labels, self.fragment_coords = self.get_fragments_from_xyz_file()
+        self.header, atom_labels, fragment_coords = self.get_fragments_from_xyz_file()
+        self.set_fragments(atom_labels, fragment_coords, calculator)
+
+    @classmethod
+    def from_connectivity(cls, xyz_file, calculator, molecules_per_fragment=1, bond_scale=1.2, frame=0):
+        """Builds Fragments from an xyz file without '--' delimiters by finding the molecules
+        from covalent bonding. See from_geometry() for the arguments.
+
+        Args:
+            frame (int): which geometry of a multi-geometry xyz file to fragment
+        """
+        header, labels, coords = read_geoms(xyz_file)
+        fragments = cls.from_geometry(labels[frame], coords[frame], calculator, molecules_per_fragment, bond_scale)
+        fragments.xyz_file = xyz_file
+        fragments.header = [header[frame]]
+        return fragments
+
+    @classmethod
+    def from_geometry(cls, atom_labels, coords, calculator, molecules_per_fragment=1, bond_scale=1.2):
+        """Builds Fragments from the labels and coordinates of an unfragmented system, e.g. a frame
+        of a trajectory. Atoms closer than bond_scale times the sum of their covalent radii are bonded,
+        each molecule becomes a fragment, and molecules_per_fragment > 1 groups neighboring molecules
+        into larger fragments.
+
+        The atoms of each fragment are stored contiguously, so if the molecules were not contiguous
+        in the input, self.atom_order gives the input index of each atom of the fragmented system.
+
+        Args:
+            atom_labels             (list): element symbol of each atom
+            coords               (ndarray): Nx3 array of cartesian coordinates in angstrom
+            calculator                    : ASE calculator attached to each fragment (may be None)
+            molecules_per_fragment   (int): number of molecules grouped into each fragment
+            bond_scale             (float): scaling of the covalent radii which decides what counts as a bond
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        fragment_indices = fragment_by_connectivity(atom_labels, coords, molecules_per_fragment, bond_scale)
+
+        fragments = cls.__new__(cls)
+        fragments.xyz_file = None
+        fragments.header = [str(len(coords)) + '\n\n']
+        fragments.set_fragments([[atom_labels[i] for i in indices] for indices in fragment_indices],
+                                [coords[indices] for indices in fragment_indices], calculator)
+        fragments.atom_order = np.concatenate(fragment_indices)
+        return fragments
+
+    def set_fragments(self, atom_labels, fragment_coords, calculator):
+        """Sets up the Atoms object of every fragment from its labels and coordinates.
+
+        Args:
+            atom_labels         (list): list of the atom labels of each fragment
+            fragment_coords     (list): list of the Mx3 coordinates of each fragment
+            calculator              : ASE calculator attached to each fragment
+        """
+        self.atom_labels = atom_labels
+        if len(set(len(labels) for labels in atom_labels)) == 1:
+            self.fragment_coords = np.array(fragment_coords, dtype=np.float64)
+        else:
+            self.fragment_coords = [np.asarray(coords, dtype=np.float64) for coords in fragment_coords]
         self.flattened_atom_labels = list(itertools.chain(*self.atom_labels))
+        self.atom_order = np.arange(len(self.flattened_atom_labels))
         self.fragments = [Atoms(self.atom_labels[i], self.fragment_coords[i]) for i in range(len(self.atom_labels))]
 
         for frag in self.fragments:
             frag.calc = calculator
 
+        # n-mers kept by get_nmer() belong to the old fragments
+        if getattr(self, "nmer_store", None) is not None:
+            self.nmer_store = {}
+
+        # an NMer_Warm_Start giving each n-mer its own calculator; it has to check the new fragments
+        if getattr(self, "nmer_calculators", None) is not None:
+            self.nmer_calculators.attach(self)
+
     def fragment_geometry(self, geometry):
         """Takes an array of cartesian coordinates and splits it into fragments
         according to the shape of self.fragments.
@@ -20,7 +88,8 @@ class Fragments:
         Args:
             geometry (ndarray): Nx3 array of cartesian coordinates
         """
-        fragmented_geom = np.reshape(geometry, self.fragment_coords.shape)
+        fragment_sizes = [len(labels) for labels in self.atom_labels]
+        fragmented_geom = np.split(np.reshape(geometry, (-1, 3)), np.cumsum(fragment_sizes)[:-1])
         [self.fragments[i].set_chemical_symbols(self.atom_labels[i]) for i in range(len(self.atom_labels))]
         [self.fragments[i].set_positions(fragmented_geom[i]) for i in range(len(self.atom_labels))]
 
@@ -56,15 +125,8 @@ class Fragments:
         combinations = list(itertools.combinations(fragment_index_array, i_order))
 
         # this tells you the number of atoms which appear before the nth fragment begins,
-        # so basically the size of all preceding fragments. This is kind of ugly, but
-        # I don't see a simpler way to do this.
-        distance_to_nth_fragment = []
-        distance_until_now = 0
-        for i, frag in enumerate(self.fragments):
-            if i-1 > -1:
-                distance_until_now = distance_to_nth_fragment[i-1]
-            distance_to_nth_fragment.append(frag.get_positions().shape[0] + distance_until_now)
-            distance_to_nth_fragment[i] -= distance_to_nth_fragment[0]
+        # so basically the size of all preceding fragments.
+        distance_to_nth_fragment = [0] + list(np.cumsum([len(frag) for frag in self.fragments])[:-1])
 
         atom_index_array = []
         for fragment_indices in combinations:
@@ -74,6 +136,15 @@ class Fragments:
 
         return atom_index_array
 
+    def get_fragment_combinations(self, i_order: int):
+        """Returns a list of tuples of the fragment indices making up each n-mer of order i_order,
+        in the same order as make_nmers() and get_indices_for_fragment_combination().
+
+        Args:
+            i_order       (int): order of the mbe we're currently working on
+        """
+        return list(itertools.combinations(range(len(self.fragments)), i_order))
+
     def make_nmers(self, mbe_order):
         """Returns a list of Atoms objects of all n-mers of order mbe_order.
 
@@ -82,10 +153,64 @@ class Fragments:
         Args:
             mbe_order (int): Order of the mbe to form nmers of (monomers, dimers, etc.)
         """
-        combinations = list(itertools.combinations(self.fragments, mbe_order))
-        for i, atoms_objects in enumerate(combinations):
-            combinations[i] = self.merge_atoms_objects(atoms_objects)
-        return combinations
+        return self.make_nmers_from_combinations(self.get_fragment_combinations(mbe_order))
+
+    def make_nmers_from_combinations(self, combinations):
+        """Returns a list of Atoms objects of the n-mers made from the given fragments only.
+        If an NMer_Warm_Start is attached, each n-mer gets its own calculator from it.
+
+        Args:
+            combinations (list): list of tuples of fragment indices, e.g. [(0, 1), (0, 4, 7)]
+        """
+        nmers = [self.get_nmer(fragment_indices) for fragment_indices in combinations]
+        nmer_calculators = getattr(self, "nmer_calculators", None)
+        if nmer_calculators is not None:
+            for fragment_indices, nmer in zip(combinations, nmers):
+                nmer.calc = nmer_calculators.get_calculator(tuple(fragment_indices))
+        return nmers
+
+    def keep_nmers(self):
+        """Makes get_nmer() build each n-mer's Atoms once and reuse it, updating its positions in place,
+        until the fragments change. Calculators can then reuse their results for n-mers which didn't move.
+        Every n-mer that gets made is kept, so this is meant for expansions with few n-mers, such as QM ones.
+        """
+        if getattr(self, "nmer_store", None) is None:
+            self.nmer_store = {}
+
+    def get_nmer(self, fragment_indices):
+        """Returns the Atoms of the n-mer made from fragment_indices at the current fragment positions.
+        If keep_nmers() was called, this is the same object on every call.
+
+        Args:
+            fragment_indices (tuple): indices of the fragments making up the n-mer
+        """
+        nmer_store = getattr(self, "nmer_store", None)
+        if nmer_store is None:
+            return self.merge_atoms_objects([self.fragments[i] for i in fragment_indices])
+
+        fragment_indices = tuple(fragment_indices)
+        nmer = nmer_store.get(fragment_indices)
+        if nmer is None:
+            nmer = self.merge_atoms_objects([self.fragments[i] for i in fragment_indices])
+            nmer_store[fragment_indices] = nmer
+        else:
+            positions = nmer.positions
+            start = 0
+            for i in fragment_indices:
+                end = start + len(self.fragments[i])
+                positions[start:end] = self.fragments[i].positions
+                start = end
+        return nmer
+
+    def get_atom_indices(self, fragment_indices):
+        """Returns the atom indices into the total system of the n-mer made from fragment_indices.
+
+        Args:
+            fragment_indices (tuple): indices of the fragments making up the n-mer
+        """
+        fragment_sizes = [len(labels) for labels in self.atom_labels]
+        offsets = np.cumsum([0] + fragment_sizes)
+        return [atom for i in fragment_indices for atom in range(offsets[i], offsets[i] + fragment_sizes[i])]
 
     @staticmethod
     def merge_atoms_objects(atoms_list):
@@ -146,11 +271,7 @@ class Fragments:
         Writes the the molecules to stdout in xyz format if no ofile is specified.
         Otherwise, write the geometries to ofile.
         """
-        output = str(self.header[0]).rstrip('\n') + '\n' + str(optional_output) + '\n'
-        for i in range(len(self.fragments)):
-            for j in range(len(self.fragments[i])):
-                output += (self.atom_labels[i*len(self.fragments[i]) + j] + " " +
-                        np.array2string(np.array(self.fragments[i][j]), precision=14, separator=' ', suppress_small=True).strip('[]') + '\n')
+        output = format_frame(self.flattened_atom_labels, np.vstack([frag.get_positions() for frag in self.fragments]), str(optional_output))
         if ofile is None:
             print(output)
         else:
@@ -158,10 +279,7 @@ class Fragments:
                 f.write(output)
     
     def write_single_geometry(self, geometry, ofile=None):
-        output = str(len(geometry)).rstrip('\n') + '\n' + '\n'
-        for i in range(len(geometry)):
-            output += (self.atom_labels[i] + " " +
-                    np.array2string(np.array(geometry[i]), precision=14, separator=' ', suppress_small=True).strip('[]') + '\n')
+        output = format_frame(self.flattened_atom_labels, geometry)
         if ofile is None:
             print(output)
         else:
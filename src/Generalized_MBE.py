@@ -0,0 +1,86 @@
+import numpy as np
+import itertools
+import sys
+
+__all__ = ['get_neighbor_groups', 'get_generalized_subsystems']
+
+def get_neighbor_groups(distances, nneighbors=1, cutoff=None):
+    """
+    Returns overlapping fragments made of each fragment and its nneighbors nearest fragments,
+    as sorted tuples of fragment indices. Groups which come out the same are only kept once.
+
+    Args:
+        distances (ndarray): NxN distances between the fragments, e.g. MBE_Potential.get_fragment_distances()
+        nneighbors    (int): number of neighbors grouped with each fragment
+        cutoff      (float): if given, neighbors further than this are left out of the group
+    """
+    groups = set()
+    for i, row in enumerate(np.asarray(distances)):
+        neighbors = [j for j in np.argsort(row, kind='stable') if j != i][:nneighbors]
+        if cutoff is not None:
+            neighbors = [j for j in neighbors if row[j] <= cutoff]
+        groups.add(tuple(sorted(int(j) for j in [i] + neighbors)))
+    return sorted(groups)
+
+def get_generalized_subsystems(overlapping_fragments, order=1, nfragments=None):
+    """
+    Returns the subsystems of the generalized MBE over overlapping fragments and their coefficients.
+
+    The n-mers of the expansion are the unions of every order of the overlapping fragments. Their union is
+    the whole system, so by inclusion-exclusion its energy is
+        E = sum over nonempty sets A of n-mers of (-1)^(|A|+1) E(intersection of A).
+    Many sets A share the same intersection, so the terms are grouped by distinct intersection T,
+    whose coefficient c(T) follows from every T being covered exactly once,
+        c(T) = 1 - sum of c(U) over the distinct intersections U which strictly contain T,
+    and each distinct subsystem is only evaluated once. For disjoint fragments this is the usual MBE.
+    This only holds if the overlapping fragments cover the whole system, so given nfragments, it exits
+    unless every fragment is in one of them.
+
+    Args:
+        overlapping_fragments (list): tuples of the (disjoint) fragment indices making up each overlapping fragment
+        order                  (int): number of overlapping fragments joined into each n-mer
+        nfragments             (int): number of fragments in the whole system, to check they're all covered
+    Returns:
+        list of (tuple of fragment indices, coefficient) with nonzero coefficients, largest subsystems first
+    """
+    overlapping_fragments = [frozenset(fragment) for fragment in overlapping_fragments]
+    if nfragments is not None:
+        covered = frozenset().union(*overlapping_fragments)
+        missing = sorted(set(range(nfragments)) - covered)
+        unknown = sorted(i for i in covered if not 0 <= i < nfragments)
+        if missing or unknown:
+            print(f"The overlapping fragments must cover every one of the {nfragments} fragments and nothing else. "
+                  f"Fragments not covered: {missing}. Indices which aren't fragments: {unknown}.")
+            sys.exit(1)
+    nmers = {frozenset().union(*combination) for combination in itertools.combinations(overlapping_fragments, order)}
+
+    # which n-mers contain each fragment, so only n-mers which overlap are intersected
+    containing = {}
+    for nmer in nmers:
+        for i in nmer:
+            containing.setdefault(i, set()).add(nmer)
+
+    subsystems = set(nmers)
+    frontier = set(nmers)
+    while frontier:
+        new_subsystems = set()
+        for subsystem in frontier:
+            for nmer in set().union(*(containing[i] for i in subsystem)):
+                intersection = subsystem & nmer
+                if intersection and intersection not in subsystems:
+                    new_subsystems.add(intersection)
+        subsystems |= new_subsystems
+        frontier = new_subsystems
+
+    # each subsystem's strict supersets are bigger, so working from the biggest down they're all known
+    subsystems_containing = {}
+    coefficients = {}
+    for subsystem in sorted(subsystems, key=len, reverse=True):
+        # the supersets of subsystem all contain its rarest fragment
+        rarest = min(subsystem, key=lambda i: len(subsystems_containing.get(i, ())))
+        supersets = [other for other in subsystems_containing.get(rarest, ()) if subsystem < other]
+        coefficients[subsystem] = 1 - sum(coefficients[other] for other in supersets)
+        for i in subsystem:
+            subsystems_containing.setdefault(i, []).append(subsystem)
+    return [(tuple(sorted(subsystem)), coefficient) for subsystem, coefficient in
+            sorted(coefficients.items(), key=lambda item: (-len(item[0]), sorted(item[0]))) if coefficient != 0]
@@ -1,10 +1,32 @@
 from .Fragments import Fragments
 from .Potential import *
 from .MBE_Potential import MBE_Potential
-from .Compute_Hessian import Hessian
 import numpy as np
 import sys, time
 
+class Hessian:
+    """Central finite difference Hessian of a potential_function, taken as the derivative of the
+    gradient newtons_method steps along (the second output divided by 1.88973) with respect to the
+    flattened geometry.
+    """
+    def __init__(self, potential_function, step=10**-4):
+        self.potential_function = potential_function
+        self.step = step
+
+    def evaluate(self, flat_geometry, shape=None):
+        flat_geometry = np.asarray(flat_geometry, dtype=np.float64)
+        shape = (-1, 3) if shape is None else shape
+        hessian = np.zeros((flat_geometry.size, flat_geometry.size))
+        for i in range(flat_geometry.size):
+            displaced = np.copy(flat_geometry)
+            displaced[i] += self.step
+            _, forward = self.potential_function(np.reshape(displaced, shape))
+            displaced[i] -= 2 * self.step
+            _, backward = self.potential_function(np.reshape(displaced, shape))
+            hessian[:, i] = (np.ravel(forward) - np.ravel(backward)) / 1.88973 / (2 * self.step)
+        # symmetrize away the finite difference noise
+        return 0.5 * (hessian + hessian.T)
+
 class Optimize:
     """Simple gradient descent implementation which works by taking a potential_function
     and following the gradient until certain convergence criteria are met.
@@ -48,7 +70,7 @@ class Optimize:
         hessian_calculator = Hessian(self.potential_function)
         old_energy, gradients = self.potential_function(np.reshape(geometry, self.initial_geometry.shape))
         for iteration in range(self.max_iterations):
-            hessian = hessian_calculator.evaluate(geometry)
+            hessian = hessian_calculator.evaluate(geometry, self.initial_geometry.shape)
             inverted_hessian = np.linalg.inv(hessian)
             geometry -= step_size * np.dot(inverted_hessian, gradients.flatten() / 1.88973)
             if abs(self.delta_energy) > self.max_delta_energy or self.current_max_force > self.max_force or self.current_rms_force > self.max_rms_force:
@@ -10,6 +10,17 @@ from .Fragments import Fragments
 from .Potential import *
 from .MBE_Potential import MBE_Potential
 from .read_geometries import read_geoms
+from .Pools import acquire_pool, release_pool
+
+def evaluate_displacements(potential, eqGeom, dx, displacements):
+    """Evaluates potential on the geometries given by the rows of displacements,
+    (first coordinate, steps of dx, second coordinate, steps of dx), applied to eqGeom.
+    Lives at module level so that it can be sent to worker processes."""
+    rows = np.arange(len(displacements))
+    cds = np.tile(np.ravel(eqGeom), (len(displacements), 1))
+    cds[rows, displacements[:, 0]] += displacements[:, 1] * dx
+    cds[rows, displacements[:, 2]] += displacements[:, 3] * dx
+    return np.asarray(potential(cds.reshape((len(displacements),) + np.shape(eqGeom))))
 
 class Constants:
     """Helps me keep track of constants and conversions,
@@ -40,13 +51,15 @@ class Constants:
         return m
 
 class HarmonicAnalysis:
-    def __init__(self,eqGeom,atoms,potential,dx=1.0e-3,ofile=None):
+    def __init__(self,eqGeom,atoms,potential,dx=1.0e-3,ofile=None,nproc=1,batch_size=1024):
         self.eqGeom = eqGeom
         self.atoms = atoms
         self.potential = potential
         self.dx = dx
         self.ofile=ofile
         self.nEls = 3 * len(self.atoms)
+        self.nproc = nproc # processes evaluating the batches of displaced geometries in genHess
+        self.batch_size = batch_size # number of displaced geometries passed to the potential at once
 
     def genStencil(self,dispTup,dim):
         cds = self.eqGeom
@@ -106,27 +119,134 @@ class HarmonicAnalysis:
             der = (stencil.dot(wts[0])).dot(wts[1])
             return der
 
+    def genDisplacements(self, pairs=None):
+        """Returns every displaced geometry genHess needs, once, as rows of
+        (first coordinate, steps of dx, second coordinate, steps of dx).
+        Row 0 is the undisplaced geometry, then -2dx, -dx, dx, 2dx for each coordinate,
+        then the (-,-), (-,+), (+,-), (+,+) corners for each pair of coordinates in
+        upper triangle order, or in the order of pairs = (first, second) if given.
+        The other points of the 9-point stencil have zero weight."""
+        coords = np.arange(self.nEls)
+        first, second = np.triu_indices(self.nEls, 1) if pairs is None else pairs
+        nPairs = len(first)
+        center = np.zeros((1, 4), dtype=int)
+        single = np.column_stack((np.repeat(coords, 4), np.tile([-2, -1, 1, 2], self.nEls),
+                                  np.zeros(4 * self.nEls, dtype=int), np.zeros(4 * self.nEls, dtype=int)))
+        pairs = np.column_stack((np.repeat(first, 4), np.tile([-1, -1, 1, 1], nPairs),
+                                 np.repeat(second, 4), np.tile([-1, 1, -1, 1], nPairs)))
+        return np.vstack((center, single, pairs))
+
+    def evaluateDisplacements(self, displacements):
+        """Evaluates the potential on all displacements in batches of self.batch_size,
+        spread over self.nproc processes if nproc > 1."""
+        batches = [displacements[i:i + self.batch_size] for i in range(0, len(displacements), self.batch_size)]
+        if self.nproc > 1 and len(batches) > 1:
+            pool = acquire_pool(self.nproc)
+            try:
+                energies = pool.starmap(evaluate_displacements, [(self.potential, self.eqGeom, self.dx, batch) for batch in batches])
+            finally:
+                release_pool(pool)
+        else:
+            energies = [evaluate_displacements(self.potential, self.eqGeom, self.dx, batch) for batch in batches]
+        return np.concatenate(energies)
+
     def genHess(self):
-        nAtoms = len(self.atoms)
+        """Energy-only finite difference Hessian. Each unique displaced geometry is evaluated
+        once and the 5-point (diagonal) and 9-point (off-diagonal) stencils are read from the table."""
+        dx = self.dx
+        energies = self.evaluateDisplacements(self.genDisplacements())
         hess = np.zeros((self.nEls,self.nEls))
+
         ###### Off Diagonals #############
-        d=np.ravel_multi_index(np.array((np.triu_indices(nAtoms*3, 1))),[nAtoms*3,nAtoms*3]) #indexing nonsense
-        atmInfo = np.array((np.unravel_index(d, (nAtoms, 3, nAtoms, 3)))).T #indexing nonsense (getting the upper indices of a 4D array for all my displacements)
-        #atmInfo has information (cd1,atm1,cd2,atm2) which tells the stencil function which atom and dimension to displace
-        offDiags = list(itt.combinations(np.arange(self.nEls),2)) #indices of upper triangle of hessian
-        for k in range(len(offDiags)):
-            stencil = self.genStencil(atmInfo[k],dim=2)
-            hess[offDiags[k]] = self.finiteDiff(stencil,dim=2)
+        corners = energies[1 + 4 * self.nEls:].reshape(-1, 4)
+        hess[np.triu_indices(self.nEls, 1)] = (corners[:, 0] - corners[:, 1] - corners[:, 2] + corners[:, 3]) / (4.0 * dx**2)
         hess = hess+hess.T #hessian is symmetric matrix
 
         ###### On Diagonals #############
-        s = [np.arange(nAtoms),np.arange(3)]
-        atmInfo = list(itt.product(*s))
-        for onDiags in range(self.nEls):
-            stencil1D = self.genStencil(atmInfo[onDiags],dim=1)
-            hess[onDiags,onDiags]=self.finiteDiff(stencil1D,dim=1)
+        single = energies[1:1 + 4 * self.nEls].reshape(-1, 4)
+        hess[np.diag_indices(self.nEls)] = (-single[:, 0] + 16.0 * single[:, 1] - 30.0 * energies[0]
+                                             + 16.0 * single[:, 2] - single[:, 3]) / (12.0 * dx**2)
         return hess
 
+    def genCoordinatePairs(self, cutoff):
+        """Returns the (first, second) coordinates of the off-diagonal Hessian elements of every pair
+        of atoms closer than cutoff, in the units of eqGeom, including the pairs within each atom."""
+        from scipy.spatial import cKDTree
+        nAtoms = len(self.atoms)
+        atomPairs = np.array(sorted(cKDTree(np.reshape(self.eqGeom, (nAtoms, 3))).query_pairs(cutoff)), dtype=int).reshape(-1, 2)
+        # all 3x3 elements between two atoms, the upper triangle within an atom
+        i, j = np.meshgrid(np.arange(3), np.arange(3), indexing='ij')
+        first = (3 * atomPairs[:, :1] + i.ravel()).ravel()
+        second = (3 * atomPairs[:, 1:] + j.ravel()).ravel()
+        i, j = np.triu_indices(3, 1)
+        first = np.concatenate((first, (3 * np.arange(nAtoms)[:, np.newaxis] + i).ravel()))
+        second = np.concatenate((second, (3 * np.arange(nAtoms)[:, np.newaxis] + j).ravel()))
+        return first, second
+
+    def genBlockHess(self, cutoff, massWeighted=True):
+        """Block-sparse version of genHess for large clusters. Only the 3x3 blocks of atoms closer than
+        cutoff (units of eqGeom) are computed and stored, the rest of the Hessian is taken to be zero,
+        so the cost and memory grow with the number of neighboring atoms rather than N^2.
+        If massWeighted, each element is divided by sqrt(m_i m_j) as it is assembled.
+        Returns a 3N x 3N scipy.sparse.bsr_matrix with 3x3 blocks."""
+        from scipy.sparse import coo_matrix
+        dx = self.dx
+        first, second = self.genCoordinatePairs(cutoff)
+        energies = self.evaluateDisplacements(self.genDisplacements((first, second)))
+
+        corners = energies[1 + 4 * self.nEls:].reshape(-1, 4)
+        offDiagonal = (corners[:, 0] - corners[:, 1] - corners[:, 2] + corners[:, 3]) / (4.0 * dx**2)
+        single = energies[1:1 + 4 * self.nEls].reshape(-1, 4)
+        diagonal = (-single[:, 0] + 16.0 * single[:, 1] - 30.0 * energies[0]
+                    + 16.0 * single[:, 2] - single[:, 3]) / (12.0 * dx**2)
+
+        coords = np.arange(self.nEls)
+        rows = np.concatenate((first, second, coords))
+        columns = np.concatenate((second, first, coords))
+        values = np.concatenate((offDiagonal, offDiagonal, diagonal))
+        if massWeighted:
+            invSqrtMasses = 1.0 / np.sqrt(np.repeat([Constants.mass(a) for a in self.atoms], 3))
+            values *= invSqrtMasses[rows] * invSqrtMasses[columns]
+        return coo_matrix((values, (rows, columns)), shape=(self.nEls, self.nEls)).tobsr(blocksize=(3, 3))
+
+    def partialDiagonalize(self, hessianMW, nModes=20, window=None, tol=0.0):
+        """Finds some of the harmonic frequencies (cm^-1) and normal modes of a mass-weighted Hessian,
+        e.g. from genBlockHess, with the Lanczos solver of scipy.sparse.linalg.eigsh rather than a full eigh.
+        Without a window, the nModes lowest are returned. With window = (lowest, highest) in cm^-1, every mode
+        in the window is returned, found by shift-invert around its middle. nModes is then the first guess
+        of how many there are, which is doubled until the window is covered.
+        Imaginary frequencies are returned as negative numbers. The modes are the mass-weighted eigenvectors, as columns."""
+        from scipy.sparse.linalg import eigsh
+        n = hessianMW.shape[0]
+        if window is None:
+            # Lanczos converges poorly onto the cluster of near-zero translations and rotations at the bottom
+            # of the spectrum, so shift-invert around a Gershgorin bound below the lowest eigenvalue instead
+            absHessian = abs(hessianMW)
+            diagonal = hessianMW.diagonal()
+            radii = np.ravel(absHessian.sum(axis=1)) - np.abs(diagonal)
+            sigma = np.min(diagonal - radii) - 0.01 * np.max(np.abs(diagonal) + radii)
+            eigenvalues, modes = eigsh(hessianMW, k=min(nModes, n - 1), sigma=sigma, which='LM', tol=tol)
+        else:
+            lowest, highest = [np.sign(w) * Constants.convert(abs(w), 'wavenumbers')**2 for w in window]
+            sigma = 0.5 * (lowest + highest)
+            k = nModes
+            while True:
+                if k >= n - 1:
+                    # the window holds most of the spectrum, so there is nothing to gain over a full diagonalization
+                    eigenvalues, modes = la.eigh(hessianMW.toarray())
+                    break
+                eigenvalues, modes = eigsh(hessianMW, k=k, sigma=sigma, which='LM', tol=tol)
+                # the k eigenvalues closest to sigma reach past the window, so none in it were missed
+                if np.max(np.abs(eigenvalues - sigma)) > 0.5 * (highest - lowest):
+                    break
+                k *= 2
+            inWindow = (eigenvalues >= lowest) & (eigenvalues <= highest)
+            eigenvalues, modes = eigenvalues[inWindow], modes[:, inWindow]
+        order = np.argsort(eigenvalues)
+        eigenvalues, modes = eigenvalues[order], modes[:, order]
+        freqsCM = np.sign(eigenvalues) * Constants.convert(np.sqrt(np.abs(eigenvalues)), 'wavenumbers', to_AU=False)
+        return freqsCM, modes
+
     def diagonalize(self,hessian):
         masses = np.array([Constants.mass(a) for a in self.atoms])
         massesDup = np.repeat(masses, 3)
@@ -151,6 +271,17 @@ class HarmonicAnalysis:
         hessian = self.genHess()
         self.diagonalize(hessian)
 
+    def runPartial(self, cutoff, nModes=20, window=None):
+        """Like run, but with the block-sparse Hessian of genBlockHess and partialDiagonalize.
+        Saves the frequencies like diagonalize does and returns the frequencies and normal modes."""
+        freqsCM, normalModes = self.partialDiagonalize(self.genBlockHess(cutoff), nModes, window)
+        timestr = time.strftime("%Y%m%d-%H%M%S")
+        if self.ofile is None:
+            np.savetxt("frequencies" + timestr + ".txt", freqsCM)
+        else:
+            np.savetxt(str(self.ofile) + "_freq.txt", freqsCM)
+        return freqsCM, normalModes
+
 class Potential_Wrapper:
     """
     Wraps an existing function that only calls a single geometry to returns many energies. pot_function should only return the energy, not the energy and gradients.
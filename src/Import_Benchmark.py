@@ -0,0 +1,50 @@
+"""
+Times how long a fresh interpreter takes to import the modules of this package, which is what every
+short job and every freshly spawned worker pays before it evaluates anything. Run it as
+
+    python -m src.Import_Benchmark [modules] [--repeats 5] [--max-ms 300]
+
+With --max-ms it exits with status 1 if any module takes longer, so it can guard against a heavy
+import sneaking back in. Use python -X importtime -c "import <module>" to see where the time goes.
+"""
+import sys, os
+import argparse
+import subprocess
+import time
+
+__all__ = ['time_import', 'main']
+
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# the modules import each other relatively, so they are imported as part of the package
+PACKAGE = os.path.basename(SOURCE_DIRECTORY)
+DEFAULT_MODULES = ["Potential", "Fragments", "MBE_Potential", "Composite_Potential", "Executors", "Pools"]
+
+def time_import(module, repeats=5):
+    """Returns the best of repeats wall times (s) for a fresh interpreter to import module,
+    less the time to start an interpreter which imports nothing."""
+    def best_time(code):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(SOURCE_DIRECTORY))
+            times.append(time.perf_counter() - start)
+        return min(times)
+    return best_time(f"import {PACKAGE}.{module}") - best_time("pass")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Times the import of modules in a fresh interpreter.")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, help="exit with status 1 if any import takes longer than this")
+    args = parser.parse_args(argv)
+
+    too_slow = False
+    for module in args.modules:
+        milliseconds = time_import(module, args.repeats) * 1e3
+        print(f"{module:<24} {milliseconds:8.1f} ms")
+        if args.max_ms is not None and milliseconds > args.max_ms:
+            too_slow = True
+    return 1 if too_slow else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import numpy as np
+from .Masses import get_mass_of_element
+
+__all__ = ['Integrator', 'Verlet', 'Velocity_Verlet', 'RESPA', 'Residual_Potential']
+
+# conversions to atomic units. Potentials take angstrom and return hartree and hartree / bohr.
+ANGSTROM_TO_BOHR = 1.88973
+FS_TO_AU_TIME = 1.0 / 0.02418884326585747
+AMU_TO_AU_MASS = 1822.888486
+
+class Integrator:
+    """
+    Base class of the integrators used by Dynamics. A potential is any callable which takes
+    Nx3 coordinates in angstrom and returns the energy in hartree and forces in hartree / bohr,
+    e.g. MBE_Potential.evaluate_on_geometry.
+
+    Internally everything is kept in atomic units: positions in bohr, velocities in bohr / a.u. time.
+    """
+    def __init__(self, potential, atom_labels, dt):
+        """
+        Args:
+            potential  (callable): returns (energy, forces) for Nx3 coordinates in angstrom
+            atom_labels    (list): atom labels, used to look up the masses
+            dt            (float): time step in fs
+        """
+        self.potential = potential
+        self.atom_labels = atom_labels
+        self.masses = np.array([get_mass_of_element(label) for label in atom_labels]) * AMU_TO_AU_MASS
+        self.dt = dt * FS_TO_AU_TIME
+        self.potential_energy = None
+        self.forces = None
+        # number of times each potential has been called, to compare the cost of integrators
+        self.force_evaluations = {"potential": 0}
+
+    def evaluate(self, positions):
+        """Calls self.potential on positions in bohr and stores the energy and forces."""
+        self.force_evaluations["potential"] += 1
+        output = self.potential(positions / ANGSTROM_TO_BOHR)
+        self.potential_energy, self.forces = output[0], np.asarray(output[1]).reshape(positions.shape)
+        return self.potential_energy, self.forces
+
+    def kinetic_energy(self, velocities):
+        return 0.5 * np.sum(self.masses[:, np.newaxis] * velocities**2)
+
+    def step(self, positions, velocities):
+        """Takes one step and returns the new positions and velocities."""
+        raise NotImplementedError
+
+class Verlet(Integrator):
+    """
+    Position Verlet, x(t+dt) = 2x(t) - x(t-dt) + a(t)dt^2. The velocities returned with x(t+dt)
+    are the backward differences (x(t+dt) - x(t)) / dt, so they are only first-order accurate and
+    are really the velocities half a step earlier, at t + dt/2.
+    """
+    def __init__(self, potential, atom_labels, dt):
+        super().__init__(potential, atom_labels, dt)
+        self.previous_positions = None
+
+    def step(self, positions, velocities):
+        if self.forces is None:
+            self.evaluate(positions)
+        accelerations = self.forces / self.masses[:, np.newaxis]
+        if self.previous_positions is None:
+            new_positions = positions + velocities * self.dt + 0.5 * accelerations * self.dt**2
+        else:
+            new_positions = 2.0 * positions - self.previous_positions + accelerations * self.dt**2
+        self.previous_positions = positions
+        self.evaluate(new_positions)
+        return new_positions, (new_positions - positions) / self.dt
+
+class Velocity_Verlet(Integrator):
+    def step(self, positions, velocities):
+        if self.forces is None:
+            self.evaluate(positions)
+        velocities = velocities + 0.5 * self.dt * self.forces / self.masses[:, np.newaxis]
+        positions = positions + self.dt * velocities
+        self.evaluate(positions)
+        velocities = velocities + 0.5 * self.dt * self.forces / self.masses[:, np.newaxis]
+        return positions, velocities
+
+class RESPA(Integrator):
+    """
+    Velocity Verlet with RESPA multiple time stepping. The forces are split into a cheap, fast part,
+    e.g. the 1- and 2-body terms of an MBE, which is integrated every inner step, and an expensive,
+    slow part, e.g. the higher-order or residual terms, which is applied as a half-step impulse at the
+    start and end of every outer step of n_inner inner steps. The slow potential is therefore only
+    called once per n_inner steps.
+
+    self.potential_energy and self.forces are the totals at the end of each outer step.
+    """
+    def __init__(self, fast_potential, slow_potential, atom_labels, dt, n_inner=4):
+        """
+        Args:
+            fast_potential (callable): the cheap part of the forces
+            slow_potential (callable): the expensive part of the forces, see Residual_Potential
+            atom_labels        (list): atom labels, used to look up the masses
+            dt                (float): inner time step in fs. The outer step is n_inner * dt.
+            n_inner             (int): number of inner steps per evaluation of slow_potential
+        """
+        super().__init__(fast_potential, atom_labels, dt)
+        self.fast_potential = fast_potential
+        self.slow_potential = slow_potential
+        self.n_inner = n_inner
+        self.fast_energy = self.fast_forces = None
+        self.slow_energy = self.slow_forces = None
+        self.force_evaluations = {"fast": 0, "slow": 0}
+
+    def evaluate_fast(self, positions):
+        self.force_evaluations["fast"] += 1
+        output = self.fast_potential(positions / ANGSTROM_TO_BOHR)
+        self.fast_energy, self.fast_forces = output[0], np.asarray(output[1]).reshape(positions.shape)
+
+    def evaluate_slow(self, positions):
+        self.force_evaluations["slow"] += 1
+        output = self.slow_potential(positions / ANGSTROM_TO_BOHR)
+        self.slow_energy, self.slow_forces = output[0], np.asarray(output[1]).reshape(positions.shape)
+
+    def evaluate(self, positions):
+        self.evaluate_fast(positions)
+        self.evaluate_slow(positions)
+        self.update_totals()
+        return self.potential_energy, self.forces
+
+    def update_totals(self):
+        self.potential_energy = self.fast_energy + self.slow_energy
+        self.forces = self.fast_forces + self.slow_forces
+
+    def step(self, positions, velocities):
+        """Takes one outer step of n_inner * dt."""
+        if self.fast_forces is None or self.slow_forces is None:
+            self.evaluate(positions)
+        inverse_masses = 1.0 / self.masses[:, np.newaxis]
+        outer_dt = self.n_inner * self.dt
+
+        velocities = velocities + 0.5 * outer_dt * self.slow_forces * inverse_masses
+        for _ in range(self.n_inner):
+            velocities = velocities + 0.5 * self.dt * self.fast_forces * inverse_masses
+            positions = positions + self.dt * velocities
+            self.evaluate_fast(positions)
+            velocities = velocities + 0.5 * self.dt * self.fast_forces * inverse_masses
+        self.evaluate_slow(positions)
+        velocities = velocities + 0.5 * outer_dt * self.slow_forces * inverse_masses
+
+        self.update_totals()
+        return positions, velocities
+
+class Residual_Potential:
+    """
+    The difference of two potentials, full - fast, for use as the slow part of RESPA.
+    For example, with fast = Classical_MBE_Potential(2, fragments, ttm).evaluate_on_geometry and
+    full = Composite_Potential(...).get_energy_and_gradients, the slow part is every term beyond 2-body.
+    """
+    def __init__(self, full_potential, fast_potential):
+        self.full_potential = full_potential
+        self.fast_potential = fast_potential
+
+    def __call__(self, coords):
+        full = self.full_potential(coords)
+        fast = self.fast_potential(coords)
+        return full[0] - fast[0], np.asarray(full[1]) - np.asarray(fast[1])
@@ -60,3 +60,69 @@ class MBEPotentialCalculator(Calculator):
         self.results['energy'] = output[0] * Hartree
         self.results['forces'] = output[1] * Hartree / Bohr
         return output[0], output[1]
+
+    def calculate_images(self, images):
+        """
+        Evaluates several Atoms objects, e.g. the images of a NEB or the members of an ensemble,
+        with a single batch through evaluate_on_geometries_parallel().
+
+        Returns the energies in eV and forces in eV / Angstrom of each image.
+        """
+        outputs = self.mbe_potential.evaluate_on_geometries_parallel([atoms.get_positions() for atoms in images])
+        energies = [output[0] * Hartree for output in outputs]
+        forces = [output[1] * Hartree / Bohr for output in outputs]
+        return energies, forces
+
+    def attach(self, images):
+        """
+        Gives each image its own MBEImageCalculator backed by this calculator, so that
+        ASE NEB and ensemble workflows evaluate all images which changed in a single batch
+        the first time any one of them is asked for its energy or forces.
+        For a NEB you would usually only attach the moving images, e.g. neb.images[1:-1].
+        """
+        self.image_calculators = []
+        for atoms in images:
+            atoms.calc = MBEImageCalculator(self)
+            self.image_calculators.append((atoms, atoms.calc))
+        return images
+
+    def calculate_pending(self, requesting_calculator):
+        """
+        Evaluates the image belonging to requesting_calculator together with every other
+        attached image whose results are out of date, and stores the results on their calculators.
+        """
+        pending = [(requesting_calculator.atoms, requesting_calculator)]
+        for atoms, calc in getattr(self, "image_calculators", []):
+            if calc is requesting_calculator or atoms.calc is not calc:
+                continue
+            if calc.calculation_required(atoms, self.implemented_properties):
+                pending.append((atoms, calc))
+
+        energies, forces = self.calculate_images([atoms for atoms, _ in pending])
+        for (atoms, calc), energy, force in zip(pending, energies, forces):
+            if calc is not requesting_calculator:
+                calc.atoms = atoms.copy()
+            calc.results['energy'] = energy
+            calc.results['forces'] = force
+
+class MBEImageCalculator(Calculator):
+    """
+    Calculator for one image of a band or ensemble which is evaluated in batches by an MBEPotentialCalculator.
+    Use MBEPotentialCalculator.attach() to set these up.
+    """
+    implemented_properties = ['forces', 'energy']
+    nolabel = True
+
+    def __init__(self, batch_calculator: MBEPotentialCalculator):
+        super().__init__()
+        self.batch_calculator = batch_calculator
+
+    def calculate(self, atoms=None, properties=None, system_changes=all_changes,):
+        if properties is None:
+            properties = self.implemented_properties
+
+        # call the base class
+        Calculator.calculate(self, atoms, properties, system_changes)
+
+        # evaluates this image and any other attached image that changed
+        self.batch_calculator.calculate_pending(self)
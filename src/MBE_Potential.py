@@ -1,15 +1,55 @@
-from Fragments import Fragments
-from Potential import *
+from .Fragments import Fragments
+from .Potential import *
+from .MBE_Terms import MBE_Terms
+from .Warm_Start import NMer_Warm_Start
+from .Symmetry import find_symmetry_operations, get_nmer_orbits
+from .Generalized_MBE import get_neighbor_groups, get_generalized_subsystems
 import numpy as np
 from math import comb
 from ase.units import Hartree, Bohr
-import sys, os, time
-from multiprocessing import Pool
+import sys, os, time, itertools
+from .Executors import Executor, Process_Executor, serial_executor
+
+def reduce_nmer_chunk(function, chunk, ngeometries, highest_order, natoms, keep_nmer_energies=False, sums=None):
+    """
+    Runs in a pool worker. Evaluates every n-mer in chunk with function and sums the energies and
+    forces per geometry and order, so the worker only sends back these partial sums.
+    In this process the sums can go straight into existing arrays instead, see evaluate_on_fragments().
+
+    Args:
+        function           (callable): evaluates a task and returns (energy, forces)
+        chunk                  (list): (geometry_index, order, atom_indices, fragment_indices, task) items
+        ngeometries             (int): number of geometries the items belong to
+        highest_order           (int): highest order of the MBE
+        natoms                  (int): number of atoms in the full system
+        keep_nmer_energies     (bool): also return the energy of every n-mer, keyed by its fragment indices,
+                                       for attributing the n-body energies to fragments
+        sums                  (tuple): (energy, forces) arrays with a leading geometry axis and a list of
+                                       n-mer energy dicts or None, which are added to and returned rather
+                                       than allocating new ones
+    """
+    if sums is not None:
+        energy_sum, forces_sum, nmer_energies = sums
+    else:
+        energy_sum = np.zeros((ngeometries, highest_order), dtype=np.float64)
+        forces_sum = np.zeros((ngeometries, highest_order, natoms, 3), dtype=np.float64)
+        nmer_energies = [{} for _ in range(ngeometries)] if keep_nmer_energies else None
+    for geometry_index, order, atom_indices, fragment_indices, task in chunk:
+        energy, forces = function(task)
+        energy_sum[geometry_index, order] += energy
+        forces_sum[geometry_index, order][atom_indices] += forces
+        if nmer_energies is not None:
+            nmer_energies[geometry_index][tuple(fragment_indices)] = energy
+    return energy_sum, forces_sum, nmer_energies
 
 class MBE_Potential:
     """
     Base class of the MBE potentials.
     """
+    # the parallel paths split the n-mers into nproc * chunks_per_worker chunks which are summed on the workers.
+    # The constructors take chunks_per_worker to override this default, e.g. with the one recommended by Planner.plan_mbe().
+    chunks_per_worker = 4
+
     def log_mb_terms(self, nbody_energies, nbody_forces):
         """
         Logs all of the n-body energies and forces calculated and returns it as a dictionary
@@ -23,6 +63,761 @@ class MBE_Potential:
             mb_terms[key] = nbody_energy
         return mb_terms
 
+    @property
+    def executor(self):
+        """The Executor used by the parallel evaluate paths. Unless one was given to the constructor,
+        this is a Process_Executor on a pool from the shared pool registry, which is only started on first use.
+        """
+        if self._executor is None:
+            self._executor = Process_Executor(self.nproc, self.threads_per_worker, self.cpu_sets)
+            self._owns_executor = True
+        return self._executor
+
+    def close(self):
+        """Closes the executor if this potential made it. For the default executor this hands the
+        worker pool back to the registry, which shuts it down once no other potential uses it.
+        """
+        if self._executor is not None and self._owns_executor:
+            self._executor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        d = dict(self.__dict__)
+        if self._owns_executor:
+            d['_executor'] = None
+        return d
+
+    def get_work_arrays(self):
+        """Returns zeroed (highest_order,) energy and (highest_order, natoms, 3) force sums.
+        The force array is allocated once and reused on every evaluation. If the mb_terms
+        record wants per-fragment energies, a (highest_order, nfragments) array is returned
+        as well, otherwise None.
+        """
+        natoms = len(self.fragments.flattened_atom_labels)
+        forces_sum = getattr(self, "_forces_sum", None)
+        if forces_sum is None or forces_sum.shape != (self.highest_order, natoms, 3):
+            forces_sum = np.zeros((self.highest_order, natoms, 3), dtype=np.float64)
+            self._forces_sum = forces_sum
+        else:
+            forces_sum.fill(0.0)
+        energy_sum = np.zeros(self.highest_order, dtype=np.float64)
+
+        fragment_energy_sum = None
+        if self.mb_terms is not None and self.mb_terms.wants_fragment_energies:
+            fragment_energy_sum = np.zeros((self.highest_order, len(self.fragments.fragments)), dtype=np.float64)
+        return energy_sum, forces_sum, fragment_energy_sum
+
+    @staticmethod
+    def accumulate_nmer(order, energy, forces, atom_indices, energy_sum, forces_sum, fragment_indices=None, fragment_energy_sum=None):
+        """Adds the energy and forces of a single n-mer into the sums for its order.
+        If fragment_energy_sum is given, the energy is split evenly between the fragments in the n-mer,
+        so it should be the n-mer's n-body increment rather than its total energy.
+        """
+        assert(len(forces) == len(atom_indices))
+        energy_sum[order] += energy
+        forces_sum[order][atom_indices] += forces
+        if fragment_energy_sum is not None:
+            fragment_energy_sum[order][list(fragment_indices)] += energy / len(fragment_indices)
+
+    def check_order(self):
+        """Exits if the MBE asks for a higher order than there are fragments. Returns the number of fragments."""
+        N = len(self.fragments.fragments)
+        if self.highest_order > N:
+            print(f"The order of the MBE being evaluated seems to be larger than the number of fragments, {N}. Check that you haven't asked for too high of an MBE by asking for a {self.highest_order}-body expansion.")
+            sys.exit(1)
+        return N
+
+    def nbody_decomposition(self, *sums):
+        """Weights each sum over all n-mers by the combinatorial number of times it shows up
+        to get the n-body terms. The leading axis of each array is the order of the MBE, and
+        the arrays are overwritten in place, so afterwards sums[k][n] is the (n+1)-body term.
+        Working from the highest order down means no extra copies of the sums are needed.
+        """
+        N = self.check_order()
+        for iMBE in range(self.highest_order-1, 0, -1):
+            for i in range(1, iMBE+1):
+                weight = (-1)**i * comb(N-(iMBE+1)+i,i)
+                for nbody_sum in sums:
+                    if nbody_sum is not None:
+                        nbody_sum[iMBE] += weight * nbody_sum[iMBE-i]
+
+    @staticmethod
+    def attribute_fragment_energies(nmer_energies, fragment_energy_sum):
+        """Splits the n-body increment of every n-mer,
+            dE(S) = E(S) - sum of dE(T) over the proper subsets T of S,
+        evenly between its fragments and adds it to fragment_energy_sum[|S| - 1]. nmer_energies maps the
+        fragment indices of every n-mer of the MBE to its energy. Unlike the n-body terms, the energy of a
+        fragment can't be weighted out of sums over all n-mers, as each n-mer holds it a different number of times.
+        """
+        increments = {}
+        for combination in sorted(nmer_energies, key=len):
+            increment = nmer_energies[combination]
+            for subset_order in range(1, len(combination)):
+                for subset in itertools.combinations(combination, subset_order):
+                    increment -= increments[subset]
+            increments[combination] = increment
+            fragment_energy_sum[len(combination) - 1][list(combination)] += increment / len(combination)
+
+    def package_results(self, nbody_energies, nbody_forces, nbody_fragment_energies=None):
+        """Accumulates the n-body terms and returns whatever this potential was asked to return."""
+        total_energy = np.sum(nbody_energies)
+        total_forces = np.sum(nbody_forces, axis=0)
+
+        if not self.return_mb_terms:
+            if self.return_order_n == None:
+                return total_energy, total_forces
+            else:
+                return nbody_energies[self.return_order_n-1], np.copy(nbody_forces[self.return_order_n-1])
+        elif self.mb_terms is not None:
+            return total_energy, total_forces, self.mb_terms.record(nbody_energies, nbody_forces, nbody_fragment_energies)
+        else:
+            return total_energy, total_forces, self.log_mb_terms(nbody_energies, np.copy(nbody_forces))
+
+    def make_reduction_items(self, geometry_index=0, detach=False):
+        """
+        Returns a (geometry_index, order, atom_indices, fragment_indices, task) item for every n-mer
+        of the current geometry. These are what the workers evaluate and sum in reduce_nmer_chunk().
+        detach is passed to make_task(), for items which must keep this geometry after the fragments move on.
+        """
+        items = []
+        for order in range(self.highest_order):
+            atom_indices = self.fragments.get_indices_for_fragment_combination(order + 1)
+            fragment_indices = self.fragments.get_fragment_combinations(order + 1)
+            for i_frag, nmer in enumerate(self.fragments.make_nmers(order + 1)):
+                items.append((geometry_index, order, atom_indices[i_frag], fragment_indices[i_frag], self.make_task(nmer, detach)))
+        return items
+
+    def submit_reduction(self, items, ngeometries=1, executor: Executor=None):
+        """
+        Splits items into chunks, nworkers * chunks_per_worker of them for a parallel executor, and queues
+        them on executor, which defaults to self.executor. Each worker sums the energies and forces of the
+        n-mers in its chunk per order, so only one partial sum per chunk comes back rather than the forces
+        of every n-mer. The items are dealt out round-robin, so every chunk gets a similar mix of cheap
+        and expensive n-mers.
+
+        The items are sorted by size first, so each chunk runs all of its n-mers of one size before the
+        next, and potentials which set up per system size (see Potential.get_size_handle()) rarely switch.
+        """
+        executor = executor or self.executor
+        items = sorted(items, key=lambda item: len(item[2]))
+        nchunks = executor.get_nchunks(len(items), self.chunks_per_worker)
+        natoms = len(self.fragments.flattened_atom_labels)
+        keep_nmer_energies = self.mb_terms is not None and self.mb_terms.wants_fragment_energies
+        function = self.get_task_function()
+        return executor.starmap_async(reduce_nmer_chunk, [(function, items[i::nchunks], ngeometries, self.highest_order, natoms, keep_nmer_energies)
+                                                         for i in range(nchunks)])
+
+    def collect_batch_results(self, async_result, ngeometries):
+        """Merges the partial sums of an evaluation queued by submit_reduction() and returns the results of the MBE for each geometry."""
+        partial_sums = async_result.get()
+        outputs = []
+        for geometry_index in range(ngeometries):
+            energy_sum, forces_sum, fragment_energy_sum = self.get_work_arrays()
+            nmer_energies = {}
+            for partial_energies, partial_forces, partial_nmer_energies in partial_sums:
+                energy_sum += partial_energies[geometry_index]
+                forces_sum += partial_forces[geometry_index]
+                if fragment_energy_sum is not None:
+                    nmer_energies.update(partial_nmer_energies[geometry_index])
+            self.nbody_decomposition(energy_sum, forces_sum)
+            if fragment_energy_sum is not None:
+                self.attribute_fragment_energies(nmer_energies, fragment_energy_sum)
+            outputs.append(self.package_results(energy_sum, forces_sum, fragment_energy_sum))
+        return outputs
+
+    def make_parallel_tasks(self):
+        """
+        Returns the function which evaluates an n-mer and the tasks for every n-mer
+        of the current geometry, ordered by increasing order of the MBE.
+        """
+        tasks = []
+        for order in range(self.highest_order):
+            tasks += [self.make_task(nmer) for nmer in self.fragments.make_nmers(order + 1)]
+        return self.get_task_function(), tasks
+
+    def evaluate_nmers(self, nmers, parallel=False):
+        """Evaluates a list of n-mer Atoms objects, with self.executor if parallel is True,
+        and returns a list with the (energy, forces) of each.
+        """
+        function = self.get_task_function()
+        tasks = [self.make_task(nmer) for nmer in nmers]
+        executor = self.executor if parallel else serial_executor
+        return executor.map(function, tasks)
+
+    def evaluate_on_fragments(self):
+        """
+        Evaluates every n-mer of self.fragments in this process and returns the results of the MBE.
+
+        This operates directly on the fragments brought in with self.fragments
+        """
+        energy_sum, forces_sum, fragment_energy_sum = self.get_work_arrays()
+        # summed straight into the work arrays, viewed as a batch of one geometry, so nothing is allocated per call
+        nmer_energies = None if fragment_energy_sum is None else [{}]
+        sums = (energy_sum[np.newaxis], forces_sum[np.newaxis], nmer_energies)
+        items = sorted(self.make_reduction_items(), key=lambda item: len(item[2]))
+        reduce_nmer_chunk(self.get_task_function(), items, 1, self.highest_order, len(self.fragments.flattened_atom_labels), sums=sums)
+        self.nbody_decomposition(energy_sum, forces_sum)
+        if fragment_energy_sum is not None:
+            self.attribute_fragment_energies(nmer_energies[0], fragment_energy_sum)
+        return self.package_results(energy_sum, forces_sum, fragment_energy_sum)
+
+    def evaluate_on_fragments_parallel(self):
+        """
+        Evaluates every n-mer of self.fragments with self.executor and returns the results of the MBE.
+
+        This operates directly on the fragments brought in with self.fragments
+        """
+        return self.collect_results(self.submit_on_fragments())
+
+    def submit_on_fragments(self, executor: Executor=None):
+        """
+        Queues every n-mer of self.fragments on executor, self.executor by default, without waiting
+        for them to finish. This lets several evaluations share the executor at the same time.
+        Pass the returned handle to collect_results() to get the results of the MBE.
+        """
+        return self.submit_reduction(self.make_reduction_items(), executor=executor)
+
+    def collect_results(self, async_result):
+        """Waits for an evaluation queued by submit_on_fragments() and returns the results of the MBE."""
+        return self.collect_batch_results(async_result, 1)[0]
+
+    def evaluate_on_geometries_parallel(self, geometries):
+        """Evaluates the MBE on several geometries at once, e.g. all images of a NEB.
+        The n-mers of every geometry go to the pool as a single task stream, so there is one
+        pool barrier per call rather than one per geometry, and small n-mer sets from many
+        images keep all of the workers busy.
+
+        If an MBE_Terms record is attached, it holds the terms of the last geometry afterwards.
+
+        Args:
+            geometries (list of ndarray): Nx3 arrays of cartesian coordinates
+        Returns:
+            list with the output of evaluate_on_geometry_parallel() for each geometry
+        """
+        if len(geometries) == 0:
+            return []
+        items = []
+        for geometry_index, geometry in enumerate(geometries):
+            self.fragments.fragment_geometry(geometry)
+            # every geometry but the last is moved away from before the items are evaluated
+            items += self.make_reduction_items(geometry_index, detach=geometry_index < len(geometries) - 1)
+        return self.collect_batch_results(self.submit_reduction(items, len(geometries)), len(geometries))
+
+    def evaluate_increments(self, combinations, increments, parallel=False, nmer_results=None):
+        """
+        Evaluates the n-mers made from combinations, which must all be of the same order, and stores
+        the n-body increment of each in increments,
+            dE(S) = E(S) - sum of dE(T) over the proper subsets T of S found in increments.
+        increments maps tuples of fragment indices to (energy increment, force increment on the n-mer's own atoms).
+        If nmer_results is given, the (energy, forces) of each n-mer are stored in it the same way.
+
+        Returns a list with the largest magnitude of the next-lower-order increments inside each n-mer.
+        """
+        fragment_sizes = [len(labels) for labels in self.fragments.atom_labels]
+        results = self.evaluate_nmers(self.fragments.make_nmers_from_combinations(combinations), parallel)
+        largest_subincrements = []
+        for combination, (energy, forces) in zip(combinations, results):
+            if nmer_results is not None:
+                nmer_results[combination] = (energy, forces)
+            nbody = len(combination)
+            # where the atoms of each fragment of this n-mer are in its force array
+            local_offsets = dict(zip(combination, np.cumsum([0] + [fragment_sizes[i] for i in combination])))
+            energy_increment = energy
+            forces_increment = np.array(forces, dtype=np.float64)
+            largest_subincrement = 0.0
+            for subset_order in range(1, nbody):
+                for subset in itertools.combinations(combination, subset_order):
+                    if subset not in increments:
+                        continue
+                    subset_energy, subset_forces = increments[subset]
+                    energy_increment -= subset_energy
+                    forces_increment[[local_offsets[i] + k for i in subset for k in range(fragment_sizes[i])]] -= subset_forces
+                    if subset_order == nbody - 1:
+                        largest_subincrement = max(largest_subincrement, abs(subset_energy))
+            increments[combination] = (energy_increment, forces_increment)
+            largest_subincrements.append(largest_subincrement)
+        return largest_subincrements
+
+    def compute_increments(self, parallel=False):
+        """Returns the n-body increment of every n-mer up to self.highest_order, in the form used by evaluate_increments()."""
+        self.check_order()
+        increments = {}
+        for order in range(self.highest_order):
+            self.evaluate_increments(self.fragments.get_fragment_combinations(order + 1), increments, parallel)
+        return increments
+
+    def evaluate_on_fragments_adaptive(self, threshold, parallel=False, screen_from_order=3):
+        """
+        Evaluates the MBE while skipping the n-mers whose interactions are negligible.
+        Rather than the per-order sums used by evaluate_on_fragments(), this keeps the n-body increment
+        of every evaluated n-mer,
+            dE(S) = E(S) - sum of dE(T) over all evaluated proper subsets T of S,
+        and an (n+1)-mer is only evaluated if at least one of its n-body increments is at least threshold
+        in magnitude. Every n-mer below screen_from_order is evaluated. Skipped n-mers contribute nothing.
+        The increment of an n-mer needs all of its subsets, so a skipped subset of an evaluated n-mer is
+        evaluated as well and added to its own order. Otherwise its interaction would stay inside the
+        increment of every evaluated n-mer containing it, and be counted once per such n-mer.
+
+        An estimate of the energy lost by skipping n-mers is stored per order in self.screening_report.
+        The estimate assumes each skipped n-mer would have contributed the typical ratio of
+        |dE(S)| to its largest sub-increment seen among the evaluated n-mers of that order.
+
+        Args:
+            threshold       (float): smallest n-body increment (hartree) worth building on
+            parallel         (bool): evaluate each order on the worker pool
+            screen_from_order (int): first order of the MBE which is screened
+        """
+        N = self.check_order()
+        energy_sum, forces_sum, fragment_energy_sum = self.get_work_arrays()
+
+        # maps a tuple of fragment indices to its (energy increment, force increment on its own atoms)
+        increments = {}
+        previous_order = []
+        self.screening_report = {}
+        for order in range(self.highest_order):
+            nbody = order + 1
+            if nbody < screen_from_order:
+                combinations = self.fragments.get_fragment_combinations(nbody)
+            else:
+                significant = [combination for combination in previous_order if abs(increments[combination][0]) >= threshold]
+                combinations = sorted({tuple(sorted(combination + (i,))) for combination in significant for i in range(N) if i not in combination})
+
+            filled_in = self.evaluate_missing_subsets(combinations, increments, parallel)
+            filled_in_orders = {}
+            for subset in filled_in:
+                filled_in_orders[len(subset)] = filled_in_orders.get(len(subset), 0) + 1
+                self.accumulate_nmer(len(subset) - 1, *increments[subset], self.fragments.get_atom_indices(subset),
+                                     energy_sum, forces_sum, subset, fragment_energy_sum)
+
+            ratios = []
+            for combination, largest_subincrement in zip(combinations, self.evaluate_increments(combinations, increments, parallel)):
+                energy_increment, forces_increment = increments[combination]
+                if largest_subincrement > 0.0:
+                    ratios.append(abs(energy_increment) / largest_subincrement)
+                self.accumulate_nmer(order, energy_increment, forces_increment, self.fragments.get_atom_indices(combination),
+                                     energy_sum, forces_sum, combination, fragment_energy_sum)
+
+            skipped = comb(N, nbody) - len(combinations)
+            estimated_error = 0.0
+            if nbody >= screen_from_order and skipped > 0:
+                # the sub-increments of a skipped n-mer were all below the threshold, and each of them
+                # is shared by N - nbody + 1 n-mers, which bounds the sum of their largest sub-increments
+                insignificant = sum(abs(increments[combination][0]) for combination in previous_order if abs(increments[combination][0]) < threshold)
+                ratio = np.median(ratios) if ratios else 1.0
+                estimated_error = ratio * insignificant * (N - nbody + 1)
+            self.screening_report[nbody] = {"candidates": comb(N, nbody),
+                                            "evaluated": len(combinations),
+                                            "filled_in": len(filled_in),
+                                            "filled_in_orders": filled_in_orders,
+                                            "estimated_error": estimated_error}
+            previous_order = combinations
+
+        self.screening_report["estimated_error"] = sum(report["estimated_error"] for report in self.screening_report.values())
+        # the sums are already the n-body terms, so there is no combinatorial weighting to do
+        return self.package_results(energy_sum, forces_sum, fragment_energy_sum)
+
+    def evaluate_on_geometry_adaptive(self, geometry, threshold, parallel=False, screen_from_order=3):
+        """This is a thin wrapper around evaluate_on_fragments_adaptive() which allows
+        raw coordinates to be passed in.
+
+        Args:
+            geometry (ndarray): Nx3 array of cartesian coordinates
+        """
+        self.fragments.fragment_geometry(geometry)
+        return self.evaluate_on_fragments_adaptive(threshold, parallel, screen_from_order)
+
+    def evaluate_on_fragments_multilevel(self, cheap_increments, cutoff, parallel=False, screen_from_order=2):
+        """
+        Multilevel MBE where a cheap potential decides which n-mers get this (expensive) potential.
+        cheap_increments holds the n-body increment of every n-mer from the cheap potential, as returned by
+        compute_increments() of an MBE of at least this order. n-mers whose cheap increment is at least
+        cutoff in magnitude, and every n-mer inside them, are evaluated with this potential.
+        Every other n-mer keeps its cheap increment. All n-mers below screen_from_order are evaluated.
+
+        The selected fraction and an estimated error are stored per order in self.multilevel_report.
+        The error estimate scales the cheap increments of the unselected n-mers by the typical relative
+        difference between the two potentials seen among the selected n-mers of that order.
+        If an order has unselected n-mers but no selected ones to compare with, its error is unknown and
+        reported as None, as is the total.
+
+        Args:
+            cheap_increments (dict): tuples of fragment indices mapped to (energy increment, force increment)
+            cutoff          (float): smallest cheap n-body increment (hartree) worth the expensive potential
+            parallel         (bool): evaluate each order on the worker pool
+            screen_from_order (int): first order of the MBE which is screened
+        """
+        self.check_order()
+        energy_sum, forces_sum, fragment_energy_sum = self.get_work_arrays()
+
+        # select the n-mers for this potential. The increment of an n-mer needs all of its subsets too.
+        selected = set()
+        for order in range(self.highest_order):
+            for combination in self.fragments.get_fragment_combinations(order + 1):
+                try:
+                    cheap_energy = cheap_increments[combination][0]
+                except KeyError:
+                    print(f"The cheap increments don't include the {order+1}-body terms. Compute them with an MBE of at least order {self.highest_order}.")
+                    sys.exit(1)
+                if order + 1 < screen_from_order or abs(cheap_energy) >= cutoff:
+                    for subset_order in range(1, order + 2):
+                        selected.update(itertools.combinations(combination, subset_order))
+
+        increments = {}
+        self.multilevel_report = {}
+        for order in range(self.highest_order):
+            all_combinations = self.fragments.get_fragment_combinations(order + 1)
+            combinations = [combination for combination in all_combinations if combination in selected]
+            self.evaluate_increments(combinations, increments, parallel)
+
+            relative_differences = []
+            unselected = 0.0
+            for combination in all_combinations:
+                cheap_energy = cheap_increments[combination][0]
+                if combination in increments:
+                    energy_increment, forces_increment = increments[combination]
+                    if cheap_energy != 0.0:
+                        relative_differences.append(abs(energy_increment - cheap_energy) / abs(cheap_energy))
+                else:
+                    energy_increment, forces_increment = cheap_increments[combination]
+                    unselected += abs(cheap_energy)
+                self.accumulate_nmer(order, energy_increment, forces_increment, self.fragments.get_atom_indices(combination),
+                                     energy_sum, forces_sum, combination, fragment_energy_sum)
+
+            if unselected == 0.0:
+                estimated_error = 0.0
+            elif relative_differences:
+                estimated_error = np.median(relative_differences) * unselected
+            else:
+                # nothing of this order was compared between the two potentials
+                estimated_error = None
+            self.multilevel_report[order + 1] = {"nmers": len(all_combinations),
+                                                 "selected": len(combinations),
+                                                 "selected_fraction": len(combinations) / len(all_combinations),
+                                                 "estimated_error": estimated_error}
+
+        errors = [report["estimated_error"] for report in self.multilevel_report.values()]
+        self.multilevel_report["estimated_error"] = None if None in errors else sum(errors)
+        # the sums are already the n-body terms, so there is no combinatorial weighting to do
+        return self.package_results(energy_sum, forces_sum, fragment_energy_sum)
+
+    def evaluate_on_fragments_exported(self, writer, frame=0, source="", parallel=False):
+        """
+        Evaluates the MBE like evaluate_on_fragments(), and adds every n-mer with its energy, forces and
+        n-body increment to writer, an NMer_Dataset_Writer, e.g. to train a machine-learned potential on.
+        The n-mers go to the writer in order, monomers first, and the results of the MBE are returned as usual.
+
+        Args:
+            writer (NMer_Dataset_Writer): dataset the n-mers are added to
+            frame                  (int): frame the geometry comes from, stored with each n-mer
+            source                 (str): where the geometry comes from, e.g. the xyz file
+            parallel              (bool): evaluate each order on the worker pool
+        """
+        self.check_order()
+        energy_sum, forces_sum, fragment_energy_sum = self.get_work_arrays()
+        increments = {}
+        nmer_results = {}
+        for order in range(self.highest_order):
+            combinations = self.fragments.get_fragment_combinations(order + 1)
+            self.evaluate_increments(combinations, increments, parallel, nmer_results)
+            for combination in combinations:
+                energy_increment, forces_increment = increments[combination]
+                atom_indices = self.fragments.get_atom_indices(combination)
+                self.accumulate_nmer(order, energy_increment, forces_increment, atom_indices,
+                                     energy_sum, forces_sum, combination, fragment_energy_sum)
+                energy, forces = nmer_results.pop(combination)
+                writer.add_nmer([label for i in combination for label in self.fragments.atom_labels[i]],
+                                np.vstack([self.fragments.fragments[i].get_positions() for i in combination]),
+                                energy, forces, energy_increment, forces_increment, combination, frame, source)
+        # the sums are already the n-body terms, so there is no combinatorial weighting to do
+        return self.package_results(energy_sum, forces_sum, fragment_energy_sum)
+
+    def evaluate_on_geometry_exported(self, geometry, writer, frame=0, source="", parallel=False):
+        """This is a thin wrapper around evaluate_on_fragments_exported() which allows
+        raw coordinates to be passed in.
+
+        Args:
+            geometry (ndarray): Nx3 array of cartesian coordinates
+        """
+        self.fragments.fragment_geometry(geometry)
+        return self.evaluate_on_fragments_exported(writer, frame, source, parallel)
+
+    def get_fragment_distances(self):
+        """Returns the NxN distances between the centroids of the fragments."""
+        centroids = np.array([fragment.get_positions().mean(axis=0) for fragment in self.fragments.fragments])
+        return np.linalg.norm(centroids[:, np.newaxis] - centroids[np.newaxis], axis=-1)
+
+    @staticmethod
+    def draw_compact_nmer(nbody, distances, length_scale, rng):
+        """Draws an n-mer by picking a fragment uniformly and then adding fragments with weights
+        exp(-d / length_scale), where d is the distance to the nearest fragment already picked."""
+        N = len(distances)
+        available = np.ones(N, dtype=bool)
+        first = rng.integers(N)
+        available[first] = False
+        nearest = distances[first].copy()
+        combination = [first]
+        for _ in range(nbody - 1):
+            weights = np.exp(-nearest / length_scale) * available
+            j = rng.choice(N, p=weights / weights.sum())
+            available[j] = False
+            nearest = np.minimum(nearest, distances[j])
+            combination.append(j)
+        return tuple(sorted(int(i) for i in combination))
+
+    @staticmethod
+    def compact_nmer_probability(combination, distances, length_scale):
+        """The probability that draw_compact_nmer() returns combination, summed over the orders its fragments could be picked in."""
+        N = len(distances)
+        probability = 0.0
+        for ordering in itertools.permutations(combination):
+            p = 1.0 / N
+            available = np.ones(N, dtype=bool)
+            available[ordering[0]] = False
+            nearest = distances[ordering[0]].copy()
+            for j in ordering[1:]:
+                weights = np.exp(-nearest / length_scale) * available
+                p *= weights[j] / weights.sum()
+                available[j] = False
+                nearest = np.minimum(nearest, distances[j])
+            probability += p
+        return probability
+
+    def evaluate_on_fragments_sampled(self, sampled_from_order=4, error_target=None, max_samples=1000, batch_size=50,
+                                      importance=False, length_scale=3.0, parallel=False, seed=None):
+        """
+        Estimates the n-body terms from sampled_from_order up to self.highest_order by sampling n-mers
+        instead of evaluating all of them. Lower orders are evaluated exactly.
+
+        For each sampled order, n-mers S are drawn with replacement with probability q(S), and the n-body term
+        is estimated by the mean of dE(S) / q(S) over the draws (the same for the forces), which is unbiased.
+        The increment of a drawn n-mer needs all of its subsets, which are evaluated once and reused.
+        q(S) is uniform, or with importance=True favors compact n-mers (see draw_compact_nmer()),
+        which lowers the variance since the large increments come from compact n-mers.
+
+        Draws are made in batches until the standard error of the order's energy is below error_target
+        or max_samples draws have been made. An order with at most batch_size n-mers is evaluated exactly.
+        The estimate, standard error and number of draws of each order are stored in self.sampling_report.
+
+        Args:
+            sampled_from_order (int): first order of the MBE which is sampled
+            error_target     (float): standard error (hartree) of each sampled order to stop at. None always uses max_samples.
+            max_samples        (int): largest number of draws per order
+            batch_size         (int): number of draws evaluated at once
+            importance        (bool): draw compact n-mers more often
+            length_scale     (float): distance (angstrom) over which the importance weights decay
+            parallel          (bool): evaluate each batch on the worker pool
+            seed               (int): seed of the draws
+        """
+        N = self.check_order()
+        energy_sum, forces_sum, fragment_energy_sum = self.get_work_arrays()
+        rng = np.random.default_rng(seed)
+        distances = self.get_fragment_distances() if importance else None
+
+        increments = {}
+        self.sampling_report = {}
+        for order in range(min(sampled_from_order - 1, self.highest_order)):
+            combinations = self.fragments.get_fragment_combinations(order + 1)
+            self.evaluate_increments(combinations, increments, parallel)
+            for combination in combinations:
+                self.accumulate_nmer(order, *increments[combination], self.fragments.get_atom_indices(combination),
+                                     energy_sum, forces_sum, combination, fragment_energy_sum)
+
+        for order in range(sampled_from_order - 1, self.highest_order):
+            nbody = order + 1
+            nmers = comb(N, nbody)
+            if nmers <= batch_size:
+                combinations = self.fragments.get_fragment_combinations(nbody)
+                self.evaluate_sampled_increments(combinations, increments, parallel)
+                for combination in combinations:
+                    self.accumulate_nmer(order, *increments[combination], self.fragments.get_atom_indices(combination),
+                                         energy_sum, forces_sum, combination, fragment_energy_sum)
+                self.sampling_report[nbody] = {"nmers": nmers, "samples": nmers, "energy": energy_sum[order], "standard_error": 0.0}
+                continue
+
+            weighted_energies = []
+            standard_error = np.inf
+            while len(weighted_energies) < max_samples and (error_target is None or standard_error > error_target):
+                ndraws = min(batch_size, max_samples - len(weighted_energies))
+                if importance:
+                    draws = [self.draw_compact_nmer(nbody, distances, length_scale, rng) for _ in range(ndraws)]
+                else:
+                    draws = [tuple(sorted(int(i) for i in rng.choice(N, nbody, replace=False))) for _ in range(ndraws)]
+                self.evaluate_sampled_increments(draws, increments, parallel)
+                for combination in draws:
+                    q = self.compact_nmer_probability(combination, distances, length_scale) if importance else 1.0 / nmers
+                    energy_increment, forces_increment = increments[combination]
+                    weighted_energies.append(energy_increment / q)
+                    # scaled by the number of draws once sampling stops
+                    self.accumulate_nmer(order, energy_increment / q, forces_increment / q, self.fragments.get_atom_indices(combination),
+                                         energy_sum, forces_sum, combination, fragment_energy_sum)
+                if len(weighted_energies) > 1:
+                    standard_error = np.std(weighted_energies, ddof=1) / np.sqrt(len(weighted_energies))
+
+            nsamples = len(weighted_energies)
+            energy_sum[order] /= nsamples
+            forces_sum[order] /= nsamples
+            if fragment_energy_sum is not None:
+                fragment_energy_sum[order] /= nsamples
+            self.sampling_report[nbody] = {"nmers": nmers, "samples": nsamples, "energy": energy_sum[order], "standard_error": standard_error}
+
+        self.sampling_report["standard_error"] = np.sqrt(sum(report["standard_error"]**2 for report in self.sampling_report.values()))
+        # the sums are already the n-body terms, so there is no combinatorial weighting to do
+        return self.package_results(energy_sum, forces_sum, fragment_energy_sum)
+
+    def evaluate_missing_subsets(self, combinations, increments, parallel=False):
+        """Evaluates the increments of every proper subset of combinations which isn't in increments yet,
+        lowest order first, and returns the subsets which were evaluated."""
+        missing = {}
+        for combination in combinations:
+            for subset_order in range(1, len(combination)):
+                for subset in itertools.combinations(combination, subset_order):
+                    if subset not in increments:
+                        missing.setdefault(subset_order, set()).add(subset)
+        evaluated = []
+        for subset_order in sorted(missing):
+            subsets = sorted(missing[subset_order])
+            self.evaluate_increments(subsets, increments, parallel)
+            evaluated += subsets
+        return evaluated
+
+    def evaluate_sampled_increments(self, combinations, increments, parallel=False):
+        """Evaluates the increments of combinations that aren't in increments yet,
+        after first evaluating every subset of them which is missing, lowest order first."""
+        self.evaluate_missing_subsets(combinations, increments, parallel)
+        missing = sorted({combination for combination in combinations if combination not in increments})
+        if missing:
+            self.evaluate_increments(missing, increments, parallel)
+
+    def evaluate_on_geometry_sampled(self, geometry, sampled_from_order=4, error_target=None, max_samples=1000, batch_size=50,
+                                     importance=False, length_scale=3.0, parallel=False, seed=None):
+        """This is a thin wrapper around evaluate_on_fragments_sampled() which allows
+        raw coordinates to be passed in.
+
+        Args:
+            geometry (ndarray): Nx3 array of cartesian coordinates
+        """
+        self.fragments.fragment_geometry(geometry)
+        return self.evaluate_on_fragments_sampled(sampled_from_order, error_target, max_samples, batch_size,
+                                                  importance, length_scale, parallel, seed)
+
+    def evaluate_on_fragments_symmetric(self, tolerance=1e-3, parallel=False):
+        """
+        Evaluates the MBE using the point-group symmetry of the cluster. The n-mers of each order are
+        grouped into orbits of symmetry-equivalent n-mers (see Symmetry.py) and only one representative
+        of each orbit is evaluated. Every other n-mer in the orbit gets the representative's energy
+        and its forces rotated by the operation and moved onto the n-mer's atoms.
+        For a cluster without symmetry this is the same as evaluate_on_fragments().
+
+        The number of operations found and the n-mers evaluated per order are stored in self.symmetry_report.
+
+        Args:
+            tolerance (float): largest distance (angstrom) between an atom and the image of its symmetry partner
+            parallel   (bool): evaluate the representatives of each order on the worker pool
+        """
+        self.check_order()
+        energy_sum, forces_sum, fragment_energy_sum = self.get_work_arrays()
+        coords = np.vstack([fragment.get_positions() for fragment in self.fragments.fragments])
+        fragment_sizes = [len(labels) for labels in self.fragments.atom_labels]
+        operations = find_symmetry_operations(self.fragments.flattened_atom_labels, coords, fragment_sizes, tolerance)
+
+        self.symmetry_report = {"operations": len(operations)}
+        nmer_energies = {}
+        for order in range(self.highest_order):
+            combinations = self.fragments.get_fragment_combinations(order + 1)
+            orbits = get_nmer_orbits(combinations, operations)
+            representatives = sorted({representative for representative, _ in orbits.values()})
+            results = self.evaluate_nmers(self.fragments.make_nmers_from_combinations(representatives), parallel)
+            results = dict(zip(representatives, results))
+
+            for combination in combinations:
+                representative, k = orbits[combination]
+                rotation, permutation, _ = operations[k]
+                energy, forces = results[representative]
+                atom_indices = permutation[self.fragments.get_atom_indices(representative)]
+                self.accumulate_nmer(order, energy, np.asarray(forces) @ rotation.T, atom_indices, energy_sum, forces_sum)
+                nmer_energies[combination] = energy
+            self.symmetry_report[order + 1] = {"nmers": len(combinations), "evaluated": len(representatives)}
+
+        self.nbody_decomposition(energy_sum, forces_sum)
+        if fragment_energy_sum is not None:
+            self.attribute_fragment_energies(nmer_energies, fragment_energy_sum)
+        return self.package_results(energy_sum, forces_sum, fragment_energy_sum)
+
+    def evaluate_on_geometry_symmetric(self, geometry, tolerance=1e-3, parallel=False):
+        """This is a thin wrapper around evaluate_on_fragments_symmetric() which allows
+        raw coordinates to be passed in.
+
+        Args:
+            geometry (ndarray): Nx3 array of cartesian coordinates
+        """
+        self.fragments.fragment_geometry(geometry)
+        return self.evaluate_on_fragments_symmetric(tolerance, parallel)
+
+    def evaluate_on_fragments_generalized(self, overlapping_fragments=None, nneighbors=1, parallel=False):
+        """
+        Evaluates the generalized MBE of order self.highest_order over overlapping fragments, e.g. each
+        fragment of self.fragments together with its nearest neighbors. Its n-mers are the unions of
+        highest_order overlapping fragments, and the overlaps between them are removed by inclusion-exclusion
+        over their distinct intersections (see Generalized_MBE.py), so each distinct subsystem is evaluated once.
+        A low order over larger fragments can then stand in for a high order over single fragments.
+
+        The subsystems and their coefficients are kept until the overlapping fragments change.
+        The number of overlapping fragments, n-mers and evaluated subsystems are stored in self.generalized_report.
+        There are no separate n-body terms, so if return_mb_terms is set the terms come back as None,
+        and return_order_n can't be used.
+
+        Args:
+            overlapping_fragments (list): tuples of indices of self.fragments making up each overlapping fragment.
+                                          Defaults to each fragment with its nneighbors nearest fragments.
+            nneighbors             (int): neighbors grouped with each fragment if overlapping_fragments isn't given
+            parallel              (bool): evaluate the subsystems on the worker pool
+        """
+        if self.return_order_n is not None:
+            print("The generalized MBE has no separate n-body terms, so it can't return the n-body term of one order.")
+            sys.exit(1)
+        if overlapping_fragments is None:
+            overlapping_fragments = get_neighbor_groups(self.get_fragment_distances(), nneighbors)
+        overlapping_fragments = sorted(tuple(sorted(fragment)) for fragment in overlapping_fragments)
+        if self.highest_order > len(overlapping_fragments):
+            print(f"The order of the generalized MBE, {self.highest_order}, is larger than the number of overlapping fragments, {len(overlapping_fragments)}.")
+            sys.exit(1)
+
+        key = (tuple(overlapping_fragments), self.highest_order)
+        if getattr(self, "_generalized_subsystems", (None,))[0] != key:
+            nfragments = len(self.fragments.fragments)
+            self._generalized_subsystems = (key, get_generalized_subsystems(overlapping_fragments, self.highest_order, nfragments))
+        subsystems = self._generalized_subsystems[1]
+
+        combinations = [combination for combination, _ in subsystems]
+        results = self.evaluate_nmers(self.fragments.make_nmers_from_combinations(combinations), parallel)
+        energy = 0.0
+        forces = np.zeros((len(self.fragments.flattened_atom_labels), 3))
+        for (combination, coefficient), (subsystem_energy, subsystem_forces) in zip(subsystems, results):
+            energy += coefficient * subsystem_energy
+            forces[self.fragments.get_atom_indices(combination)] += coefficient * np.asarray(subsystem_forces)
+
+        self.generalized_report = {"overlapping_fragments": len(overlapping_fragments),
+                                   "nmers": comb(len(overlapping_fragments), self.highest_order),
+                                   "evaluated": len(subsystems)}
+        if self.return_mb_terms:
+            return energy, forces, None
+        return energy, forces
+
+    def evaluate_on_geometry_generalized(self, geometry, overlapping_fragments=None, nneighbors=1, parallel=False):
+        """This is a thin wrapper around evaluate_on_fragments_generalized() which allows
+        raw coordinates to be passed in.
+
+        Args:
+            geometry (ndarray): Nx3 array of cartesian coordinates
+        """
+        self.fragments.fragment_geometry(geometry)
+        return self.evaluate_on_fragments_generalized(overlapping_fragments, nneighbors, parallel)
+
     def evaluate_on_geometry(self, geometry):
         """This is a thin wrapper around evaluate_on_fragments() which allows
         raw coordinates to be passed in, and then fragments those coordinates
@@ -61,311 +856,76 @@ class ASE_MBE_Potential(MBE_Potential):
     Fragments in the form of Atoms objects, and a calculator with which to
     carry out the MBE.
     """
-    def __init__(self, highest_order: int, fragments: Fragments, nproc=8, return_order_n=None, return_mb_terms=False):
+    def __init__(self, highest_order: int, fragments: Fragments, nproc=8, return_order_n=None, return_mb_terms=False, mb_terms: MBE_Terms=None, threads_per_worker=None, cpu_sets=None, executor: Executor=None, warm_start: NMer_Warm_Start=None, keep_nmers=False, chunks_per_worker=None):
         self.highest_order = highest_order
         self.fragments = fragments
-        self._pool = Pool(nproc)
+        if keep_nmers:
+            # build the n-mer Atoms once and move them with the fragments, so calculators can cache results
+            fragments.keep_nmers()
+        self.warm_start = warm_start # an optional NMer_Warm_Start which restarts each n-mer from its previous calculation.
+        if warm_start is not None:
+            warm_start.attach(fragments)
+        self.nproc = nproc
+        self.threads_per_worker = threads_per_worker # BLAS/OpenMP threads per worker, None leaves the defaults.
+        self.cpu_sets = cpu_sets # core sets the workers are pinned to, or 'auto'. See Pools.get_core_sets().
+        if chunks_per_worker is not None:
+            self.chunks_per_worker = chunks_per_worker # chunks each worker gets per evaluation, see submit_reduction().
+        self._executor = executor # runs the parallel evaluate paths, see the executor property
+        self._owns_executor = False
         self.return_order_n = return_order_n # an integer which allows the n-body term to be returned rather than the total.
-        self.return_mb_terms = return_mb_terms
+        self.mb_terms = mb_terms # an optional preallocated MBE_Terms record which is filled instead of returning a dict.
+        self.return_mb_terms = return_mb_terms or mb_terms is not None
 
     @staticmethod
     def evaluate_ase(fragment):
         forces = fragment.get_forces()
         return fragment.get_potential_energy() / Hartree, forces / Hartree * Bohr
 
-    def evaluate_on_fragments(self):
-        """
-        Uses the ASE Calculator object attached to the Fragments to calculate the forces
-        and energies for every fragment in self.fragments.
-
-        This operates directly on the fragments brought in with self.fragments
-        """
-        # this will hang on to the n-body forces and energies summed for all
-        # n-mers. These will then be combined with proper combinatorial weights
-        # to get the total forces and energies.
-        forces_sum = []
-        energy_sum = []
-
-        for order in range(self.highest_order):
-            fragment_combinations = self.fragments.make_nmers(order + 1)
-            
-            atom_indices = self.fragments.get_indices_for_fragment_combination(order + 1)
-
-            # each force sum is the size of forces for total system
-            forces_sum.append(np.zeros( (len(self.fragments.flattened_atom_labels), 3), dtype=np.float64))
-            energy_sum.append(0.0)
-
-            # now get components of the MBE by summing energies and forces for each order
-            for i_frag, fragment in enumerate(fragment_combinations):
-                energy, forces = self.evaluate_ase(fragment)
-                # add forces in the appropriate rows of force sum
-                energy_sum[order] += energy
-                assert(len(forces) == len(fragment))
-                for i_force, force in enumerate(forces):
-                    forces_sum[order][atom_indices[i_frag][i_force]] += force
-
-        ### now that we have the sums for each part, we must weight them by the 
-        ### combinatorial number of times they show up and accumulate the totals.
-        total_forces = np.zeros( (len(self.fragments.flattened_atom_labels), 3), dtype=np.float64)
-        total_energy = 0.0
-
-        nbody_energies = [0 for x in range(self.highest_order)]
-        nbody_forces = [np.zeros_like(total_forces) for x in range(self.highest_order)]
-        
-        # set the appropriate 1-body terms
-        nbody_forces[0] = forces_sum[0]
-        nbody_energies[0] = energy_sum[0]
-        
-        # multiply each many-body sum by the appropriate combinatorial factor
-        N = len(self.fragments.fragments)
-        try:
-            for iMBE in range(1, self.highest_order):
-                for i in range(iMBE+1):
-                    nbody_energies[iMBE] += (-1)**i * comb(N-(iMBE+1)+i,i) * energy_sum[iMBE-i]
-                    nbody_forces[iMBE]   += (-1)**i * comb(N-(iMBE+1)+i,i) * forces_sum[iMBE-i]
-        except ValueError:
-            print(f"The order of the MBE being evaluated seems to be larger than the number of fragments, {N}. Check that you haven't asked for too high of an MBE by asking for a {self.highest_order}-body expansion.")
-            sys.exit(1)
-
-        # accumulate many-body energies and forces
-        total_energy = np.sum(nbody_energies)
-        total_forces = np.sum(nbody_forces, axis=0)
+    def get_task_function(self):
+        """Returns the function which evaluates a single task made by make_task()."""
+        return self.evaluate_ase
 
-        if not self.return_mb_terms:
-            if self.return_order_n == None:
-                return total_energy, total_forces
-            else:
-                return nbody_energies[self.return_order_n-1], nbody_forces[self.return_order_n-1]
-        else:
-            return total_energy, total_forces, self.log_mb_terms(nbody_energies, nbody_forces)
-
-    def evaluate_on_fragments_parallel(self):
+    def make_task(self, nmer, detach=False):
         """
-        Uses the Potential object passed in to calculate the forces and energies for every fragment 
-        in self.fragments.
-
-        This operates directly on the fragments brought in with self.fragments
+        Returns what get_task_function() is called on to evaluate an n-mer. This is the n-mer itself,
+        unless detach is set and the n-mers are kept (see Fragments.keep_nmers()): a kept n-mer is moved
+        in place with the fragments, so while another geometry of it is still waiting to be evaluated,
+        the task is a copy which still shares the n-mer's calculator and its cache.
         """
-        # this will hang on to the n-body forces and energies summed for all
-        # n-mers. These will then be combined with proper combinatorial weights
-        # to get the total forces and energies.
-        all_fragments = []
-        all_indices_into_fragments = []
-        for order in range(self.highest_order):
-            all_fragments += self.fragments.make_nmers(order + 1)
-            all_indices_into_fragments += self.fragments.get_indices_for_fragment_combination(order + 1)
-
-        # evaluate the potential on all fragments
-        energies, forces = map(list, zip(*self._pool.map(self.potential.evaluate, all_fragments)))
-
-        # each force sum is the size of forces for total system
-        forces_sum = np.zeros( (self.highest_order, len(self.fragments.atom_labels), 3), dtype=np.float64)
-        energy_sum = np.zeros( (self.highest_order,) )
-
-        # loop through the appropriate parts of the energies and forces arrays and sum them for each n-body term
-        N = len(self.fragments.fragments)
-        comb_sum = 0
-        global_fragment_index = 0
-        for order in range(self.highest_order):
-            mask = np.full(len(energies), False)
-            mask[np.arange(comb_sum, comb(N, order+1) + comb_sum)] = True
-            energy_sum[order] = np.sum(energies, where=mask)
-
-            for nbody_forces in forces[comb_sum:(comb(N, order+1) + comb_sum)]:
-                indices = all_indices_into_fragments[global_fragment_index]
-                global_fragment_index += 1
-                for i_force, force in enumerate(nbody_forces):
-                    forces_sum[order][indices[i_force]] += force
-            
-            comb_sum += comb(N, order+1)
-
-        ### now that we have the sums for each part, we must weight them by the 
-        ### combinatorial number of times they show up and accumulate the totals.
-        total_forces = np.zeros( (len(self.fragments.atom_labels), 3), dtype=np.float64)
-        total_energy = 0.0
-
-        nbody_energies = [0 for x in range(self.highest_order)]
-        nbody_forces = [np.zeros_like(total_forces) for x in range(self.highest_order)]
-        
-        # set the appropriate 1-body terms
-        nbody_forces[0] = forces_sum[0]
-        nbody_energies[0] = energy_sum[0]
-        
-        # multiply each many-body sum by the appropriate combinatorial factor
-        N = len(self.fragments.fragments)
-        for iMBE in range(1, self.highest_order):
-            for i in range(iMBE+1):
-                nbody_energies[iMBE] += (-1)**i * comb(N-(iMBE+1)+i,i) * energy_sum[iMBE-i]
-                nbody_forces[iMBE]   += (-1)**i * comb(N-(iMBE+1)+i,i) * forces_sum[iMBE-i]
-
-        # accumulate many-body energies and forces
-        total_energy = np.sum(nbody_energies)
-        total_forces = np.sum(nbody_forces, axis=0)
-
-        if not self.return_mb_terms:
-            if self.return_order_n == None:
-                return total_energy, total_forces
-            else:
-                return nbody_energies[self.return_order_n-1], nbody_forces[self.return_order_n-1]
-        else:
-            return total_energy, total_forces, self.log_mb_terms(nbody_energies, nbody_forces)
+        if not detach or getattr(self.fragments, "nmer_store", None) is None:
+            return nmer
+        task = nmer.copy()
+        task.calc = nmer.calc
+        return task
 
 class Classical_MBE_Potential(MBE_Potential):
     """
     Implements an MBE potential which calls out to a Potential object and
     parses the output energy and forces
     """
-    # this is broken. Move the potentials into the fragments object.
-    def __init__(self, highest_order: int, fragments: Fragments, potential: Potential, nproc=8, return_order_n=None, return_mb_terms=False):
+    def __init__(self, highest_order: int, fragments: Fragments, potential: Potential, nproc=8, return_order_n=None, return_mb_terms=False, mb_terms: MBE_Terms=None, threads_per_worker=None, cpu_sets=None, executor: Executor=None, chunks_per_worker=None):
         self.highest_order = highest_order
         self.fragments = fragments
         self.potential = potential
-        self._pool = Pool(nproc)
+        self.nproc = nproc
+        self.threads_per_worker = threads_per_worker # BLAS/OpenMP threads per worker, None leaves the defaults.
+        self.cpu_sets = cpu_sets # core sets the workers are pinned to, or 'auto'. See Pools.get_core_sets().
+        if chunks_per_worker is not None:
+            self.chunks_per_worker = chunks_per_worker # chunks each worker gets per evaluation, see submit_reduction().
+        self._executor = executor # runs the parallel evaluate paths, see the executor property
+        self._owns_executor = False
         self.return_order_n = return_order_n # an integer which allows the n-body term to be returned rather than the total.
-        self.return_mb_terms = return_mb_terms
+        self.mb_terms = mb_terms # an optional preallocated MBE_Terms record which is filled instead of returning a dict.
+        self.return_mb_terms = return_mb_terms or mb_terms is not None
     
-    def evaluate_on_fragments(self):
-        """
-        Uses the Potential object passed in to calculate the forces and energies for every fragment 
-        in self.fragments.
-
-        This operates directly on the fragments brought in with self.fragments
-        """
-        # this will hang on to the n-body forces and energies summed for all
-        # n-mers. These will then be combined with proper combinatorial weights
-        # to get the total forces and energies.
-        forces_sum = []
-        energy_sum = []
-
-        for order in range(self.highest_order):
-            fragment_combinations = self.fragments.make_nmers(order + 1)
-            atom_indices = self.fragments.get_indices_for_fragment_combination(order + 1)
-
-            # each force sum is the size of forces for total system
-            forces_sum.append(np.zeros( (len(self.fragments.atom_labels), 3), dtype=np.float64))
-            energy_sum.append(0.0)
-
-            # now get components of the MBE by summing energies and forces for each order
-            for i_frag, fragment in enumerate(fragment_combinations):
-                energy, forces = self.potential.evaluate(fragment)
-
-                # add forces in the appropriate rows of force sum
-                energy_sum[order] += energy
-                assert(len(forces) == len(fragment))
-                for i_force, force in enumerate(forces):
-                    forces_sum[order][atom_indices[i_frag][i_force]] += force
-
-        ### now that we have the sums for each part, we must weight them by the 
-        ### combinatorial number of times they show up and accumulate the totals.
-        total_forces = np.zeros( (len(self.fragments.atom_labels), 3), dtype=np.float64)
-        total_energy = 0.0
-
-        nbody_energies = [0 for x in range(self.highest_order)]
-        nbody_forces = [np.zeros_like(total_forces) for x in range(self.highest_order)]
-        
-        # set the appropriate 1-body terms
-        nbody_forces[0] = forces_sum[0]
-        nbody_energies[0] = energy_sum[0]
-        
-        # multiply each many-body sum by the appropriate combinatorial factor
-        N = len(self.fragments.fragments)
-        try:
-            for iMBE in range(1, self.highest_order):
-                for i in range(iMBE+1):
-                    nbody_energies[iMBE] += (-1)**i * comb(N-(iMBE+1)+i,i) * energy_sum[iMBE-i]
-                    nbody_forces[iMBE]   += (-1)**i * comb(N-(iMBE+1)+i,i) * forces_sum[iMBE-i]
-        except ValueError:
-            print(f"The order of the MBE being evaluated seems to be larger than the number of fragments, {N}. Check that you haven't asked for too high of an MBE by asking for a {self.highest_order}-body expansion.")
-            sys.exit(1)
-
-        # accumulate many-body energies and forces
-        total_energy = np.sum(nbody_energies)
-        total_forces = np.sum(nbody_forces, axis=0)
-
-        #print(total_energy * 627.5)
-        #print(total_forces * 627.5 / 1.88973)
-
-        if not self.return_mb_terms:
-            if self.return_order_n == None:
-                return total_energy, total_forces
-            else:
-                return nbody_energies[self.return_order_n-1], nbody_forces[self.return_order_n-1]
-        else:
-            return total_energy, total_forces, self.log_mb_terms(nbody_energies, nbody_forces)
-
-    def evaluate_on_fragments_parallel(self):
-        """
-        Uses the Potential object passed in to calculate the forces and energies for every fragment 
-        in self.fragments.
-
-        This operates directly on the fragments brought in with self.fragments
-        """
-        # this will hang on to the n-body forces and energies summed for all
-        # n-mers. These will then be combined with proper combinatorial weights
-        # to get the total forces and energies.
-        all_fragments = []
-        all_indices_into_fragments = []
-        for order in range(self.highest_order):
-            all_fragments += self.fragments.make_nmers(order + 1)
-            all_indices_into_fragments += self.fragments.get_indices_for_fragment_combination(order + 1)
-
-        # evaluate the potential on all fragments
-        energies, forces = map(list, zip(*self._pool.map(self.potential.evaluate, all_fragments)))
-
-        # each force sum is the size of forces for total system
-        forces_sum = np.zeros( (self.highest_order, len(self.fragments.atom_labels), 3), dtype=np.float64)
-        energy_sum = np.zeros( (self.highest_order,) )
-
-        # loop through the appropriate parts of the energies and forces arrays and sum them for each n-body term
-        N = len(self.fragments.fragments)
-        comb_sum = 0
-        global_fragment_index = 0
-        for order in range(self.highest_order):
-            mask = np.full(len(energies), False)
-            mask[np.arange(comb_sum, comb(N, order+1) + comb_sum)] = True
-            energy_sum[order] = np.sum(energies, where=mask)
-
-            for nbody_forces in forces[comb_sum:(comb(N, order+1) + comb_sum)]:
-                indices = all_indices_into_fragments[global_fragment_index]
-                global_fragment_index += 1
-                for i_force, force in enumerate(nbody_forces):
-                    forces_sum[order][indices[i_force]] += force
-            
-            comb_sum += comb(N, order+1)
-
-        ### now that we have the sums for each part, we must weight them by the 
-        ### combinatorial number of times they show up and accumulate the totals.
-        total_forces = np.zeros( (len(self.fragments.atom_labels), 3), dtype=np.float64)
-        total_energy = 0.0
-
-        nbody_energies = [0 for x in range(self.highest_order)]
-        nbody_forces = [np.zeros_like(total_forces) for x in range(self.highest_order)]
-        
-        # set the appropriate 1-body terms
-        nbody_forces[0] = forces_sum[0]
-        nbody_energies[0] = energy_sum[0]
-        
-        # multiply each many-body sum by the appropriate combinatorial factor
-        N = len(self.fragments.fragments)
-        for iMBE in range(1, self.highest_order):
-            for i in range(iMBE+1):
-                nbody_energies[iMBE] += (-1)**i * comb(N-(iMBE+1)+i,i) * energy_sum[iMBE-i]
-                nbody_forces[iMBE]   += (-1)**i * comb(N-(iMBE+1)+i,i) * forces_sum[iMBE-i]
-
-        # accumulate many-body energies and forces
-        total_energy = np.sum(nbody_energies)
-        total_forces = np.sum(nbody_forces, axis=0)
-
-        #print(total_energy * 627.5)
-        #print(total_forces * 627.5 / 1.88973)
-
-        if not self.return_mb_terms:
-            if self.return_order_n == None:
-                return total_energy, total_forces
-            else:
-                return nbody_energies[self.return_order_n-1], nbody_forces[self.return_order_n-1]
-        else:
-            return total_energy, total_forces, self.log_mb_terms(nbody_energies, nbody_forces)
+    def get_task_function(self):
+        """Returns the function which evaluates a single task made by make_task()."""
+        return self.potential.evaluate
+
+    def make_task(self, nmer, detach=False):
+        """Returns what get_task_function() is called on to evaluate an n-mer. The positions are
+        always a copy, so detach makes no difference."""
+        return nmer.get_positions()
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,79 @@
+import sys
+import numpy as np
+
+class MBE_Terms:
+    """
+    Compact record of the n-body terms of an MBE. All of the arrays are allocated
+    once and overwritten in place on every evaluation, so a long trajectory does not
+    allocate a new set of (natoms, 3) force arrays per order on every step.
+    Copy anything that has to outlive the next call.
+    """
+    def __init__(self, highest_order: int, natoms: int, nfragments=None, orders=None, dtype=np.float64, log_forces=True, log_fragment_energies=False):
+        """
+        Args:
+            highest_order         (int): highest order of the MBE this record will be filled by.
+            natoms                (int): number of atoms in the full system.
+            nfragments            (int): number of fragments. Only needed for log_fragment_energies.
+            orders               (list): the n-body orders to keep (e.g. [2, 3]). Defaults to all of them.
+            dtype                       : dtype of the stored forces. np.float32 halves the storage.
+            log_forces           (bool): if False, only the n-body energies are stored.
+            log_fragment_energies(bool): if True, also store the n-body energy attributed to each fragment.
+        """
+        self.highest_order = highest_order
+        self.orders = list(range(1, highest_order+1)) if orders is None else sorted(orders)
+        if self.orders[0] < 1 or self.orders[-1] > highest_order:
+            print(f"The orders stored in MBE_Terms must be between 1 and {highest_order}. Got {self.orders}.")
+            sys.exit(1)
+
+        self.energies = np.zeros(len(self.orders), dtype=np.float64)
+        self.forces = None
+        if log_forces:
+            self.forces = np.zeros((len(self.orders), natoms, 3), dtype=dtype)
+        self.fragment_energies = None
+        if log_fragment_energies:
+            if nfragments is None:
+                print("Need the number of fragments to log the fragment energies.")
+                sys.exit(1)
+            self.fragment_energies = np.zeros((len(self.orders), nfragments), dtype=np.float64)
+
+    @property
+    def wants_fragment_energies(self):
+        return self.fragment_energies is not None
+
+    def record(self, nbody_energies, nbody_forces, nbody_fragment_energies=None):
+        """Copies the requested orders of the n-body terms into the preallocated arrays.
+
+        Args:
+            nbody_energies          (ndarray): (highest_order,) n-body energies
+            nbody_forces            (ndarray): (highest_order, natoms, 3) n-body forces
+            nbody_fragment_energies (ndarray): (highest_order, nfragments) n-body energy of each fragment
+        """
+        for i, order in enumerate(self.orders):
+            self.energies[i] = nbody_energies[order-1]
+            if self.forces is not None:
+                self.forces[i] = nbody_forces[order-1]
+            if self.fragment_energies is not None:
+                self.fragment_energies[i] = nbody_fragment_energies[order-1]
+        return self
+
+    def energy(self, order: int):
+        return self.energies[self.orders.index(order)]
+
+    def forces_of_order(self, order: int):
+        if self.forces is None:
+            return None
+        return self.forces[self.orders.index(order)]
+
+    def as_dict(self):
+        """
+        Returns the stored terms with the same keys as MBE_Potential.log_mb_terms().
+        The values are views into this record, not copies.
+        """
+        mb_terms = {}
+        for i, order in enumerate(self.orders):
+            if self.forces is not None:
+                mb_terms[str(order) + "body_forces"] = self.forces[i]
+            mb_terms[str(order) + "body_energy"] = self.energies[i]
+            if self.fragment_energies is not None:
+                mb_terms[str(order) + "body_fragment_energies"] = self.fragment_energies[i]
+        return mb_terms
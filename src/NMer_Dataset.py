@@ -0,0 +1,236 @@
+"""
+Append-only dataset of the n-mers evaluated by an MBE, e.g. to train machine-learned n-body potentials.
+A dataset is a directory of chunks, each holding chunk_size n-mers as one .npy file per column,
+and an index.json listing the chunks:
+
+    index.json
+    chunk_000000/numbers.npy           atomic number of every atom of every n-mer, concatenated
+                 coordinates.npy       coordinates (angstrom) of every atom
+                 forces.npy            forces (hartree/bohr) on every atom
+                 increment_forces.npy  n-body increment of the forces on every atom
+                 atom_offsets.npy      where the atoms of each n-mer start in the atom columns, plus the total
+                 energy.npy            energy (hartree) of each n-mer
+                 increment.npy         n-body increment (hartree) of each n-mer
+                 order.npy             number of fragments in each n-mer
+                 fragments.npy         fragment indices of every n-mer, concatenated (order of them per n-mer)
+                 frame.npy             frame of the source each n-mer comes from
+                 source.npy            index into the "sources" of index.json, e.g. the xyz file
+
+Chunks are only ever added, and index.json is replaced once a chunk is complete, so a reader
+never sees a partial chunk. Only one writer may have a dataset open at a time: a writer holds the
+file .lock in the directory until it is closed, and a second writer on the same dataset exits
+instead of writing over the first one's chunks. A .lock left behind by a writer which crashed
+can be deleted by hand. NMer_Dataset memory maps the columns, so batches of n-mers can be read
+in any order without loading or parsing the whole dataset.
+"""
+import sys, os
+import json
+import numpy as np
+from ase.data import atomic_numbers, chemical_symbols
+
+__all__ = ['NMer_Dataset_Writer', 'NMer_Dataset']
+
+ATOM_COLUMNS = ["numbers", "coordinates", "forces", "increment_forces"]
+NMER_COLUMNS = ["energy", "increment", "order", "frame", "source"]
+
+def read_index(directory):
+    """Returns the index of the dataset in directory, or an empty index if there isn't one yet."""
+    index_file = os.path.join(directory, "index.json")
+    if not os.path.exists(index_file):
+        return {"chunks": [], "sources": []}
+    with open(index_file) as f:
+        return json.load(f)
+
+class NMer_Dataset_Writer:
+    """
+    Streams n-mers into a dataset directory, see the top of NMer_Dataset.py. The n-mers are buffered
+    and written as a chunk every chunk_size n-mers and on close(). Writing to an existing dataset
+    appends to it. Use as a context manager, or call close(), so the last chunk is written and the
+    dataset is unlocked for the next writer.
+    """
+    def __init__(self, directory, chunk_size=4096, dtype=np.float64):
+        """
+        Args:
+            directory  (str): directory of the dataset, made if it doesn't exist
+            chunk_size (int): number of n-mers per chunk
+            dtype           : dtype of the coordinates and forces. np.float32 halves the storage.
+        """
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+        os.makedirs(directory, exist_ok=True)
+        self.lock_file = self.lock(directory)
+        self.index = read_index(directory)
+        self.clear_buffer()
+
+    @staticmethod
+    def lock(directory):
+        """Creates the lock file of the dataset in directory, which only succeeds if no other writer holds it."""
+        lock_file = os.path.join(directory, ".lock")
+        try:
+            descriptor = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            print(f"The n-mer dataset {directory} is already open in another writer. "
+                  f"If no writer is running, delete {lock_file}.")
+            sys.exit(1)
+        with os.fdopen(descriptor, 'w') as f:
+            f.write(str(os.getpid()))
+        return lock_file
+
+    def clear_buffer(self):
+        self.buffer = {column: [] for column in ATOM_COLUMNS + NMER_COLUMNS + ["fragments"]}
+
+    def get_source_index(self, source):
+        if source not in self.index["sources"]:
+            self.index["sources"].append(source)
+        return self.index["sources"].index(source)
+
+    def add_nmer(self, labels, coordinates, energy, forces, increment, increment_forces, fragment_indices, frame=0, source=""):
+        """
+        Adds one n-mer to the dataset.
+
+        Args:
+            labels                (list): element symbol of each atom
+            coordinates        (ndarray): Mx3 coordinates in angstrom
+            energy               (float): energy of the n-mer in hartree
+            forces             (ndarray): Mx3 forces in hartree/bohr
+            increment            (float): n-body increment of the energy
+            increment_forces   (ndarray): Mx3 n-body increment of the forces
+            fragment_indices     (tuple): indices of the fragments making up the n-mer
+            frame                  (int): frame of the source the n-mer comes from
+            source                 (str): where the n-mer comes from, e.g. the xyz file
+        """
+        self.buffer["numbers"].append(np.array([atomic_numbers[label] for label in labels], dtype=np.uint8))
+        self.buffer["coordinates"].append(np.asarray(coordinates, dtype=self.dtype))
+        self.buffer["forces"].append(np.asarray(forces, dtype=self.dtype))
+        self.buffer["increment_forces"].append(np.asarray(increment_forces, dtype=self.dtype))
+        self.buffer["fragments"].append(np.asarray(fragment_indices, dtype=np.int32))
+        self.buffer["energy"].append(energy)
+        self.buffer["increment"].append(increment)
+        self.buffer["order"].append(len(fragment_indices))
+        self.buffer["frame"].append(frame)
+        self.buffer["source"].append(self.get_source_index(source))
+        if len(self.buffer["energy"]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered n-mers as a new chunk and adds it to the index."""
+        nrecords = len(self.buffer["energy"])
+        if nrecords == 0:
+            return
+        name = f"chunk_{len(self.index['chunks']):06d}"
+        chunk_directory = os.path.join(self.directory, name)
+        os.makedirs(chunk_directory, exist_ok=True)
+
+        columns = {column: np.concatenate(self.buffer[column]) for column in ATOM_COLUMNS + ["fragments"]}
+        columns["atom_offsets"] = np.cumsum([0] + [len(numbers) for numbers in self.buffer["numbers"]], dtype=np.int64)
+        columns["energy"] = np.array(self.buffer["energy"], dtype=np.float64)
+        columns["increment"] = np.array(self.buffer["increment"], dtype=np.float64)
+        columns["order"] = np.array(self.buffer["order"], dtype=np.uint8)
+        columns["frame"] = np.array(self.buffer["frame"], dtype=np.int64)
+        columns["source"] = np.array(self.buffer["source"], dtype=np.int32)
+        for column, values in columns.items():
+            np.save(os.path.join(chunk_directory, column + ".npy"), values)
+
+        self.index["chunks"].append({"name": name, "records": nrecords, "atoms": int(columns["atom_offsets"][-1])})
+        # the index is swapped in whole, so a reader never sees a chunk that isn't finished
+        index_file = os.path.join(self.directory, "index.json")
+        with open(index_file + ".tmp", 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(index_file + ".tmp", index_file)
+        self.clear_buffer()
+
+    def close(self):
+        """Writes the last chunk and unlocks the dataset."""
+        if self.lock_file is None:
+            return
+        try:
+            self.flush()
+        finally:
+            os.remove(self.lock_file)
+            self.lock_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class NMer_Dataset:
+    """
+    Reads a dataset written by NMer_Dataset_Writer. The n-mers are numbered across all chunks,
+    and the columns of each chunk are memory mapped the first time one of its n-mers is read.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.index = read_index(directory)
+        if not self.index["chunks"]:
+            print(f"Found no n-mer dataset in {directory}.")
+            sys.exit(1)
+        self.sources = self.index["sources"]
+        self.chunk_starts = np.cumsum([0] + [chunk["records"] for chunk in self.index["chunks"]])
+        self.chunks = {}
+
+    def __len__(self):
+        return int(self.chunk_starts[-1])
+
+    def get_chunk(self, i):
+        """Returns the memory-mapped columns of chunk i."""
+        if i not in self.chunks:
+            chunk_directory = os.path.join(self.directory, self.index["chunks"][i]["name"])
+            columns = {column: np.load(os.path.join(chunk_directory, column + ".npy"), mmap_mode='r')
+                       for column in ATOM_COLUMNS + NMER_COLUMNS + ["atom_offsets", "fragments"]}
+            columns["fragment_offsets"] = np.cumsum(np.concatenate(([0], columns["order"])), dtype=np.int64)
+            self.chunks[i] = columns
+        return self.chunks[i]
+
+    def __getitem__(self, i):
+        """Returns n-mer i as a dict of its labels, coordinates, forces, energies, fragments, frame and source."""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"n-mer {i} is out of range for a dataset of {len(self)} n-mers")
+        chunk_index = int(np.searchsorted(self.chunk_starts, i, side='right')) - 1
+        chunk = self.get_chunk(chunk_index)
+        row = i - self.chunk_starts[chunk_index]
+        atoms = slice(chunk["atom_offsets"][row], chunk["atom_offsets"][row + 1])
+        fragments = slice(chunk["fragment_offsets"][row], chunk["fragment_offsets"][row + 1])
+        return {"labels": [chemical_symbols[number] for number in chunk["numbers"][atoms]],
+                "numbers": np.array(chunk["numbers"][atoms]),
+                "coordinates": np.array(chunk["coordinates"][atoms]),
+                "forces": np.array(chunk["forces"][atoms]),
+                "increment_forces": np.array(chunk["increment_forces"][atoms]),
+                "energy": float(chunk["energy"][row]),
+                "increment": float(chunk["increment"][row]),
+                "fragments": tuple(int(j) for j in chunk["fragments"][fragments]),
+                "frame": int(chunk["frame"][row]),
+                "source": self.sources[chunk["source"][row]]}
+
+    def get_batch(self, indices):
+        """
+        Returns the n-mers at indices, in that order, as columns ready for a training loader:
+        the per-atom columns (numbers, coordinates, forces, increment_forces) concatenated over the n-mers
+        with atom_offsets marking where each n-mer starts, and the per-n-mer columns as arrays.
+        """
+        indices = np.array(indices, dtype=np.int64)
+        indices[indices < 0] += len(self)
+        out_of_range = (indices < 0) | (indices >= len(self))
+        if np.any(out_of_range):
+            raise IndexError(f"n-mer {indices[out_of_range][0]} is out of range for a dataset of {len(self)} n-mers")
+        chunk_indices = np.searchsorted(self.chunk_starts, indices, side='right') - 1
+        atom_columns = {column: [] for column in ATOM_COLUMNS}
+        nmer_columns = {column: np.empty(len(indices), dtype=self.get_chunk(0)[column].dtype) for column in NMER_COLUMNS}
+        sizes = np.empty(len(indices), dtype=np.int64)
+        for n, (i, chunk_index) in enumerate(zip(indices, chunk_indices)):
+            chunk = self.get_chunk(chunk_index)
+            row = i - self.chunk_starts[chunk_index]
+            start, end = chunk["atom_offsets"][row], chunk["atom_offsets"][row + 1]
+            for column in ATOM_COLUMNS:
+                atom_columns[column].append(chunk[column][start:end])
+            for column in NMER_COLUMNS:
+                nmer_columns[column][n] = chunk[column][row]
+            sizes[n] = end - start
+        batch = {column: np.concatenate(values) for column, values in atom_columns.items()}
+        batch.update(nmer_columns)
+        batch["atom_offsets"] = np.concatenate(([0], np.cumsum(sizes)))
+        return batch
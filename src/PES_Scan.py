@@ -0,0 +1,218 @@
+import sys
+import numpy as np
+from ase.atoms import Atoms
+from numpy.lib.format import open_memmap
+from .MBE_Potential import MBE_Potential
+from .Executors import serial_executor
+
+__all__ = ['Rigid_Body_Scan', 'rotation_matrix', 'single_fragment_grid']
+
+def rotation_matrix(axis, angle):
+    """Returns the 3x3 matrix rotating by angle (radians) about axis, counterclockwise looking down the axis."""
+    axis = np.asarray(axis, dtype=np.float64)
+    axis = axis / np.linalg.norm(axis)
+    K = np.array([[0.0, -axis[2], axis[1]],
+                  [axis[2], 0.0, -axis[0]],
+                  [-axis[1], axis[0], 0.0]])
+    return np.eye(3) + np.sin(angle) * K + (1.0 - np.cos(angle)) * (K @ K)
+
+def single_fragment_grid(nfragments, fragment, translations=None, rotations=None):
+    """
+    Returns the (rotations, translations) of a scan which only moves one fragment, e.g. the
+    second monomer of a dimer, for Rigid_Body_Scan.scan(). Every other fragment stays put.
+
+    Args:
+        nfragments            (int): number of fragments in the system
+        fragment              (int): index of the fragment which moves
+        translations (ndarray): Px3 displacements (angstrom) of the fragment at each grid point
+        rotations    (ndarray): Px3x3 rotations of the fragment about its centroid at each grid point
+    """
+    if translations is None and rotations is None:
+        print("A scan needs translations, rotations, or both.")
+        sys.exit(1)
+    npoints = len(translations) if translations is not None else len(rotations)
+    grid_rotations = np.tile(np.eye(3), (npoints, nfragments, 1, 1))
+    grid_translations = np.zeros((npoints, nfragments, 3))
+    if rotations is not None:
+        grid_rotations[:, fragment] = rotations
+    if translations is not None:
+        grid_translations[:, fragment] = translations
+    return grid_rotations, grid_translations
+
+class Rigid_Body_Scan:
+    """
+    Scans the MBE of a cluster over a grid of rigid-body moves of its fragments, e.g. a dimer or
+    trimer potential energy surface. At each grid point fragment i is rotated by R_i about its
+    centroid and translated by t_i.
+
+    An n-mer's energy only depends on where its fragments are relative to each other, so each n-mer
+    is moved into the frame of its first fragment and only evaluated if that geometry hasn't been
+    seen before. The monomers never change, so they are evaluated once for the whole scan, and a
+    dimer whose fragments don't move relative to each other is evaluated once rather than at every
+    grid point. The evaluations run in batches of grid points on the MBE potential's executor.
+    The potential must be invariant to rigid motions of the whole n-mer, which any isolated PES is.
+
+    The energies and forces of the distinct n-mers are kept until clear() is called, so a second
+    scan of the same fragments reuses them.
+    """
+    def __init__(self, mbe_potential: MBE_Potential, decimals=8):
+        """
+        Args:
+            mbe_potential (MBE_Potential): the MBE to scan. Its fragments at construction are the reference geometry.
+            decimals               (int): n-mer geometries which agree to this many decimals (angstrom) are the same
+        """
+        self.mbe_potential = mbe_potential
+        self.decimals = decimals
+        fragments = mbe_potential.fragments
+        self.reference_coords = [fragment.get_positions() for fragment in fragments.fragments]
+        self.centroids = np.array([np.mean(coords, axis=0) for coords in self.reference_coords])
+        self.calculators = [fragment.calc for fragment in fragments.fragments]
+        fragment_sizes = [len(coords) for coords in self.reference_coords]
+        self.atom_offsets = np.cumsum([0] + fragment_sizes)
+        self.natoms = self.atom_offsets[-1]
+        self.cache = {}
+        self.report = {}
+
+    def clear(self):
+        """Forgets the n-mers evaluated by earlier scans."""
+        self.cache = {}
+
+    def get_geometries(self, rotations, translations):
+        """Returns the PxNx3 geometries of the full system at the grid points given by rotations and translations."""
+        rotations, translations = self.check_grid(rotations, translations)
+        geometries = np.empty((len(rotations), self.natoms, 3))
+        for i, coords in enumerate(self.reference_coords):
+            geometries[:, self.atom_offsets[i]:self.atom_offsets[i+1]] = self.move_fragment(i, coords, rotations[:, i], translations[:, i])
+        return geometries
+
+    def move_fragment(self, i, coords, rotations, translations):
+        """Returns coords of fragment i rotated about its centroid and translated, for every rotation and translation."""
+        return np.einsum('pab,nb->pna', rotations, coords - self.centroids[i]) + (self.centroids[i] + translations)[:, np.newaxis]
+
+    def check_grid(self, rotations, translations):
+        """Fills in the identity for whichever of rotations and translations is None and checks the shapes."""
+        nfragments = len(self.reference_coords)
+        if rotations is None and translations is None:
+            print("A scan needs translations, rotations, or both.")
+            sys.exit(1)
+        npoints = len(rotations) if rotations is not None else len(translations)
+        if rotations is None:
+            rotations = np.tile(np.eye(3), (npoints, nfragments, 1, 1))
+        if translations is None:
+            translations = np.zeros((npoints, nfragments, 3))
+        rotations = np.asarray(rotations, dtype=np.float64)
+        translations = np.asarray(translations, dtype=np.float64)
+        if rotations.shape != (npoints, nfragments, 3, 3) or translations.shape != (npoints, nfragments, 3):
+            print(f"The rotations of a scan must be Px{nfragments}x3x3 and the translations Px{nfragments}x3 for {nfragments} fragments. "
+                  f"Got {rotations.shape} and {translations.shape}.")
+            sys.exit(1)
+        return rotations, translations
+
+    def get_relative_nmers(self, combination, rotations, translations):
+        """
+        Returns the geometry of the n-mer made from combination at every grid point, moved so that its
+        first fragment is back at its reference position. Moving fragment j by (R_j, t_j) and then undoing
+        the move of the first fragment a gives R_a^T (R_j (x - c_j) + c_j + t_j - c_a - t_a) + c_a.
+        """
+        a = combination[0]
+        geometries = []
+        for j in combination:
+            coords = self.move_fragment(j, self.reference_coords[j], rotations[:, j], translations[:, j])
+            coords -= (self.centroids[a] + translations[:, a])[:, np.newaxis]
+            geometries.append(np.einsum('pnb,pba->pna', coords, rotations[:, a]) + self.centroids[a])
+        return np.concatenate(geometries, axis=1)
+
+    def make_task(self, combination, coords):
+        """Returns what the MBE potential's task function evaluates for the n-mer at coords."""
+        labels = [label for i in combination for label in self.mbe_potential.fragments.atom_labels[i]]
+        nmer = Atoms(labels, coords)
+        nmer.calc = self.calculators[combination[0]]
+        return self.mbe_potential.make_task(nmer)
+
+    def scan(self, rotations=None, translations=None, batch_size=256, parallel=False, forces=False, output=None):
+        """
+        Evaluates the MBE at every point of a grid of rigid-body moves.
+
+        Args:
+            rotations    (ndarray): PxNx3x3 rotation of each of the N fragments about its centroid at each of the P points
+            translations (ndarray): PxNx3 translation (angstrom) of each fragment at each point
+            batch_size       (int): grid points whose new n-mers are evaluated together
+            parallel        (bool): evaluate the new n-mers of each batch on the MBE potential's executor
+            forces          (bool): also return the forces
+            output           (str): if given, the results are written batch by batch to
+                                    output + "_energies.npy", "_nbody_energies.npy" and "_forces.npy"
+                                    as they are computed, and the returned arrays are memory maps of them
+        Returns:
+            dict with the energies (P), n-body energies (P x highest order) in hartree, and if asked
+            for the forces (P x natoms x 3) in hartree/bohr. The atoms are in the order of the fragments.
+            The number of n-mers at all grid points and the number actually evaluated are in self.report.
+        """
+        mbe = self.mbe_potential
+        highest_order = mbe.highest_order
+        mbe.check_order()
+        rotations, translations = self.check_grid(rotations, translations)
+        npoints = len(rotations)
+
+        shapes = {"energies": (npoints,), "nbody_energies": (npoints, highest_order)}
+        if forces:
+            shapes["forces"] = (npoints, self.natoms, 3)
+        if output is None:
+            results = {key: np.zeros(shape) for key, shape in shapes.items()}
+        else:
+            results = {key: open_memmap(f"{output}_{key}.npy", mode='w+', dtype=np.float64, shape=shape) for key, shape in shapes.items()}
+
+        executor = mbe.executor if parallel else serial_executor
+        function = mbe.get_task_function()
+        combinations = [mbe.fragments.get_fragment_combinations(order + 1) for order in range(highest_order)]
+        atom_indices = [[mbe.fragments.get_atom_indices(combination) for combination in order_combinations]
+                        for order_combinations in combinations]
+        self.report = {"points": npoints, "nmers": 0, "evaluated": 0}
+
+        for start in range(0, npoints, batch_size):
+            batch = slice(start, min(start + batch_size, npoints))
+            batch_rotations, batch_translations = rotations[batch], translations[batch]
+            nbatch = len(batch_rotations)
+
+            # find the n-mer geometries of this batch which haven't been evaluated yet
+            keys = []
+            new_keys, new_tasks = [], []
+            for order_combinations in combinations:
+                order_keys = []
+                for combination in order_combinations:
+                    nmers = self.get_relative_nmers(combination, batch_rotations, batch_translations)
+                    # adding 0.0 turns -0.0 into 0.0 so they give the same key
+                    rounded = np.round(nmers, self.decimals) + 0.0
+                    combination_keys = [(combination, rounded[p].tobytes()) for p in range(nbatch)]
+                    for p, key in enumerate(combination_keys):
+                        if key not in self.cache:
+                            self.cache[key] = None
+                            new_keys.append(key)
+                            new_tasks.append(self.make_task(combination, nmers[p]))
+                    order_keys.append(combination_keys)
+                keys.append(order_keys)
+
+            for key, (energy, nmer_forces) in zip(new_keys, executor.map(function, new_tasks)):
+                self.cache[key] = (energy, np.asarray(nmer_forces))
+            self.report["nmers"] += nbatch * sum(len(order_combinations) for order_combinations in combinations)
+            self.report["evaluated"] += len(new_keys)
+
+            energy_sum = np.zeros((highest_order, nbatch))
+            forces_sum = np.zeros((highest_order, nbatch, self.natoms, 3)) if forces else None
+            for order in range(highest_order):
+                for combination, combination_keys, indices in zip(combinations[order], keys[order], atom_indices[order]):
+                    for p, key in enumerate(combination_keys):
+                        energy, nmer_forces = self.cache[key]
+                        energy_sum[order, p] += energy
+                        if forces:
+                            # back from the frame of the first fragment to the frame of the grid point
+                            forces_sum[order, p][indices] += nmer_forces @ batch_rotations[p, combination[0]].T
+
+            mbe.nbody_decomposition(energy_sum, forces_sum)
+            results["nbody_energies"][batch] = energy_sum.T
+            results["energies"][batch] = np.sum(energy_sum, axis=0)
+            if forces:
+                results["forces"][batch] = np.sum(forces_sum, axis=0)
+            if output is not None:
+                for array in results.values():
+                    array.flush()
+        return results
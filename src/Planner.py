@@ -0,0 +1,207 @@
+import numpy as np
+import pickle
+import time
+import tracemalloc
+from math import comb
+from .Pools import get_available_cpus
+
+__all__ = ['plan_mbe', 'plan_composite', 'format_plan']
+
+# aim for chunks of at least this many seconds of work, so the per-chunk overhead is negligible
+TARGET_CHUNK_SECONDS = 0.05
+MAX_CHUNKS_PER_WORKER = 16
+
+def count_nmers(mbe_potential):
+    """Returns the number of n-mers per order, using the screening report of a previous
+    adaptive or multilevel evaluation of this potential when there is one. The lower-order
+    n-mers an adaptive evaluation filled in are counted with their own order.
+    """
+    N = len(mbe_potential.fragments.fragments)
+    counts = {}
+    for order in range(1, mbe_potential.highest_order + 1):
+        counts[order] = comb(N, order)
+        for report_name, key in [("screening_report", "evaluated"), ("multilevel_report", "selected")]:
+            report = getattr(mbe_potential, report_name, None)
+            if report is not None and order in report:
+                counts[order] = report[order][key]
+    screening_report = getattr(mbe_potential, "screening_report", None) or {}
+    for order in range(1, mbe_potential.highest_order + 1):
+        for filled_in_order, count in screening_report.get(order, {}).get("filled_in_orders", {}).items():
+            counts[filled_in_order] += count
+    return counts
+
+def sample_combinations(N, order, nsamples, rng):
+    """Draws up to nsamples distinct fragment combinations of one order without enumerating all of them."""
+    samples = set()
+    for _ in range(10 * nsamples):
+        if len(samples) >= min(nsamples, comb(N, order)):
+            break
+        samples.add(tuple(sorted(rng.choice(N, order, replace=False))))
+    return sorted(samples)
+
+def measure_items(mbe_potential, combinations):
+    """
+    Builds the reduction items (see MBE_Potential.make_reduction_items()) of combinations, which are all
+    of one order, and measures their memory with tracemalloc. Returns the items, the bytes per n-mer which
+    the items hold on to until they are evaluated, and the bytes per n-mer of the Atoms which are only
+    alive while the items of an order are built. For an ASE MBE the task is the n-mer itself, so nothing is transient.
+    """
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    nmers = mbe_potential.fragments.make_nmers_from_combinations(combinations)
+    items = [(0, len(combination) - 1, [int(atom) for atom in mbe_potential.fragments.get_atom_indices(combination)],
+              combination, mbe_potential.make_task(nmer)) for combination, nmer in zip(combinations, nmers)]
+    with_nmers = tracemalloc.get_traced_memory()[0]
+    del nmers
+    held = tracemalloc.get_traced_memory()[0]
+    if not tracing:
+        tracemalloc.stop()
+    return items, (held - start) / len(combinations), max(0, with_nmers - held) / len(combinations)
+
+def plan_mbe(mbe_potential, nproc=None, calibrate=True, calibration_samples=3, seed=0):
+    """
+    Dry run of an MBE potential which reports what an evaluation on its current fragments will cost,
+    without evaluating the whole MBE.
+
+    The sizes of the tasks, in memory and pickled, are measured from real n-mers of every order, and if
+    calibrate is True, a few n-mers of every order are evaluated to time the potential. From these, the planner projects the memory
+    of the serial and parallel evaluate paths and the wall time, and recommends nproc and chunks_per_worker,
+    which are both constructor arguments of the MBE potentials.
+
+    Args:
+        mbe_potential          : an ASE_MBE_Potential or Classical_MBE_Potential
+        nproc             (int): number of workers to plan for. Defaults to the available cores.
+        calibrate        (bool): time the potential on a few n-mers of each order
+        calibration_samples (int): number of n-mers timed per order
+        seed              (int): seed for picking the calibration n-mers
+    Returns:
+        dict with an entry per order and totals
+    """
+    fragments = mbe_potential.fragments
+    N = len(fragments.fragments)
+    natoms = len(fragments.flattened_atom_labels)
+    highest_order = mbe_potential.highest_order
+    nproc = nproc or len(get_available_cpus())
+    rng = np.random.default_rng(seed)
+
+    plan = {"fragments": N, "atoms": natoms, "highest_order": highest_order, "orders": {}}
+    if highest_order > N:
+        plan["valid"] = False
+        plan["message"] = f"The order of the MBE, {highest_order}, is larger than the number of fragments, {N}."
+        return plan
+    plan["valid"] = True
+
+    function = mbe_potential.get_task_function()
+    counts = count_nmers(mbe_potential)
+    for order in range(1, highest_order + 1):
+        combinations = sample_combinations(N, order, max(1, calibration_samples), rng)
+        items, item_bytes, transient_bytes = measure_items(mbe_potential, combinations)
+        tasks = [item[4] for item in items]
+        atoms_per_nmer = np.mean([len(item[2]) for item in items])
+
+        seconds_per_nmer = None
+        if calibrate:
+            function(tasks[0]) # don't time anything which only happens on the first call
+            start = time.perf_counter()
+            for task in tasks:
+                function(task)
+            seconds_per_nmer = (time.perf_counter() - start) / len(tasks)
+
+        plan["orders"][order] = {"nmers": counts[order],
+                                 "atoms_per_nmer": atoms_per_nmer,
+                                 "bytes_per_item": item_bytes,
+                                 "transient_bytes_per_nmer": transient_bytes,
+                                 "bytes_per_task": np.mean([len(pickle.dumps(item)) for item in items]),
+                                 "seconds_per_nmer": seconds_per_nmer}
+
+    orders = plan["orders"].values()
+    total_nmers = sum(order["nmers"] for order in orders)
+    work_array_bytes = highest_order * natoms * 3 * 8
+    partial_sum_bytes = highest_order * natoms * 3 * 8
+
+    # both paths build every item up front, and the n-mers of one order at a time while doing so.
+    # The parallel path also pickles the items to the workers, then gets back one partial sum per chunk
+    chunks_per_worker = mbe_potential.chunks_per_worker
+    nchunks = max(1, min(total_nmers, nproc * chunks_per_worker))
+    item_bytes = sum(order["nmers"] * order["bytes_per_item"] for order in orders)
+    transient_bytes = max(order["nmers"] * order["transient_bytes_per_nmer"] for order in orders)
+    task_bytes = sum(order["nmers"] * order["bytes_per_task"] for order in orders)
+    plan["nmers"] = total_nmers
+    plan["peak_memory_parallel_bytes"] = item_bytes + transient_bytes + task_bytes + nchunks * partial_sum_bytes + work_array_bytes
+    plan["worker_memory_bytes"] = task_bytes / nchunks * int(np.ceil(nchunks / nproc)) + partial_sum_bytes
+    plan["peak_memory_serial_bytes"] = item_bytes + transient_bytes + partial_sum_bytes + work_array_bytes
+
+    if calibrate:
+        serial_seconds = sum(order["nmers"] * order["seconds_per_nmer"] for order in orders)
+        recommended_nproc = max(1, min(nproc, total_nmers))
+        # more chunks balance the load better, but each should still hold enough work to amortize its overhead
+        recommended_chunks = int(serial_seconds / recommended_nproc / TARGET_CHUNK_SECONDS)
+        recommended_chunks = max(1, min(MAX_CHUNKS_PER_WORKER, recommended_chunks))
+        # the slowest chunk sets the wall time, so add the largest single n-mer cost on top of a perfect split
+        slowest_nmer = max(order["seconds_per_nmer"] for order in orders)
+        plan["projected_serial_seconds"] = serial_seconds
+        plan["projected_parallel_seconds"] = serial_seconds / recommended_nproc + slowest_nmer
+        plan["recommended_nproc"] = recommended_nproc
+        plan["recommended_chunks_per_worker"] = recommended_chunks
+    return plan
+
+def plan_composite(composite_potential, nproc=None, calibrate=True, calibration_samples=3, seed=0):
+    """
+    Dry run of a Composite_Potential. Plans every member MBE and the residual MBE with plan_mbe(),
+    and times one full system evaluation with the highest order potential if calibrate is True.
+    Since the concurrent path runs all of them at once on the same pool, the projected wall time
+    is the larger of the full system calculation and the pooled MBE work.
+    """
+    residual_mbe, full_potential = composite_potential.full_system_potential
+    members = list(composite_potential.mbe_potentials) + [residual_mbe]
+    plans = [plan_mbe(member, nproc, calibrate, calibration_samples, seed) for member in members]
+    plan = {"members": plans, "valid": all(member_plan["valid"] for member_plan in plans)}
+    if not plan["valid"]:
+        return plan
+
+    plan["nmers"] = sum(member_plan["nmers"] for member_plan in plans)
+    plan["peak_memory_parallel_bytes"] = sum(member_plan["peak_memory_parallel_bytes"] for member_plan in plans)
+    plan["peak_memory_serial_bytes"] = max(member_plan["peak_memory_serial_bytes"] for member_plan in plans)
+    if calibrate:
+        coords = np.vstack([fragment.get_positions() for fragment in composite_potential.fragments.fragments])
+        start = time.perf_counter()
+        full_potential.evaluate(coords)
+        full_seconds = time.perf_counter() - start
+        serial_seconds = sum(member_plan["projected_serial_seconds"] for member_plan in plans)
+        recommended_nproc = max(member_plan["recommended_nproc"] for member_plan in plans)
+        plan["full_system_seconds"] = full_seconds
+        plan["projected_serial_seconds"] = serial_seconds + full_seconds
+        plan["projected_parallel_seconds"] = max(full_seconds, serial_seconds / recommended_nproc)
+        plan["recommended_nproc"] = recommended_nproc
+    return plan
+
+def format_plan(plan):
+    """Returns a plan from plan_mbe() or plan_composite() as a human readable summary."""
+    if "members" in plan:
+        lines = []
+        for i, member_plan in enumerate(plan["members"]):
+            lines.append(f"Member {i}:")
+            lines += ["    " + line for line in format_plan(member_plan).splitlines()]
+        if plan["valid"]:
+            lines.append(f"Total n-mers: {plan['nmers']}")
+            lines.append(f"Peak memory: {plan['peak_memory_parallel_bytes'] / 1e6:.1f} MB parallel, {plan['peak_memory_serial_bytes'] / 1e6:.1f} MB serial")
+            if "projected_serial_seconds" in plan:
+                lines.append(f"Full system: {plan['full_system_seconds']:.3f} s")
+                lines.append(f"Projected time: {plan['projected_serial_seconds']:.2f} s serial, {plan['projected_parallel_seconds']:.2f} s on {plan['recommended_nproc']} processes")
+        return "\n".join(lines)
+
+    if not plan["valid"]:
+        return plan["message"]
+    lines = [f"{plan['fragments']} fragments, {plan['atoms']} atoms, {plan['highest_order']}-body MBE"]
+    for order, order_plan in plan["orders"].items():
+        line = f"{order}-body: {order_plan['nmers']} n-mers of {order_plan['atoms_per_nmer']:.0f} atoms"
+        if order_plan["seconds_per_nmer"] is not None:
+            line += f", {order_plan['seconds_per_nmer'] * 1e3:.3f} ms each"
+        lines.append(line)
+    lines.append(f"Peak memory: {plan['peak_memory_parallel_bytes'] / 1e6:.1f} MB parallel ({plan['worker_memory_bytes'] / 1e6:.1f} MB per worker), {plan['peak_memory_serial_bytes'] / 1e6:.1f} MB serial")
+    if "projected_serial_seconds" in plan:
+        lines.append(f"Projected time: {plan['projected_serial_seconds']:.2f} s serial, {plan['projected_parallel_seconds']:.2f} s on {plan['recommended_nproc']} processes")
+        lines.append(f"Recommended MBE potential arguments: nproc={plan['recommended_nproc']}, chunks_per_worker={plan['recommended_chunks_per_worker']}")
+    return "\n".join(lines)
@@ -0,0 +1,198 @@
+from multiprocessing import Pool, Value
+import atexit, glob, itertools, os, time
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+__all__ = ['Pool_Registry', 'pool_registry', 'acquire_pool', 'release_pool', 'get_core_sets', 'calibrate_worker_layout']
+
+# environment variables read by the usual BLAS and OpenMP runtimes, and by programs like NWChem run from a worker
+THREAD_VARIABLES = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "BLIS_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+def initialize_worker(threads_per_worker, cpu_sets, worker_counter, initializer, initargs):
+    """
+    Runs once in every pool worker. Limits the BLAS/OpenMP threads of the worker, pins it to
+    the next core set in cpu_sets, and then calls the user's initializer.
+    The environment variables only reach libraries which start their thread pools after this point
+    and child processes, so threadpoolctl is used as well if it is installed to resize thread pools
+    which numpy already started.
+    """
+    if threads_per_worker is not None:
+        for variable in THREAD_VARIABLES:
+            os.environ[variable] = str(threads_per_worker)
+        if threadpool_limits is not None:
+            # keep a reference so the limits stay in place for the life of the worker
+            global _worker_thread_limits
+            _worker_thread_limits = threadpool_limits(limits=threads_per_worker)
+    if cpu_sets is not None and hasattr(os, "sched_setaffinity"):
+        with worker_counter.get_lock():
+            worker_index = worker_counter.value
+            worker_counter.value += 1
+        os.sched_setaffinity(0, cpu_sets[worker_index % len(cpu_sets)])
+    if initializer is not None:
+        initializer(*initargs)
+
+def get_available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+def get_numa_nodes():
+    """Returns the available CPUs of each NUMA node, or all available CPUs as one node if the OS doesn't expose them."""
+    available = set(get_available_cpus())
+    nodes = []
+    for cpulist_file in sorted(glob.glob("/sys/devices/system/node/node*/cpulist")):
+        with open(cpulist_file) as f:
+            cpus = []
+            for cpu_range in f.read().strip().split(","):
+                if not cpu_range:
+                    continue
+                bounds = cpu_range.split("-")
+                cpus += list(range(int(bounds[0]), int(bounds[-1]) + 1))
+        node = [cpu for cpu in cpus if cpu in available]
+        if node:
+            nodes.append(node)
+    if not nodes:
+        nodes = [sorted(available)]
+    return nodes
+
+def get_core_sets(nproc, threads_per_worker=1):
+    """
+    Splits the available CPUs into nproc core sets of threads_per_worker cores each.
+    A core set never spans two NUMA nodes, and consecutive workers alternate between nodes
+    so that a pool smaller than the machine still uses every socket.
+    If there are not enough cores, the core sets are reused.
+    """
+    threads_per_worker = max(1, threads_per_worker or 1)
+    blocks_per_node = []
+    for node in get_numa_nodes():
+        blocks = [node[i:i+threads_per_worker] for i in range(0, len(node) - threads_per_worker + 1, threads_per_worker)]
+        if not blocks:
+            blocks = [node]
+        blocks_per_node.append(blocks)
+    interleaved = [block for blocks in itertools.zip_longest(*blocks_per_node) for block in blocks if block is not None]
+    return [tuple(interleaved[i % len(interleaved)]) for i in range(nproc)]
+
+class Pool_Registry:
+    """
+    Process-wide registry of multiprocessing pools. Every MBE potential asks the registry
+    for a pool on its first parallel call, and potentials which ask for the same configuration
+    share the same workers. Pools are reference counted and closed once nobody holds them anymore,
+    or all at once with close() or when a with-block on the registry exits.
+    """
+    def __init__(self):
+        self._pools = {}
+        self._users = {}
+
+    @staticmethod
+    def make_key(nproc, initializer=None, initargs=(), threads_per_worker=None, cpu_sets=None):
+        if cpu_sets is not None:
+            cpu_sets = tuple(tuple(cpu_set) for cpu_set in cpu_sets)
+        return (nproc, initializer, tuple(initargs), threads_per_worker, cpu_sets)
+
+    def acquire(self, nproc, initializer=None, initargs=(), threads_per_worker=None, cpu_sets=None):
+        """Returns a pool with nproc workers, creating it if no pool with this configuration exists yet.
+        Every call to acquire() should be matched by a call to release().
+
+        Args:
+            nproc              (int): number of worker processes
+            initializer   (callable): run once in each worker when it starts
+            initargs         (tuple): arguments passed to initializer
+            threads_per_worker (int): number of BLAS/OpenMP threads each worker may use. None leaves the defaults.
+            cpu_sets          (list): core set each worker is pinned to, e.g. from get_core_sets(), or
+                                      'auto' to build them with get_core_sets(nproc, threads_per_worker).
+        """
+        if isinstance(cpu_sets, str) and cpu_sets == "auto":
+            cpu_sets = get_core_sets(nproc, threads_per_worker)
+        key = self.make_key(nproc, initializer, initargs, threads_per_worker, cpu_sets)
+        if key not in self._pools:
+            if threads_per_worker is None and cpu_sets is None:
+                self._pools[key] = Pool(nproc, initializer=initializer, initargs=tuple(initargs))
+            else:
+                self._pools[key] = Pool(nproc, initializer=initialize_worker,
+                                        initargs=(threads_per_worker, key[4], Value('i', 0), initializer, tuple(initargs)))
+            self._users[key] = 0
+        self._users[key] += 1
+        return self._pools[key]
+
+    def release(self, pool):
+        """Drops one reference to pool and shuts it down if it was the last one."""
+        for key, registered_pool in list(self._pools.items()):
+            if registered_pool is pool:
+                self._users[key] -= 1
+                if self._users[key] <= 0:
+                    self._shutdown(key)
+                return
+
+    def _shutdown(self, key, terminate=False):
+        pool = self._pools.pop(key)
+        del self._users[key]
+        if terminate:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
+    def close(self, terminate=False):
+        """Shuts down every pool in the registry, whether or not it is still referenced.
+        If terminate is True, the workers are stopped without finishing outstanding work.
+        """
+        for key in list(self._pools.keys()):
+            self._shutdown(key, terminate)
+
+    def holds(self, pool):
+        """True if pool is still open and owned by this registry."""
+        return any(registered_pool is pool for registered_pool in self._pools.values())
+
+    def __len__(self):
+        return len(self._pools)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(terminate=exc_type is not None)
+
+# the one registry shared by everything in this process
+pool_registry = Pool_Registry()
+atexit.register(pool_registry.close)
+
+def acquire_pool(nproc, initializer=None, initargs=(), threads_per_worker=None, cpu_sets=None):
+    return pool_registry.acquire(nproc, initializer, initargs, threads_per_worker, cpu_sets)
+
+def release_pool(pool):
+    pool_registry.release(pool)
+
+def calibrate_worker_layout(function, tasks, total_cores=None, pin_workers=True, repeats=1):
+    """
+    Times a short run of function over tasks for every split of total_cores into processes x threads
+    and returns the fastest (nproc, threads_per_worker) along with the timings of every split.
+    For an MBE potential, a few tasks from mbe_potential.make_parallel_tasks() make a good calibration run.
+
+    Args:
+        function  (callable): the function a pool would map over tasks
+        tasks         (list): a short, representative list of tasks
+        total_cores    (int): cores to split between processes and threads. Defaults to all available cores.
+        pin_workers   (bool): pin the workers to NUMA-aware core sets while timing
+        repeats        (int): number of timed runs per split, the best of which is kept
+    """
+    total_cores = total_cores or len(get_available_cpus())
+    timings = {}
+    for threads_per_worker in range(1, total_cores + 1):
+        if total_cores % threads_per_worker != 0:
+            continue
+        nproc = total_cores // threads_per_worker
+        cpu_sets = get_core_sets(nproc, threads_per_worker) if pin_workers else None
+        # a private registry, so calibration pools never end up shared with real work
+        with Pool_Registry() as registry:
+            pool = registry.acquire(nproc, threads_per_worker=threads_per_worker, cpu_sets=cpu_sets)
+            pool.map(function, tasks[:nproc]) # warm up the workers
+            best = float("inf")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                pool.map(function, tasks)
+                best = min(best, time.perf_counter() - start)
+        timings[(nproc, threads_per_worker)] = best
+    return min(timings, key=timings.get), timings
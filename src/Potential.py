@@ -1,13 +1,49 @@
-import sys, os, subprocess, importlib
-from ase.atoms import Atoms
-from ase.units import Bohr, Hartree
-from ase.calculators.nwchem import NWChem
+import sys, os, importlib
+import threading
 import numpy as np
 import ctypes
+from collections import OrderedDict
 
-from numpy.core.fromnumeric import size
+__all__ = ['Potential', 'TTM', 'MBPol', 'make_potential', 'register_potential']
 
-__all__ = ['Potential', 'TTM', 'MBPol']
+# guards making the per-thread storage of the size handles, see Potential.get_size_handle()
+_size_handles_lock = threading.Lock()
+
+# Potentials which can be made by name with make_potential(), as "module:attribute".
+# A module starting with "." is one of this package.
+# Nothing is imported until a potential is made, and the libraries behind the potentials in this
+# module are only loaded on their first evaluation, so importing this module (e.g. in a freshly
+# started worker) doesn't pay for ASE or any compiled potential.
+potential_registry = {
+    "TTM": ".Potential:TTM",
+    "MBPol": ".Potential:MBPol",
+    "Protonated_Water": ".Potential:Protonated_Water",
+    "NWChem": ".Potential:get_ASE_NWChem_Potential",
+}
+
+def register_potential(name: str, location: str):
+    """Makes a potential available to make_potential() by name.
+
+    Args:
+        name     (str): name to make the potential by
+        location (str): "module:attribute" of the class or function which makes it. The module must be importable,
+                        or start with "." for a module of this package.
+    """
+    potential_registry[name] = location
+
+def make_potential(name: str, *args, **kwargs):
+    """Imports the potential registered as name, or at name if it is a "module:attribute" itself,
+    and makes it with args and kwargs."""
+    if name in potential_registry:
+        location = potential_registry[name]
+    elif ":" in name:
+        location = name
+    else:
+        print(f"No potential is registered as {name}. The registered potentials are {', '.join(potential_registry)}, "
+              "or give one as module:attribute.")
+        sys.exit(1)
+    module_name, attribute = location.split(":")
+    return getattr(importlib.import_module(module_name, __package__), attribute)(*args, **kwargs)
 
 # TODO: Rewrite the Fragments class to take Atoms objects.
 #       Move NWChem Potential to be a simple wrapper on the NWChem calculator which
@@ -25,6 +61,8 @@ def get_ASE_NWChem_Potential(theory: str, basis, xc=None, task='gradient', **kwa
                                                    'Si': '6-31g'}
         xc is a string choosing an exchange-correlation functional. This is only required if theory == 'dft'
         """
+        # importing the calculator pulls in most of ase.io, so it only happens when one is asked for
+        from ase.calculators.nwchem import NWChem
         if theory == 'dft':
             return NWChem(theory=theory, basis=basis, task=task, xc=xc)
         else:
@@ -45,7 +83,7 @@ class Potential:
         name_of_module   (str): name of a module containing the function to be called.
         name_of_library  (str): name of a shared library containing the function to be called.
         """
-        if self.path_to_library is None:
+        if path_to_library is None:
             self.path_to_library = os.path.normpath(os.path.join(os.getcwd()))
         else:
             self.path_to_library = os.path.normpath(os.path.join(os.getcwd(), path_to_library))
@@ -68,9 +106,49 @@ class Potential:
         if self.name_of_module and ".py" in self.name_of_module:
             self.name_of_module = self.name_of_module.split(".")[0]
     
+    # number of system sizes whose handles get_size_handle() keeps
+    size_cache_limit = 8
+
     def evaluate(self, coords):
         raise NotImplementedError
 
+    def make_size_handle(self, natoms: int):
+        """Returns whatever this potential needs to evaluate a system of natoms atoms without any further setup,
+        e.g. the library arguments and preallocated buffers. Potentials whose setup depends on the size implement this.
+        """
+        raise NotImplementedError
+
+    def get_size_handle(self, natoms: int):
+        """
+        Returns the handle from make_size_handle() for systems of natoms atoms, only making it the first time
+        this thread sees this size. An MBE alternates between monomers, dimers, trimers, etc., so the handles of the last
+        size_cache_limit sizes are kept and the least recently used one is dropped beyond that.
+        The handles hold the buffers the library writes into, so each thread keeps its own, e.g. when
+        a Thread_Executor evaluates n-mers of the same size at once. They are not pickled either,
+        a copy of the potential in a worker makes its own.
+        """
+        thread_handles = self.__dict__.get("thread_size_handles")
+        if thread_handles is None:
+            with _size_handles_lock:
+                thread_handles = self.__dict__.setdefault("thread_size_handles", threading.local())
+        size_handles = getattr(thread_handles, "size_handles", None)
+        if size_handles is None:
+            size_handles = thread_handles.size_handles = OrderedDict()
+        handle = size_handles.get(natoms)
+        if handle is None:
+            handle = self.make_size_handle(natoms)
+            size_handles[natoms] = handle
+            if len(size_handles) > self.size_cache_limit:
+                size_handles.popitem(last=False)
+        else:
+            size_handles.move_to_end(natoms)
+        return handle
+
+    def __getstate__(self):
+        d = dict(self.__dict__)
+        d.pop('thread_size_handles', None)
+        return d
+
     def initialize_potential(self):
         """
         Initializes a potential which is accessed via an absolute path, self.path_to_library, and a function name.
@@ -113,7 +191,6 @@ class TTM(Potential):
         """
         super().__init__(path_to_library=path_to_library, name_of_function=name_of_function, name_of_module=name_of_module)
         self.model = model
-        self.initialize_potential()
         possible_models = [2, 21, 3]
         if self.model not in possible_models:
             print("The possible TTM versions are 2, 21, or 3. Please choose one of these.")
@@ -130,25 +207,34 @@ class TTM(Potential):
             energy (float): energy of the system in hartree
             forces (ndarray3d): forces of the system in hartree / bohr
         """
+        # the f2py module is only imported on the first evaluation
+        self.initialize_potential()
+        coords = np.asarray(coords, dtype=np.float64)
+        ttm_order, water_order, ttm_coords = self.get_size_handle(len(coords))
         # Sadly, we need to re-order the geometry to TTM format which is all oxygens first.
-        coords = self.ttm_ordering(coords)
+        np.take(coords, ttm_order, axis=0, out=ttm_coords.T)
         os.chdir(self.path_to_library)
-        gradients, energy = self.potential_function(self.model, np.asarray(coords).T, int(len(coords) / 3))
+        gradients, energy = self.potential_function(self.model, ttm_coords, len(coords) // 3)
         os.chdir(self.work_dir)
-        return energy / 627.5, (-self.normal_water_ordering(gradients.T) / 627.5) / 1.88973
+        return energy / 627.5, (-gradients.T[water_order] / 627.5) / 1.88973
+
+    def make_size_handle(self, natoms: int):
+        """Returns the TTM ordering of natoms atoms, the ordering back, and a fortran-ordered 3 x natoms
+        buffer for the reordered coordinates, which f2py then passes on without copying."""
+        atoms = np.arange(natoms).reshape((natoms, 1))
+        return self.ttm_ordering(atoms)[:, 0], self.normal_water_ordering(atoms)[:, 0], np.zeros((3, natoms), order='F')
     
     def __call__(self, coords):
         return self.evaluate(coords)
 
     def __getstate__(self):
-        d = dict(self.__dict__)
+        d = super().__getstate__()
         del d['potential_function']
         return d
 
     def __setstate__(self, d):
         self.__dict__.update(d)
         self.__dict__.update({"potential_function": None})
-        self.initialize_potential()
 
     @staticmethod
     def ttm_ordering(coords):
@@ -190,7 +276,9 @@ class MBPol(Potential):
     def __init__(self, path_to_library: str, name_of_function="calcpotg_", name_of_library="./libmbpol.so"):
         super().__init__(path_to_library=path_to_library, name_of_function=name_of_function, name_of_library=name_of_library)
 
-    def initialize_potential(self, num_waters):
+    def initialize_potential(self, num_waters=None):
+        """Loads the library and sets up the argument types of the potential function.
+        If num_waters is given, self.c_num_waters is set for that many waters too."""
         super().initialize_potential()
         if self.potential_function.argtypes is None:
             self.potential_function.restype = None
@@ -200,38 +288,84 @@ class MBPol(Potential):
                 np.ctypeslib.ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"),
                 np.ctypeslib.ndpointer(ctypes.c_double, flags="C_CONTIGUOUS")
             ]
-        self.num_waters = num_waters
-        self.c_num_waters = ctypes.byref(ctypes.c_int32(self.num_waters))
+        if num_waters is not None:
+            self.num_waters = num_waters
+            self.c_num_waters = self.get_size_handle(3 * num_waters)[0]
+
+    def make_size_handle(self, natoms: int):
+        """Returns the number of waters as a ctypes reference and the energy, coordinate and gradient buffers for natoms atoms."""
+        self.initialize_potential()
+        return ctypes.byref(ctypes.c_int32(natoms // 3)), np.zeros(1), np.zeros(3 * natoms), np.zeros(3 * natoms)
+
     def evaluate(self, coords):
-        if isinstance(coords, np.ndarray):
-            self.initialize_potential(coords.shape[0] // 3)
-        else:
-            self.initialize_potential(len(coords) // 9) # N_w X 3 X 3
-            coords = np.array(coords)
-        coords=np.ascontiguousarray(coords, dtype=np.float64).flatten()
-        grads = np.zeros_like(coords)
-        potential_energy = np.zeros(1)
-        self.potential_function(self.c_num_waters, potential_energy, coords, grads)
-        return potential_energy[0] / 627.5, -np.reshape(grads, (3 * self.num_waters, 3)) / 627.5 / 1.88973
+        coords = np.asarray(coords, dtype=np.float64) # may also be N_w X 3 X 3
+        natoms = coords.size // 3
+        c_num_waters, potential_energy, flat_coords, grads = self.get_size_handle(natoms)
+        flat_coords[:] = coords.ravel()
+        self.potential_function(c_num_waters, potential_energy, flat_coords, grads)
+        return potential_energy[0] / 627.5, -np.reshape(grads, (natoms, 3)) / 627.5 / 1.88973
     
     def __call__(self, coords):
         return self.evaluate(coords)
 
+    def __getstate__(self):
+        # the loaded library can't be pickled, a copy loads its own
+        d = super().__getstate__()
+        for key in ('library', 'potential_function', 'c_num_waters'):
+            d.pop(key, None)
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self.__dict__.update({"library": None, "potential_function": None})
+
 class Protonated_Water(Potential):
     def __init__(self, num_waters: int, library_path: str, do_init=True):
         self.num_waters = num_waters
         self.library_path = library_path
         self.work_dir = os.getcwd()
+        self.do_init = do_init
+        # the module is imported on the first evaluation, see load()
+        self.module = None
+        # the module holds the setup for one number of waters at a time, see initialize_size()
+        self.initialized_waters = None
+
+    def load(self):
+        """Imports the Protonated_Water module and initializes it for self.num_waters if it hasn't been yet."""
+        if self.module is not None:
+            return
         sys.path.insert(0, self.library_path)
         os.chdir(self.library_path)
         self.module = importlib.import_module("Protonated_Water")
         self.energy_function = getattr(self.module, "get_energy")
         self.energy_and_gradient_function = getattr(self.module, "get_energy_and_gradients")
         self.init_function = getattr(self.module, "initialize_potential")
-        if do_init:
+        if self.do_init:
             self.init_function(self.num_waters)
+            self.initialized_waters = self.num_waters
         os.chdir(self.work_dir)
 
+    def initialize_size(self, coords):
+        """Sets the module up for the number of waters in coords if it was last set up for a different number.
+        An MBE groups its n-mers by size, so this only happens when it moves on to the next order."""
+        num_waters = len(coords) // 3
+        if self.do_init and num_waters != self.initialized_waters:
+            os.chdir(self.library_path)
+            self.init_function(num_waters)
+            os.chdir(self.work_dir)
+            self.initialized_waters = num_waters
+
+    def __getstate__(self):
+        d = super().__getstate__()
+        for key in ("module", "energy_function", "energy_and_gradient_function", "init_function"):
+            d.pop(key, None)
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self.module = None
+        self.initialized_waters = None
+
     def evaluate(self, coords, get_gradients=True):
         if get_gradients:
             return self.get_energy(coords)
@@ -242,6 +376,8 @@ class Protonated_Water(Potential):
         """
         Gets potential energy in hartree from coords.
         """
+        self.load()
+        self.initialize_size(coords)
         os.chdir(self.library_path)
         energy = self.energy_function(coords.T)
         os.chdir(self.work_dir)
@@ -251,6 +387,8 @@ class Protonated_Water(Potential):
         """
         Gets potential energy in hartree and gradients in hartree per bohr from coords.
         """
+        self.load()
+        self.initialize_size(coords)
         os.chdir(self.library_path)
         energy, gradients = self.energy_and_gradient_function(coords.T)
         os.chdir(self.work_dir)
@@ -0,0 +1,85 @@
+import numpy as np
+
+__all__ = ['find_symmetry_operations', 'get_nmer_orbits']
+
+def find_symmetry_operations(atom_labels, coords, fragment_sizes, tolerance=1e-3):
+    """
+    Finds the point-group operations of a fragmented cluster, i.e. the rotations and reflections
+    about its centroid which map every atom onto an atom of the same element within tolerance
+    and every fragment onto a whole fragment.
+
+    An orthogonal operation is fixed by where it sends two non-collinear atoms a and b and whether
+    it flips a x b, so every pairing of a and b with equivalent atoms is tried and checked on the
+    whole cluster.
+
+    Args:
+        atom_labels     (list): element symbol of each atom, fragments stored contiguously
+        coords       (ndarray): Nx3 coordinates
+        fragment_sizes  (list): number of atoms in each fragment
+        tolerance      (float): largest distance between an atom and the image of its partner
+    Returns:
+        list of (3x3 rotation R, atom permutation, fragment permutation) with R @ (x_i - c) = x_p[i] - c.
+        The identity is always included.
+    """
+    labels = np.asarray(atom_labels)
+    x = np.asarray(coords, dtype=np.float64) - np.mean(coords, axis=0)
+    natoms = len(x)
+    fragment_of_atom = np.repeat(np.arange(len(fragment_sizes)), fragment_sizes)
+    first_atoms = np.cumsum([0] + list(fragment_sizes))[:-1]
+    identity = (np.eye(3), np.arange(natoms), np.arange(len(fragment_sizes)))
+
+    norms = np.linalg.norm(x, axis=1)
+    a = np.argmax(norms)
+    cross_norms = np.linalg.norm(np.cross(x[a], x), axis=1)
+    b = np.argmax(cross_norms)
+    # a linear cluster has no pair of atoms to fix an operation with
+    if norms[a] < tolerance or cross_norms[b] < tolerance * norms[a]:
+        return [identity]
+    inverse_basis = np.linalg.inv(np.column_stack((x[a], x[b], np.cross(x[a], x[b]))))
+    ab_distance = np.linalg.norm(x[a] - x[b])
+
+    candidates_a = np.flatnonzero((labels == labels[a]) & (np.abs(norms - norms[a]) < tolerance))
+    candidates_b = np.flatnonzero((labels == labels[b]) & (np.abs(norms - norms[b]) < tolerance))
+    operations = []
+    seen = set()
+    for a2 in candidates_a:
+        for b2 in candidates_b:
+            if a2 == b2 or abs(np.linalg.norm(x[a2] - x[b2]) - ab_distance) > tolerance:
+                continue
+            for handedness in (1.0, -1.0):
+                rotation = np.column_stack((x[a2], x[b2], handedness * np.cross(x[a2], x[b2]))) @ inverse_basis
+                # the coordinates only match within tolerance, so snap to the nearest orthogonal matrix
+                u, _, vt = np.linalg.svd(rotation)
+                rotation = u @ vt
+                distances = np.linalg.norm((x @ rotation.T)[:, np.newaxis] - x[np.newaxis], axis=-1)
+                permutation = np.argmin(distances, axis=1)
+                if (distances[np.arange(natoms), permutation].max() > tolerance
+                        or len(set(permutation)) < natoms or np.any(labels[permutation] != labels)):
+                    continue
+                fragment_permutation = fragment_of_atom[permutation[first_atoms]]
+                if np.any(fragment_of_atom[permutation] != fragment_permutation[fragment_of_atom]):
+                    continue
+                if tuple(permutation) in seen:
+                    continue
+                seen.add(tuple(permutation))
+                operations.append((rotation, permutation, fragment_permutation))
+    return operations
+
+def get_nmer_orbits(combinations, operations):
+    """
+    Groups n-mers into orbits under the symmetry operations.
+
+    Args:
+        combinations (list): tuples of fragment indices, e.g. from Fragments.get_fragment_combinations()
+        operations   (list): output of find_symmetry_operations()
+    Returns:
+        dict mapping each combination to (representative combination, index of the operation taking the representative to it)
+    """
+    orbits = {}
+    for combination in combinations:
+        if combination in orbits:
+            continue
+        for k, (_, _, fragment_permutation) in enumerate(operations):
+            image = tuple(sorted(int(i) for i in fragment_permutation[list(combination)]))
+            orbits.setdefault(image, (combination, k))
+    return orbits
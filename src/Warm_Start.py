@@ -0,0 +1,83 @@
+import os, shutil
+
+__all__ = ['NMer_Warm_Start']
+
+class NMer_Warm_Start:
+    """
+    Gives every n-mer of an MBE its own file-based ASE calculator (e.g. NWChem) with a stable
+    scratch directory that persists across geometry steps. Once an n-mer has a converged calculation
+    on disk, its next calculation is run with restart_kw='restart', so NWChem starts from the
+    previous vectors instead of a fresh guess. Because every n-mer has its own directory, parallel
+    workers also no longer write over each other's files.
+
+    The directories belong to one fragmentation. Attaching Fragments with different fragments removes them.
+
+    Example:
+        warm_start = NMer_Warm_Start(get_ASE_NWChem_Potential('scf', 'sto-3g'), "nmer_scratch")
+        mbe = ASE_MBE_Potential(3, fragments, warm_start=warm_start)
+    """
+    def __init__(self, template_calculator, root_directory, database_suffix=".db"):
+        """
+        Args:
+            template_calculator : a calculator whose parameters are copied to every n-mer's calculator
+            root_directory (str): directory holding one subdirectory per n-mer
+            database_suffix (str): suffix of the file whose presence means a calculation can be restarted
+        """
+        self.template_calculator = template_calculator
+        self.root_directory = os.path.abspath(root_directory)
+        self.database_suffix = database_suffix
+        self.calculators = {}
+        self.fragmentation = None
+        self.statistics = {"started": 0, "restarted": 0, "cleanups": 0}
+
+    def attach(self, fragments):
+        """Makes fragments use this store for its n-mer calculators, cleaning up first if its fragmentation is new."""
+        fragmentation = tuple(tuple(labels) for labels in fragments.atom_labels)
+        if self.fragmentation is not None and fragmentation != self.fragmentation:
+            self.cleanup()
+        self.fragmentation = fragmentation
+        fragments.nmer_calculators = self
+
+    def get_label(self, combination):
+        name = "nmer_" + "-".join(str(i) for i in combination)
+        return os.path.join(self.root_directory, name, name)
+
+    def can_restart(self, combination):
+        return os.path.exists(self.get_label(combination) + self.database_suffix)
+
+    def get_calculator(self, combination):
+        """
+        Returns the calculator of the n-mer made from the fragments in combination. The same object is
+        returned on every call, with restart_kw set to restart whenever there is a previous calculation on disk.
+        """
+        calculator = self.calculators.get(combination)
+        if calculator is None:
+            label = self.get_label(combination)
+            os.makedirs(os.path.dirname(label), exist_ok=True)
+            parameters = {key: value for key, value in self.template_calculator.parameters.items()
+                          if key not in ("label", "perm", "scratch", "restart_kw")}
+            calculator = self.template_calculator.__class__(label=label, perm=os.path.dirname(label),
+                                                            scratch=os.path.dirname(label), **parameters)
+            self.calculators[combination] = calculator
+
+        if self.can_restart(combination):
+            calculator.parameters["restart_kw"] = "restart"
+            self.statistics["restarted"] += 1
+        else:
+            calculator.parameters["restart_kw"] = "start"
+            self.statistics["started"] += 1
+        return calculator
+
+    def cleanup(self):
+        """Removes the directories of every n-mer and forgets their calculators."""
+        for combination in self.calculators:
+            shutil.rmtree(os.path.dirname(self.get_label(combination)), ignore_errors=True)
+        self.calculators = {}
+        self.fragmentation = None
+        self.statistics["cleanups"] += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
@@ -1,9 +1,48 @@
-from py_MD.Logger import Logger
-from py_MD.Masses import get_mass_of_element
-from py_MD.Integrator import Integrator, Verlet, Velocity_Verlet
-from py_MD.Fragments import Fragments
-from py_MD.Potential import Potential, TTM, MBPol
-from py_MD.Thermostat import Thermostat, Velocity_Rescaling, Andersen_Thermostat, Langevin_Thermostat, Langevin_Thermostat_GJF
-from py_MD.Dynamics import Dynamics
-from py_MD.MBE_Potential import MBE_Potential
-from py_MD.Interfaces import PotentialCalculator, MBEPotentialCalculator
\ No newline at end of file
+import sys, types, importlib
+# the modules of this package import each other relatively, e.g. "from .Pools import acquire_pool"
+
+# Public names and the module each comes from. A module is only imported when one of its names is
+# first used, so importing the package, e.g. in a freshly started worker, doesn't load ASE, scipy or
+# any potential library.
+_exports = {
+    "get_mass_of_element": "Masses",
+    "Integrator": "Integrator",
+    "Verlet": "Integrator",
+    "Velocity_Verlet": "Integrator",
+    "RESPA": "Integrator",
+    "Fragments": "Fragments",
+    "Potential": "Potential",
+    "TTM": "Potential",
+    "MBPol": "Potential",
+    "make_potential": "Potential",
+    "register_potential": "Potential",
+    "Dynamics": "Dynamics",
+    "MBE_Potential": "MBE_Potential",
+    "ASE_MBE_Potential": "MBE_Potential",
+    "Classical_MBE_Potential": "MBE_Potential",
+    "Composite_Potential": "Composite_Potential",
+    "Rigid_Body_Scan": "PES_Scan",
+    "NMer_Dataset": "NMer_Dataset",
+    "NMer_Dataset_Writer": "NMer_Dataset",
+    "PotentialCalculator": "Interfaces",
+    "MBEPotentialCalculator": "Interfaces",
+}
+
+__all__ = list(_exports)
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module("." + _exports[name], __name__), name)
+    globals()[name] = value
+    return value
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        # importing a submodule sets it as an attribute of the package, which would hide the export
+        # of the same name, e.g. the MBE_Potential class behind the MBE_Potential module
+        if name in _exports and isinstance(value, types.ModuleType):
+            return
+        super().__setattr__(name, value)
+
+sys.modules[__name__].__class__ = _Package
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from .Fragments import Fragments
+from .Potential import Potential
+from .MBE_Potential import Classical_MBE_Potential
+from .Executors import serial_executor
+
+class Toy_Potential(Potential):
+    """
+    A cheap potential for testing the MBE bookkeeping: a gaussian pair term between every two atoms and
+    a 3-body term between every three oxygens, so the MBE of water clusters is exact at third order.
+    Takes angstrom and returns the energy and forces like the other potentials.
+    """
+    def __init__(self):
+        super().__init__()
+
+    def evaluate(self, coords):
+        coords = np.asarray(coords, dtype=np.float64)
+        differences = coords[:, np.newaxis] - coords[np.newaxis]
+        pair_energies = np.exp(-0.3 * np.sum(differences**2, axis=-1))
+        np.fill_diagonal(pair_energies, 0.0)
+        energy = 0.5 * np.sum(pair_energies)
+        forces = np.sum(0.6 * pair_energies[..., np.newaxis] * differences, axis=1)
+
+        oxygens = coords[::3]
+        for i in range(len(oxygens)):
+            for j in range(i + 1, len(oxygens)):
+                for k in range(j + 1, len(oxygens)):
+                    rij, rjk, rik = oxygens[i] - oxygens[j], oxygens[j] - oxygens[k], oxygens[i] - oxygens[k]
+                    triple_energy = 0.01 * np.exp(-0.05 * (rij @ rij + rjk @ rjk + rik @ rik))
+                    energy += triple_energy
+                    forces[3*i] += 0.1 * triple_energy * (rij + rik)
+                    forces[3*j] += 0.1 * triple_energy * (rjk - rij)
+                    forces[3*k] += 0.1 * triple_energy * (-rik - rjk)
+        return energy, forces
+
+class Scaled_Potential(Potential):
+    """A potential scaled by a constant, as a stand-in for a cheaper level of theory."""
+    def __init__(self, potential, scale):
+        super().__init__()
+        self.potential = potential
+        self.scale = scale
+
+    def evaluate(self, coords):
+        energy, forces = self.potential.evaluate(coords)
+        return self.scale * energy, self.scale * forces
+
+def make_water_cluster(nwaters, seed=0, spacing=3.0):
+    """Returns the labels and coordinates of nwaters waters on a jittered cubic grid."""
+    rng = np.random.default_rng(seed)
+    water = np.array([[0.0, 0.0, 0.0], [0.96, 0.0, 0.0], [-0.24, 0.93, 0.0]])
+    side = int(np.ceil(nwaters ** (1 / 3)))
+    sites = np.array([[i, j, k] for i in range(side) for j in range(side) for k in range(side)][:nwaters], dtype=np.float64)
+    coords = np.concatenate([water + spacing * site + rng.normal(scale=0.2, size=3) for site in sites])
+    return ["O", "H", "H"] * nwaters, coords
+
+def make_water_fragments(nwaters, calculator=None, seed=0, spacing=3.0):
+    """Returns Fragments of nwaters waters, one water per fragment."""
+    labels, coords = make_water_cluster(nwaters, seed, spacing)
+    fragments = Fragments.__new__(Fragments)
+    fragments.xyz_file = None
+    fragments.header = [str(len(coords)) + '\n\n']
+    fragments.set_fragments([labels[3*i:3*i+3] for i in range(nwaters)], [coords[3*i:3*i+3] for i in range(nwaters)], calculator)
+    return fragments
+
+@pytest.fixture
+def toy_potential():
+    return Toy_Potential()
+
+@pytest.fixture
+def scaled_toy_potential():
+    """Makes the toy potential scaled by a constant."""
+    return lambda scale: Scaled_Potential(Toy_Potential(), scale)
+
+@pytest.fixture
+def water_cluster():
+    """make_water_cluster(nwaters, seed=0, spacing=3.0)"""
+    return make_water_cluster
+
+@pytest.fixture
+def water_fragments():
+    """make_water_fragments(nwaters, calculator=None, seed=0, spacing=3.0)"""
+    return make_water_fragments
+
+@pytest.fixture
+def toy_mbe(toy_potential):
+    """Makes a Classical_MBE_Potential of the toy potential, serial unless an executor is given,
+    over the given Fragments or that many waters."""
+    def make_toy_mbe(order, fragments, potential=toy_potential, executor=serial_executor, **kwargs):
+        if isinstance(fragments, int):
+            fragments = make_water_fragments(fragments)
+        return Classical_MBE_Potential(order, fragments, potential, executor=executor, **kwargs)
+    return make_toy_mbe
@@ -1,6 +1,8 @@
 #!/usr/bin/python
 
 import numpy as np
+import threading, queue
+import functools
 
 def read_geoms(geom):
     '''
@@ -30,6 +32,116 @@ def read_geoms(geom):
                 break
     return header, atomLabels, allCoords
 
+@functools.lru_cache(maxsize=8)
+def get_atoms_format(labels, precision):
+    """Returns the format string of the atom lines of a frame, with the labels (a tuple) already written in,
+    so it only takes the flattened coordinates. A trajectory has the same labels in every frame, so it's
+    only built once."""
+    coordinate_format = f"%{precision+6}.{precision}f %{precision+6}.{precision}f %{precision+6}.{precision}f\n"
+    return "".join(f"{label.replace('%', '%%'):<2} " + coordinate_format for label in labels)
+
+def format_frame(labels, coords, comment="", precision=14):
+    """
+    Formats one geometry in xyz format. All of the coordinates are formatted with a single string
+    formatting call on the cached format of the atom lines, so there is no python work per atom.
+    This is about twice as fast as np.savetxt, which formats each row separately.
+
+    Args:
+        labels     (list): atom labels
+        coords  (ndarray): Nx3 array of coordinates
+        comment     (str): second line of the xyz frame
+        precision   (int): number of decimals written for each coordinate
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    if len(labels) != len(coords):
+        raise ValueError(f"Got {len(labels)} atom labels for {len(coords)} atoms.")
+    atoms_format = get_atoms_format(tuple(labels), precision)
+    return str(len(coords)) + '\n' + comment.rstrip('\n') + '\n' + atoms_format % tuple(coords.ravel().tolist())
+
+def format_comment(comment="", energy=None, info=None):
+    """
+    Builds an extended xyz comment line from an energy and a dict of other per-frame values,
+    e.g. the n-body energies returned with return_mb_terms=True. Arrays in info are skipped,
+    since only scalars fit on the comment line.
+    """
+    fields = []
+    if comment:
+        fields.append(comment.strip())
+    if energy is not None:
+        fields.append(f"energy={energy:.12f}")
+    if info is not None:
+        for key, value in info.items():
+            if np.ndim(value) == 0:
+                fields.append(f"{key}={value:.12f}" if isinstance(value, (float, np.floating)) else f"{key}={value}")
+    return " ".join(fields)
+
+class Trajectory_Writer:
+    """
+    Writes many geometries to one xyz file through a single buffered handle. Frames are formatted
+    with format_frame(). If background is True, formatting and writing happen on a separate thread,
+    so the caller can get on with the next evaluation while the last frame is written.
+    """
+    def __init__(self, ofile, mode='w', background=False, precision=14, buffer_size=1 << 20):
+        self.ofile = ofile
+        self.precision = precision
+        self.handle = open(ofile, mode, buffering=buffer_size)
+        self.frames_written = 0
+        self._queue = None
+        self._thread = None
+        self._error = None
+        if background:
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._write_queued_frames, daemon=True)
+            self._thread.start()
+
+    def write(self, labels, coords, comment="", energy=None, info=None):
+        """
+        Writes one geometry. energy and the scalars in info are added to the comment line as
+        extended xyz key=value fields. The coordinates are copied, so the caller may reuse its array.
+        """
+        comment = format_comment(comment, energy, info)
+        if self._queue is None:
+            self.handle.write(format_frame(labels, coords, comment, self.precision))
+            self.frames_written += 1
+        else:
+            if self._error is not None:
+                raise self._error
+            self._queue.put((list(labels), np.array(coords, dtype=np.float64), comment))
+
+    def _write_queued_frames(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                self._queue.task_done()
+                return
+            try:
+                self.handle.write(format_frame(*frame, self.precision))
+                self.frames_written += 1
+            except Exception as error:
+                self._error = error
+            self._queue.task_done()
+
+    def flush(self):
+        """Waits until every frame handed to write() is written and flushes the file."""
+        if self._queue is not None:
+            self._queue.join()
+        self.handle.flush()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self.handle.close()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
 def write_geoms(header, labels, coords, ofile=None):
     """
     args: header, labels, and coords as output by read_geoms
@@ -38,16 +150,10 @@ def write_geoms(header, labels, coords, ofile=None):
     Writes the the moelcules to stdout in xyz format if no ofile is specified.
     Otherwise, write the geometries to ofile.
     """
-    for i, head in enumerate(header):
-        output = head
-        for j, vec in enumerate(coords[i]):
-            output += (labels[i][j] + " " +
-                      np.array2string(np.array(vec), precision=14, separator=' ', suppress_small=True).strip('[]') + '\n')
-        if ofile is None:
-            print(output)
-        elif i == 0:
-            with open(ofile, 'w') as f:
-                f.write(output)
-        else:
-            with open(ofile, 'a') as f:
-                f.write(output)
+    if ofile is None:
+        for i, head in enumerate(header):
+            print(format_frame(labels[i], coords[i], head.split('\n', 1)[1]))
+        return
+    with Trajectory_Writer(ofile) as writer:
+        for i, head in enumerate(header):
+            writer.write(labels[i], coords[i], head.split('\n', 1)[1])
@@ -1,7 +1,7 @@
-from Fragments import Fragments
-from read_geometries import read_geoms
-from Potential import get_ASE_NWChem_Potential
-from MBE_Potential import ASE_MBE_Potential
+from .Fragments import Fragments
+from .read_geometries import read_geoms
+from .Potential import get_ASE_NWChem_Potential
+from .MBE_Potential import ASE_MBE_Potential
 
 nwchem = get_ASE_NWChem_Potential('scf', 'sto-3g')
 w20_frags = Fragments("data/W20_global_minimum_ttm21f_fragmented.xyz", nwchem)
@@ -0,0 +1,39 @@
+import os
+import json
+import numpy as np
+import pytest
+from ase.calculators.lj import LennardJones
+from .Batch import load_manifest, load_potential, run_batch
+from .Fragments import Fragments
+from .MBE_Potential import ASE_MBE_Potential
+from .Executors import serial_executor
+from .Potential import TTM
+
+W20 = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "W20_global_minimum_ttm21f.xyz")
+
+def test_potentials_are_made_by_make_potential(toy_potential):
+    potential, is_ase = load_potential({"type": "TTM", "kwargs": {"path_to_library": ".", "model": 2}})
+    assert isinstance(potential, TTM) and potential.model == 2 and not is_ase
+    potential, is_ase = load_potential({"type": "src.conftest:Toy_Potential"})
+    assert type(potential) is type(toy_potential) and not is_ase
+    calculator, is_ase = load_potential({"type": "ase.calculators.lj:LennardJones", "kwargs": {"sigma": 1.0}})
+    assert is_ase and calculator.parameters.sigma == 1.0
+    with pytest.raises(SystemExit):
+        load_potential({"type": "Not_A_Potential"})
+
+def test_batch_matches_direct_mbe(tmp_path, toy_mbe):
+    manifest_file = tmp_path / "manifest.json"
+    manifest_file.write_text(json.dumps({
+        "output": str(tmp_path / "results.jsonl"),
+        "potentials": {"toy": {"type": "src.conftest:Toy_Potential"},
+                       "lj": {"type": "ase.calculators.lj:LennardJones", "kwargs": {"sigma": 1.0, "epsilon": 0.01, "rc": 10.0}},
+                       "missing": {"type": "Not_A_Potential"}},
+        "defaults": {"order": 2, "parallel": False, "fragmentation": "connectivity", "xyz": W20},
+        "jobs": [{"potential": "toy", "name": "toy"}, {"potential": "lj", "name": "lj"}, {"potential": "missing", "name": "missing"}]}))
+    results = {result["name"]: result for result in run_batch(load_manifest(manifest_file), nproc=1)}
+
+    toy = toy_mbe(2, Fragments.from_connectivity(W20, None))
+    assert np.isclose(results["toy"]["energy"], toy.evaluate_on_fragments()[0], rtol=1e-12)
+    lj = ASE_MBE_Potential(2, Fragments.from_connectivity(W20, LennardJones(sigma=1.0, epsilon=0.01, rc=10.0)), executor=serial_executor)
+    assert np.isclose(results["lj"]["energy"], lj.evaluate_on_fragments()[0], rtol=1e-12)
+    assert "error" in results["missing"]
@@ -0,0 +1,24 @@
+import numpy as np
+from .Composite_Potential import Composite_Potential
+from .Executors import Process_Executor, Thread_Executor
+
+def test_concurrent_matches_sequential(toy_potential, scaled_toy_potential, water_fragments):
+    fragments = water_fragments(5)
+    coords = np.vstack(fragments.fragment_coords)
+    orders_and_potentials = {1: scaled_toy_potential(0.9), 2: scaled_toy_potential(1.1), 3: toy_potential}
+    for executor in (Thread_Executor(2), Process_Executor(2)):
+        composite = Composite_Potential(orders_and_potentials, fragments, executor=executor)
+        energy, gradients = composite.get_energy_and_gradients(coords)
+        concurrent_energy, concurrent_gradients = composite.get_energy_and_gradients(coords, parallel_MBE=True)
+        executor.close()
+        assert np.isclose(concurrent_energy, energy, rtol=1e-12)
+        assert np.allclose(concurrent_gradients, gradients, atol=1e-12)
+
+    # the 3-body potential only enters through the full system and residual, so with
+    # the same potential at every order the composite is the full potential
+    composite = Composite_Potential({2: toy_potential, 3: toy_potential}, fragments, executor=Thread_Executor(2))
+    energy, gradients = composite.get_energy_and_gradients(coords, parallel_MBE=True)
+    composite.executor.close()
+    full_energy, full_gradients = toy_potential.evaluate(coords)
+    assert np.isclose(energy, full_energy, rtol=1e-12)
+    assert np.allclose(gradients, full_gradients, atol=1e-12)
@@ -0,0 +1,45 @@
+import itertools
+import numpy as np
+from .Connectivity import get_covalent_radii, find_bonds, find_molecules, group_molecules
+
+def brute_force_bonds(atom_labels, coords, bond_scale=1.2):
+    radii = get_covalent_radii(atom_labels) * bond_scale
+    return {(i, j) for i, j in itertools.combinations(range(len(coords)), 2)
+            if np.linalg.norm(coords[i] - coords[j]) < radii[i] + radii[j]}
+
+def brute_force_groups(molecules, coords, molecules_per_fragment):
+    """The greedy grouping, comparing each seed with every unassigned molecule."""
+    centroids = np.array([np.mean(coords[molecule], axis=0) for molecule in molecules])
+    unassigned = np.ones(len(molecules), dtype=bool)
+    fragments = []
+    for seed in range(len(molecules)):
+        if unassigned[seed]:
+            candidates = np.flatnonzero(unassigned)
+            distances = np.linalg.norm(centroids[candidates] - centroids[seed], axis=1)
+            members = np.sort(candidates[np.argsort(distances, kind='stable')[:molecules_per_fragment]])
+            unassigned[members] = False
+            fragments.append(np.concatenate([molecules[member] for member in members]))
+    return fragments
+
+def test_bonds_match_brute_force(water_cluster):
+    labels, coords = water_cluster(27, spacing=3.5)
+    bonds = find_bonds(labels, coords)
+    assert {tuple(bond) for bond in bonds} == brute_force_bonds(labels, coords)
+    assert len(bonds) == 2 * 27
+    assert len(find_molecules(labels, coords)) == 27
+
+def test_bonds_of_a_sparse_system(water_cluster):
+    """Waters far apart along a diagonal would need ~1e17 cells in a grid over the bounding box."""
+    labels, coords = water_cluster(4)
+    coords[6:] += 1e6
+    assert {tuple(bond) for bond in find_bonds(labels, coords)} == brute_force_bonds(labels, coords)
+
+def test_grouping_matches_brute_force(water_cluster):
+    labels, coords = water_cluster(64, seed=3, spacing=3.5)
+    molecules = find_molecules(labels, coords)
+    for molecules_per_fragment in (1, 2, 3, 5):
+        fragments = group_molecules(molecules, coords, molecules_per_fragment)
+        reference = brute_force_groups(molecules, coords, molecules_per_fragment)
+        assert len(fragments) == len(reference) == -(-64 // molecules_per_fragment)
+        for fragment, reference_fragment in zip(fragments, reference):
+            assert np.array_equal(fragment, reference_fragment)
@@ -0,0 +1,104 @@
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .Potential import Potential
+from .Executors import serial_executor, Process_Executor, Thread_Executor, Futures_Executor
+from . import Pools
+from .Pools import Pool_Registry, pool_registry, get_core_sets, calibrate_worker_layout
+
+def square(x):
+    return x * x
+
+def test_executors_give_the_same_mbe(toy_mbe, toy_potential, water_fragments):
+    reference = toy_mbe(3, 5).evaluate_on_fragments()
+    # the toy potential has no terms beyond 3-body, so the MBE is exact
+    full_energy, full_forces = toy_potential.evaluate(np.vstack(water_fragments(5).fragment_coords))
+    assert np.isclose(reference[0], full_energy, rtol=1e-12)
+    assert np.allclose(reference[1], full_forces, atol=1e-12)
+
+    for executor in (Process_Executor(2), Thread_Executor(2), Futures_Executor(ThreadPoolExecutor(2))):
+        with toy_mbe(3, 5, executor=executor) as mbe:
+            energy, forces = mbe.evaluate_on_fragments_parallel()
+            batch = mbe.evaluate_on_geometries_parallel([np.vstack(mbe.fragments.fragment_coords)] * 2)
+        executor.close()
+        assert np.isclose(energy, reference[0], rtol=1e-12)
+        assert np.allclose(forces, reference[1], atol=1e-12)
+        for batch_energy, batch_forces in batch:
+            assert np.isclose(batch_energy, reference[0], rtol=1e-12)
+            assert np.allclose(batch_forces, reference[1], atol=1e-12)
+
+class Buffered_Potential(Potential):
+    """Evaluates a potential on coordinates copied into a buffer per system size, like the compiled potentials do."""
+    def __init__(self, potential):
+        super().__init__()
+        self.potential = potential
+
+    def make_size_handle(self, natoms):
+        return np.zeros((natoms, 3))
+
+    def evaluate(self, coords):
+        buffer = self.get_size_handle(len(coords))
+        buffer[:] = coords
+        # lets another thread write into a shared buffer in between
+        time.sleep(1e-4)
+        return self.potential.evaluate(buffer)
+
+def test_threads_match_serial_with_buffered_potential(toy_mbe, toy_potential):
+    potential = Buffered_Potential(toy_potential)
+    reference = toy_mbe(3, 6, potential).evaluate_on_fragments()
+    executor = Thread_Executor(4)
+    energy, forces = toy_mbe(3, 6, potential, executor=executor).evaluate_on_fragments_parallel()
+    executor.close()
+    assert np.isclose(energy, reference[0], rtol=1e-12)
+    assert np.allclose(forces, reference[1], atol=1e-12)
+
+def test_executor_contract():
+    for executor in (serial_executor, Process_Executor(2), Thread_Executor(2), Futures_Executor(ThreadPoolExecutor(2))):
+        assert executor.map(square, [1, 2, 3]) == [1, 4, 9]
+        assert executor.starmap_async(pow, [(2, 3), (3, 2)]).get() == [8, 9]
+        assert executor.apply_async(pow, (2, 5)).get() == 32
+        assert executor.get_nchunks(100, 4) >= 1
+        executor.close()
+
+def test_process_executors_share_pools():
+    first, second, other = Process_Executor(2), Process_Executor(2), Process_Executor(3)
+    try:
+        assert first.pool is second.pool
+        assert other.pool is not first.pool
+        pool = first.pool
+        first.close()
+        # still held by the second executor
+        assert pool_registry.holds(pool)
+        second.close()
+        assert not pool_registry.holds(pool)
+    finally:
+        for executor in (first, second, other):
+            executor.close()
+
+def test_pool_registry_reference_counts():
+    with Pool_Registry() as registry:
+        pool = registry.acquire(2)
+        assert registry.acquire(2) is pool
+        assert len(registry) == 1
+        registry.release(pool)
+        assert registry.holds(pool)
+        registry.release(pool)
+        assert not registry.holds(pool)
+        assert len(registry) == 0
+
+        pool = registry.acquire(2)
+    # the with-block closes everything which is still held
+    assert not registry.holds(pool)
+
+def test_core_sets_alternate_between_numa_nodes(monkeypatch):
+    monkeypatch.setattr(Pools, "get_numa_nodes", lambda: [[0, 1, 2, 3], [4, 5, 6, 7]])
+    assert get_core_sets(4, 2) == [(0, 1), (4, 5), (2, 3), (6, 7)]
+    assert get_core_sets(3, 4) == [(0, 1, 2, 3), (4, 5, 6, 7), (0, 1, 2, 3)]
+    # a worker wider than a node gets the whole node
+    assert get_core_sets(2, 8) == [(0, 1, 2, 3), (4, 5, 6, 7)]
+
+def test_calibrate_worker_layout(toy_mbe):
+    function, tasks = toy_mbe(2, 5).make_parallel_tasks()
+    best, timings = calibrate_worker_layout(function, tasks, total_cores=2, pin_workers=False)
+    assert set(timings) == {(2, 1), (1, 2)}
+    assert best in timings and timings[best] == min(timings.values())
@@ -0,0 +1,44 @@
+import itertools
+import numpy as np
+import pytest
+from .Generalized_MBE import get_neighbor_groups, get_generalized_subsystems
+
+def brute_force_coefficients(overlapping_fragments, order):
+    """Sums (-1)^(|A|+1) onto the intersection of every nonempty set A of n-mers."""
+    nmers = list({frozenset().union(*map(frozenset, combination)) for combination in itertools.combinations(overlapping_fragments, order)})
+    coefficients = {}
+    for size in range(1, len(nmers) + 1):
+        for subset in itertools.combinations(nmers, size):
+            intersection = frozenset.intersection(*subset)
+            if intersection:
+                coefficients[intersection] = coefficients.get(intersection, 0) + (-1) ** (size + 1)
+    return {tuple(sorted(subsystem)): coefficient for subsystem, coefficient in coefficients.items() if coefficient != 0}
+
+def test_coefficients_match_inclusion_exclusion():
+    cases = [([(0, 1), (1, 2), (2, 3), (3, 0)], 1),
+             ([(0, 1), (1, 2), (2, 3), (3, 0)], 2),
+             ([(0, 1, 2), (2, 3), (3, 4, 5), (1, 5)], 2),
+             ([(0,), (1,), (2,), (3,)], 2)]
+    for overlapping_fragments, order in cases:
+        assert dict(get_generalized_subsystems(overlapping_fragments, order)) == brute_force_coefficients(overlapping_fragments, order)
+
+def test_single_fragments_give_mbe_coefficients():
+    # the MBE of order 2 over 4 fragments: each dimer once, each monomer 1 - 3 times
+    subsystems = dict(get_generalized_subsystems([(i,) for i in range(4)], 2))
+    assert all(subsystems[dimer] == 1 for dimer in itertools.combinations(range(4), 2))
+    assert all(subsystems[(i,)] == -2 for i in range(4))
+    assert len(subsystems) == 10
+
+def test_overlapping_fragments_must_cover_the_system(toy_mbe):
+    assert len(get_generalized_subsystems([(0, 1), (1, 2)], 1, nfragments=3)) == 3
+    for overlapping_fragments in ([(0, 1), (1, 2)], [(0, 1), (2, 3), (3, 4)]):
+        with pytest.raises(SystemExit):
+            get_generalized_subsystems(overlapping_fragments, 1, nfragments=4)
+    with pytest.raises(SystemExit):
+        toy_mbe(2, 4).evaluate_on_fragments_generalized([(0, 1), (1, 2)])
+
+def test_neighbor_groups():
+    positions = np.array([0.0, 1.0, 3.0, 10.0])
+    distances = np.abs(positions[:, np.newaxis] - positions[np.newaxis])
+    assert get_neighbor_groups(distances, 1) == [(0, 1), (1, 2), (2, 3)]
+    assert get_neighbor_groups(distances, 1, cutoff=5.0) == [(0, 1), (1, 2), (3,)]
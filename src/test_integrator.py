@@ -0,0 +1,47 @@
+import numpy as np
+from .Integrator import Velocity_Verlet, RESPA, Residual_Potential, ANGSTROM_TO_BOHR
+
+def in_atomic_units(potential):
+    """The toy potential's forces are per angstrom, the integrators expect them per bohr."""
+    def evaluate(coords):
+        energy, forces = potential(coords)
+        return energy, forces / ANGSTROM_TO_BOHR
+    return evaluate
+
+def run(integrator, positions, nsteps):
+    velocities = np.zeros_like(positions)
+    energies = []
+    for _ in range(nsteps):
+        positions, velocities = integrator.step(positions, velocities)
+        energies.append(integrator.potential_energy + integrator.kinetic_energy(velocities))
+    return positions, velocities, np.array(energies)
+
+def test_respa_with_one_inner_step_is_velocity_verlet(toy_mbe, toy_potential, water_fragments):
+    fragments = water_fragments(4)
+    labels, positions = fragments.flattened_atom_labels, np.vstack(fragments.fragment_coords) * ANGSTROM_TO_BOHR
+    full = in_atomic_units(toy_potential.evaluate)
+    fast = in_atomic_units(toy_mbe(2, fragments).evaluate_on_geometry)
+
+    reference = run(Velocity_Verlet(full, labels, 0.2), positions, 20)
+    respa = RESPA(fast, Residual_Potential(full, fast), labels, 0.2, n_inner=1)
+    for value, reference_value in zip(run(respa, positions, 20), reference):
+        assert np.allclose(value, reference_value, rtol=1e-9, atol=1e-12)
+    assert respa.force_evaluations == {"fast": 21, "slow": 21}
+
+def test_respa_conserves_energy(toy_mbe, toy_potential, water_fragments):
+    fragments = water_fragments(4)
+    labels, positions = fragments.flattened_atom_labels, np.vstack(fragments.fragment_coords) * ANGSTROM_TO_BOHR
+    full = in_atomic_units(toy_potential.evaluate)
+    fast = in_atomic_units(toy_mbe(2, fragments).evaluate_on_geometry)
+
+    drifts = []
+    for dt in (0.1, 0.05):
+        respa = RESPA(fast, Residual_Potential(full, fast), labels, dt, n_inner=4)
+        _, velocities, energies = run(respa, positions, int(round(5.0 / dt)))
+        assert respa.force_evaluations["slow"] == int(round(5.0 / dt)) + 1
+        # the waters fly apart, and the total energy stays put while they do
+        assert respa.kinetic_energy(velocities) > 0.5 * abs(energies[0])
+        drifts.append(np.max(np.abs(energies - energies[0])))
+    assert drifts[1] < 1e-4 * abs(energies[0])
+    # the error is second order in the time step
+    assert 3.0 < drifts[0] / drifts[1] < 5.0
@@ -0,0 +1,58 @@
+import numpy as np
+from ase import Atoms
+from ase.calculators.lj import LennardJones
+from .MBE_Potential import ASE_MBE_Potential
+from .Executors import serial_executor
+from .Interfaces import MBEPotentialCalculator
+import pytest
+
+@pytest.fixture
+def images(water_cluster):
+    labels, coords = water_cluster(4)
+    return [Atoms(labels, coords + np.random.default_rng(seed).normal(scale=0.1, size=coords.shape)) for seed in range(3)]
+
+@pytest.fixture
+def make_calculator(water_fragments):
+    def make_mbe_calculator(keep_nmers):
+        calculator = LennardJones(sigma=1.0, epsilon=0.01, rc=10.0)
+        return MBEPotentialCalculator(ASE_MBE_Potential(3, water_fragments(4, calculator), executor=serial_executor, keep_nmers=keep_nmers))
+    return make_mbe_calculator
+
+@pytest.fixture
+def get_single_image_results(make_calculator):
+    def get_results(images):
+        results = []
+        for atoms in images:
+            atoms = atoms.copy()
+            atoms.calc = make_calculator(keep_nmers=False)
+            results.append((atoms.get_potential_energy(), atoms.get_forces()))
+        return results
+    return get_results
+
+def test_calculate_images_matches_single_images(images, make_calculator, get_single_image_results):
+    reference = get_single_image_results(images)
+    assert len(set(energy for energy, _ in reference)) == len(images)
+    for keep_nmers in (False, True):
+        energies, forces = make_calculator(keep_nmers).calculate_images(images)
+        for (reference_energy, reference_forces), energy, image_forces in zip(reference, energies, forces):
+            assert np.isclose(energy, reference_energy, rtol=1e-12)
+            assert np.allclose(image_forces, reference_forces, rtol=1e-12, atol=1e-14)
+
+def test_attached_images_are_evaluated_together(images, make_calculator, get_single_image_results):
+    reference = get_single_image_results(images)
+    for keep_nmers in (False, True):
+        calculator = make_calculator(keep_nmers)
+        calculator.attach(images)
+        # the first image evaluates all three, the others use the stored results
+        energies = [atoms.get_potential_energy() for atoms in images]
+        forces = [atoms.get_forces() for atoms in images]
+        for (reference_energy, reference_forces), energy, image_forces in zip(reference, energies, forces):
+            assert np.isclose(energy, reference_energy, rtol=1e-12)
+            assert np.allclose(image_forces, reference_forces, rtol=1e-12, atol=1e-14)
+
+        # moving one image only re-evaluates that image
+        images[1].positions[0] += 0.05
+        moved = get_single_image_results([images[1]])[0]
+        assert np.isclose(images[1].get_potential_energy(), moved[0], rtol=1e-12)
+        assert np.isclose(images[0].get_potential_energy(), reference[0][0], rtol=1e-12)
+        images[1].positions[0] -= 0.05
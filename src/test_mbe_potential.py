@@ -0,0 +1,164 @@
+import itertools
+import numpy as np
+import pytest
+from ase.calculators.lj import LennardJones
+from .Fragments import Fragments
+from .MBE_Potential import ASE_MBE_Potential, Classical_MBE_Potential
+from .MBE_Terms import MBE_Terms
+from .Executors import serial_executor, Thread_Executor
+from .Planner import plan_mbe
+
+def make_lennard_jones():
+    return LennardJones(sigma=1.0, epsilon=0.01, rc=10.0)
+
+def test_ase_batch_matches_single_geometries(water_cluster, water_fragments):
+    """Every geometry of a batch gets its own n-mers, also when the n-mer Atoms are kept and moved in place."""
+    _, coords = water_cluster(4)
+    geometries = [coords + np.random.default_rng(seed).normal(scale=0.1, size=coords.shape) for seed in range(3)]
+    for keep_nmers in (False, True):
+        mbe = ASE_MBE_Potential(3, water_fragments(4, make_lennard_jones()), executor=serial_executor, keep_nmers=keep_nmers)
+        single = [mbe.evaluate_on_geometry(geometry) for geometry in geometries]
+        batch = mbe.evaluate_on_geometries_parallel(geometries)
+        assert len(set(energy for energy, _ in single)) == len(geometries)
+        for (energy, forces), (batch_energy, batch_forces) in zip(single, batch):
+            assert np.isclose(batch_energy, energy, rtol=1e-12, atol=1e-14)
+            assert np.allclose(batch_forces, forces, rtol=1e-12, atol=1e-14)
+
+def test_kept_nmers_are_only_copied_for_batches(water_fragments):
+    mbe = ASE_MBE_Potential(2, water_fragments(3, make_lennard_jones()), executor=serial_executor, keep_nmers=True)
+    store = mbe.fragments.nmer_store
+    assert all(task is store[fragment_indices] for *_, fragment_indices, task in mbe.make_reduction_items())
+    tasks = [task for *_, fragment_indices, task in mbe.make_reduction_items(detach=True)]
+    assert not any(task is nmer for task in tasks for nmer in store.values())
+    assert all(task.calc is store[fragment_indices].calc for *_, fragment_indices, task in mbe.make_reduction_items(detach=True))
+
+def test_sampled_mbe(toy_mbe):
+    mbe = toy_mbe(3, 8, return_mb_terms=True)
+    energy, forces, mb_terms = mbe.evaluate_on_fragments()
+
+    # an order with no more n-mers than a batch is evaluated exactly
+    exact = mbe.evaluate_on_fragments_sampled(sampled_from_order=3, batch_size=100)
+    assert np.isclose(exact[0], energy, rtol=1e-12)
+    assert np.allclose(exact[1], forces, atol=1e-12)
+
+    sampled = mbe.evaluate_on_fragments_sampled(sampled_from_order=3, max_samples=200, batch_size=20, seed=1)
+    assert sampled[0] == mbe.evaluate_on_fragments_sampled(sampled_from_order=3, max_samples=200, batch_size=20, seed=1)[0]
+    report = mbe.sampling_report[3]
+    assert report["samples"] == 200
+    assert abs(report["energy"] - mb_terms["3body_energy"]) < 5 * report["standard_error"]
+
+    importance = mbe.evaluate_on_fragments_sampled(sampled_from_order=3, max_samples=200, batch_size=20, importance=True, seed=1)
+    assert abs(mbe.sampling_report[3]["energy"] - mb_terms["3body_energy"]) < 5 * mbe.sampling_report[3]["standard_error"]
+    # the 1- and 2-body terms are exact either way
+    assert np.isclose(importance[0] - mbe.sampling_report[3]["energy"], energy - mb_terms["3body_energy"], rtol=1e-12)
+
+def test_generalized_mbe_over_single_fragments_is_mbe(toy_mbe):
+    for order in (1, 2, 3):
+        mbe = toy_mbe(order, 5)
+        energy, forces = mbe.evaluate_on_fragments()
+        generalized_energy, generalized_forces = mbe.evaluate_on_fragments_generalized([(i,) for i in range(5)])
+        assert np.isclose(generalized_energy, energy, rtol=1e-12)
+        assert np.allclose(generalized_forces, forces, atol=1e-12)
+
+def test_generalized_mbe_over_every_fragment_is_exact(toy_mbe, toy_potential, water_fragments):
+    """A single n-mer holding the whole system leaves nothing out."""
+    fragments = water_fragments(5)
+    full_energy, full_forces = toy_potential.evaluate(np.vstack(fragments.fragment_coords))
+    mbe = toy_mbe(2, fragments)
+    energy, forces = mbe.evaluate_on_fragments_generalized([(0, 1, 2), (2, 3, 4), (1, 3)])
+    assert np.isclose(energy, full_energy, rtol=1e-12)
+    assert np.allclose(forces, full_forces, atol=1e-12)
+
+def test_adaptive_mbe_counts_each_increment_once(toy_mbe):
+    """At order 4 a skipped trimer inside evaluated tetramers is filled in rather than absorbed by each of them."""
+    water = np.array([[0.0, 0.0, 0.0], [0.96, 0.0, 0.0], [-0.24, 0.93, 0.0]])
+    fragments = Fragments.__new__(Fragments)
+    fragments.set_fragments([["O", "H", "H"]] * 5, [water + [3.5 * i, 0.0, 0.0] for i in range(5)], None)
+    mbe = toy_mbe(4, fragments)
+    energy = mbe.evaluate_on_fragments()[0]
+    increments = mbe.compute_increments()
+
+    assert np.isclose(mbe.evaluate_on_fragments_adaptive(0.0, screen_from_order=2)[0], energy, rtol=1e-12)
+
+    evaluated = set()
+    evaluate_increments = mbe.evaluate_increments
+    def recording_evaluate_increments(combinations, *args, **kwargs):
+        evaluated.update(combinations)
+        return evaluate_increments(combinations, *args, **kwargs)
+    mbe.evaluate_increments = recording_evaluate_increments
+    adaptive_energy = mbe.evaluate_on_fragments_adaptive(1e-4, screen_from_order=2)[0]
+
+    # the trimer of the chain's ends and middle is screened out, but sits inside evaluated tetramers
+    assert mbe.screening_report[3]["evaluated"] < 10 and mbe.screening_report[4]["filled_in"] == 1
+    assert all(subset in evaluated for combination in evaluated for subset in itertools.combinations(combination, len(combination) - 1) if subset)
+    assert abs(adaptive_energy - sum(increments[combination][0] for combination in evaluated)) < 1e-12
+
+def test_multilevel_error_estimate(toy_mbe, scaled_toy_potential, water_fragments):
+    fragments = water_fragments(6, spacing=3.5)
+    cheap_increments = toy_mbe(3, fragments, scaled_toy_potential(1.1)).compute_increments()
+    mbe = toy_mbe(3, fragments)
+    energy = mbe.evaluate_on_fragments()[0]
+
+    assert np.isclose(mbe.evaluate_on_fragments_multilevel(cheap_increments, 0.0)[0], energy, rtol=1e-12)
+    assert mbe.multilevel_report["estimated_error"] == 0.0
+
+    # a tenth of the cheap increments is off, and so is the estimate for a tenth of the unselected ones
+    cutoff = np.median([abs(cheap_increments[combination][0]) for combination in fragments.get_fragment_combinations(3)])
+    multilevel_energy = mbe.evaluate_on_fragments_multilevel(cheap_increments, cutoff, screen_from_order=3)[0]
+    assert 0 < mbe.multilevel_report[3]["selected"] < 20
+    assert np.isclose(mbe.multilevel_report["estimated_error"], abs(multilevel_energy - energy), rtol=1e-6)
+
+    # with nothing selected there is nothing to compare the potentials on
+    mbe.evaluate_on_fragments_multilevel(cheap_increments, np.inf, screen_from_order=3)
+    assert mbe.multilevel_report[3]["selected"] == 0
+    assert mbe.multilevel_report[3]["estimated_error"] is None
+    assert mbe.multilevel_report["estimated_error"] is None
+
+def test_serial_mbe_sums_into_the_work_arrays(toy_mbe):
+    mb_terms = MBE_Terms(3, 15, nfragments=5, log_fragment_energies=True)
+    mbe = toy_mbe(3, 5, executor=Thread_Executor(2), mb_terms=mb_terms)
+    energy, forces, _ = mbe.evaluate_on_fragments_parallel()
+    fragment_energies = mb_terms.fragment_energies.copy()
+    mbe.close()
+
+    work_forces = mbe._forces_sum
+    serial_energy, serial_forces, _ = mbe.evaluate_on_fragments()
+    assert mbe._forces_sum is work_forces
+    assert np.isclose(serial_energy, energy, rtol=1e-12)
+    assert np.allclose(serial_forces, forces, atol=1e-12)
+    assert np.allclose(mb_terms.fragment_energies, fragment_energies, atol=1e-12)
+    assert np.isclose(np.sum(mb_terms.fragment_energies), serial_energy, rtol=1e-12)
+
+def test_generalized_mbe_returns_the_usual_shape(toy_mbe):
+    mbe = toy_mbe(2, 4, return_mb_terms=True)
+    energy, forces, mb_terms = mbe.evaluate_on_fragments_generalized(nneighbors=1)
+    assert mb_terms is None and forces.shape == (12, 3)
+    mbe = toy_mbe(2, 4, return_order_n=2)
+    with pytest.raises(SystemExit):
+        mbe.evaluate_on_fragments_generalized(nneighbors=1)
+
+def test_chunks_per_worker_from_the_planner(toy_mbe):
+    plan = plan_mbe(toy_mbe(3, 5), nproc=2)
+    executor = Thread_Executor(2)
+    mbe = toy_mbe(3, 5, executor=executor, chunks_per_worker=plan["recommended_chunks_per_worker"])
+    assert mbe.chunks_per_worker == plan["recommended_chunks_per_worker"]
+    assert Classical_MBE_Potential.chunks_per_worker == 4
+    assert len(mbe.submit_on_fragments().get()) == executor.get_nchunks(25, mbe.chunks_per_worker)
+    executor.close()
+
+def test_fragment_energies_split_the_nbody_increments(toy_mbe, water_cluster):
+    """The n-body energy of each fragment sums to the n-body energy, and vanishes for fragments which don't interact."""
+    for spacing, interacting in ((3.0, True), (100.0, False)):
+        labels, coords = water_cluster(5, spacing=spacing)
+        # waters of different shapes, so their 1-body energies differ
+        coords += np.random.default_rng(1).normal(scale=0.05, size=coords.shape)
+        fragments = Fragments.__new__(Fragments)
+        fragments.set_fragments([labels[3*i:3*i+3] for i in range(5)], [coords[3*i:3*i+3] for i in range(5)], None)
+        for evaluate in ("evaluate_on_fragments", "evaluate_on_fragments_parallel", "evaluate_on_fragments_symmetric"):
+            mb_terms = MBE_Terms(3, 15, nfragments=5, log_fragment_energies=True)
+            executor = Thread_Executor(2)
+            getattr(toy_mbe(3, fragments, executor=executor, mb_terms=mb_terms), evaluate)()
+            executor.close()
+            assert np.allclose(np.sum(mb_terms.fragment_energies, axis=1), mb_terms.energies, rtol=1e-10, atol=1e-12)
+            if not interacting:
+                assert np.allclose(mb_terms.fragment_energies[1:], 0.0, atol=1e-12)
@@ -0,0 +1,92 @@
+import os
+import numpy as np
+import pytest
+from .NMer_Dataset import NMer_Dataset_Writer, NMer_Dataset
+
+def make_records(nrecords, seed=0):
+    rng = np.random.default_rng(seed)
+    records = []
+    for i in range(nrecords):
+        order = int(rng.integers(1, 4))
+        natoms = 3 * order
+        records.append({"labels": ["O", "H", "H"] * order,
+                        "coordinates": rng.normal(size=(natoms, 3)),
+                        "energy": float(rng.normal()),
+                        "forces": rng.normal(size=(natoms, 3)),
+                        "increment": float(rng.normal()),
+                        "increment_forces": rng.normal(size=(natoms, 3)),
+                        "fragments": tuple(sorted(int(j) for j in rng.choice(10, order, replace=False))),
+                        "frame": i // 7,
+                        "source": f"trajectory_{i % 2}.xyz"})
+    return records
+
+def write_records(directory, records, chunk_size):
+    with NMer_Dataset_Writer(directory, chunk_size=chunk_size) as writer:
+        for record in records:
+            writer.add_nmer(record["labels"], record["coordinates"], record["energy"], record["forces"], record["increment"],
+                            record["increment_forces"], record["fragments"], record["frame"], record["source"])
+
+def test_records_round_trip(tmp_path):
+    records = make_records(25)
+    write_records(tmp_path, records[:20], chunk_size=8)
+    # a second writer appends to the dataset
+    write_records(tmp_path, records[20:], chunk_size=8)
+    dataset = NMer_Dataset(tmp_path)
+    assert len(dataset) == len(records)
+    assert len(dataset.index["chunks"]) == 4
+
+    for i, record in enumerate(records):
+        read = dataset[i]
+        for key, value in record.items():
+            if isinstance(value, np.ndarray):
+                assert np.array_equal(read[key], value)
+            else:
+                assert read[key] == value
+    assert dataset[-1]["energy"] == records[-1]["energy"]
+
+    indices = [24, 3, 11, 3, 0]
+    batch = dataset.get_batch(indices)
+    assert np.array_equal(batch["energy"], [records[i]["energy"] for i in indices])
+    assert np.array_equal(batch["order"], [len(records[i]["fragments"]) for i in indices])
+    assert np.array_equal(batch["coordinates"], np.concatenate([records[i]["coordinates"] for i in indices]))
+    assert np.array_equal(batch["atom_offsets"], np.cumsum([0] + [len(records[i]["labels"]) for i in indices]))
+
+def test_exported_mbe(tmp_path, toy_mbe):
+    mbe = toy_mbe(3, 4)
+    energy, forces = mbe.evaluate_on_fragments()
+    with NMer_Dataset_Writer(tmp_path) as writer:
+        exported_energy, exported_forces = mbe.evaluate_on_fragments_exported(writer, frame=2, source="cluster.xyz")
+    assert np.isclose(exported_energy, energy, rtol=1e-12)
+    assert np.allclose(exported_forces, forces, atol=1e-12)
+
+    dataset = NMer_Dataset(tmp_path)
+    assert len(dataset) == 4 + 6 + 4
+    assert np.isclose(sum(dataset[i]["increment"] for i in range(len(dataset))), energy, rtol=1e-12)
+    dimer = dataset[4]
+    assert dimer["fragments"] == (0, 1)
+    assert dimer["frame"] == 2 and dimer["source"] == "cluster.xyz"
+    assert dimer["energy"] == mbe.potential.evaluate(dimer["coordinates"])[0]
+
+def test_out_of_range_indices(tmp_path):
+    records = make_records(10)
+    write_records(tmp_path, records, chunk_size=4)
+    dataset = NMer_Dataset(tmp_path)
+    batch = dataset.get_batch([-1, -10, 0])
+    assert np.array_equal(batch["energy"], [records[9]["energy"], records[0]["energy"], records[0]["energy"]])
+    for index in (10, -11):
+        with pytest.raises(IndexError, match="out of range"):
+            dataset[index]
+        with pytest.raises(IndexError, match="out of range"):
+            dataset.get_batch([0, index])
+
+def test_one_writer_at_a_time(tmp_path):
+    records = make_records(3)
+    with NMer_Dataset_Writer(tmp_path) as writer:
+        with pytest.raises(SystemExit):
+            NMer_Dataset_Writer(tmp_path)
+        writer.add_nmer(*(records[0][key] for key in ["labels", "coordinates", "energy", "forces", "increment", "increment_forces", "fragments"]))
+    # closing unlocks the dataset
+    write_records(tmp_path, records[1:], chunk_size=4)
+    dataset = NMer_Dataset(tmp_path)
+    assert [dataset[i]["energy"] for i in range(len(dataset))] == [record["energy"] for record in records]
+    assert not os.path.exists(os.path.join(tmp_path, ".lock"))
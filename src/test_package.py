@@ -0,0 +1,21 @@
+import sys
+import subprocess
+import os
+
+def test_exports_share_modules_with_relative_imports():
+    """The package's exports and the modules' imports of each other are the same module objects."""
+    import src as package
+    from . import Interfaces, HarmonicAnalysis, Pools
+    from .MBE_Potential import MBE_Potential
+    assert package.MBE_Potential is MBE_Potential
+    assert package.MBEPotentialCalculator is Interfaces.MBEPotentialCalculator
+    assert Interfaces.MBE_Potential is MBE_Potential
+    assert HarmonicAnalysis.acquire_pool is Pools.acquire_pool
+    assert not any(name in sys.modules for name in ("Pools", "MBE_Potential", "Fragments"))
+
+def test_package_does_not_shadow_the_standard_library():
+    """Importing the package leaves sys.path alone, so its test.py doesn't stand in for the standard library's test."""
+    code = "import src, src.MBE_Potential, test; print(test.__file__)"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", code], check=True, cwd=root, capture_output=True, text=True).stdout
+    assert os.path.dirname(output.strip()) != os.path.join(root, "src")
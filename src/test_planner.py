@@ -0,0 +1,50 @@
+import tracemalloc
+from collections import Counter
+from math import comb
+import numpy as np
+from .Fragments import Fragments
+from .Potential import Potential
+from .Planner import plan_mbe, format_plan
+
+class Counting_Potential(Potential):
+    """Counts the n-mers of waters it evaluates per order."""
+    def __init__(self, potential):
+        super().__init__()
+        self.potential = potential
+        self.counts = Counter()
+
+    def evaluate(self, coords):
+        self.counts[len(coords) // 3] += 1
+        return self.potential.evaluate(coords)
+
+def test_plan_matches_an_evaluation(toy_mbe, toy_potential):
+    potential = Counting_Potential(toy_potential)
+    mbe = toy_mbe(3, 12, potential)
+    plan = plan_mbe(mbe, nproc=2)
+    assert plan["valid"] and "chunks_per_worker=" in format_plan(plan)
+
+    potential.counts.clear()
+    tracemalloc.start()
+    mbe.evaluate_on_fragments()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert {order: order_plan["nmers"] for order, order_plan in plan["orders"].items()} == dict(potential.counts)
+    assert plan["nmers"] == sum(potential.counts.values()) == 12 + 66 + 220
+    # the memory is projected from a few measured n-mers, so it's only close
+    assert 0.5 * peak < plan["peak_memory_serial_bytes"] < 2.0 * peak
+    assert plan["peak_memory_parallel_bytes"] > plan["peak_memory_serial_bytes"]
+
+def test_plan_after_adaptive_evaluation(toy_mbe, toy_potential, water_fragments):
+    water = np.array([[0.0, 0.0, 0.0], [0.96, 0.0, 0.0], [-0.24, 0.93, 0.0]])
+    chain = Fragments.__new__(Fragments)
+    chain.set_fragments([["O", "H", "H"]] * 5, [water + [3.5 * i, 0.0, 0.0] for i in range(5)], None)
+    for fragments, order in ((water_fragments(10, spacing=4.0), 3), (chain, 4)):
+        potential = Counting_Potential(toy_potential)
+        mbe = toy_mbe(order, fragments, potential)
+        mbe.evaluate_on_fragments_adaptive(1e-4, screen_from_order=2)
+        evaluated = dict(potential.counts)
+        assert evaluated[order] < comb(len(fragments.fragments), order)
+        # the planner projects the n-mers the screening kept, and those which were filled in below them
+        plan = plan_mbe(mbe, nproc=2, calibrate=False)
+        assert {order: order_plan["nmers"] for order, order_plan in plan["orders"].items()} == evaluated
+    assert mbe.screening_report[4]["filled_in_orders"] == {3: 1}
@@ -0,0 +1,23 @@
+import pickle
+import threading
+from .Potential import Potential
+
+class Sized_Potential(Potential):
+    def make_size_handle(self, natoms):
+        return [natoms]
+
+def test_size_handles_are_per_thread():
+    potential = Sized_Potential()
+    handle = potential.get_size_handle(6)
+    assert potential.get_size_handle(6) is handle
+
+    handles = []
+    threads = [threading.Thread(target=lambda: handles.append(potential.get_size_handle(6))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(thread_handle) for thread_handle in handles + [handle]}) == 3
+
+    copy = pickle.loads(pickle.dumps(potential))
+    assert copy.get_size_handle(6) is not handle
@@ -0,0 +1,21 @@
+import numpy as np
+from .read_geometries import read_geoms, format_frame, Trajectory_Writer
+
+def test_trajectory_round_trip(tmp_path, water_cluster):
+    labels, coords = water_cluster(5)
+    frames = [coords + np.random.default_rng(seed).normal(scale=0.1, size=coords.shape) for seed in range(4)]
+    for background in (False, True):
+        ofile = tmp_path / f"trajectory_{background}.xyz"
+        with Trajectory_Writer(ofile, background=background) as writer:
+            for i, frame in enumerate(frames):
+                writer.write(labels, frame, comment=f"frame {i}", energy=-0.5 * i)
+        header, read_labels, read_coords = read_geoms(ofile)
+        assert len(header) == len(frames)
+        assert header[2] == f"15\nframe 2 energy={-1.0:.12f}\n"
+        assert all(frame_labels == labels for frame_labels in read_labels)
+        for frame, read_frame in zip(frames, read_coords):
+            assert np.allclose(read_frame, frame, rtol=0.0, atol=1e-13)
+
+def test_frame_lines():
+    frame = format_frame(["O", "Cl"], [[1.0, -2.0, 0.5], [0.0, 0.0, 1e3]], "comment", precision=4)
+    assert frame == "2\ncomment\nO      1.0000    -2.0000     0.5000\nCl     0.0000     0.0000  1000.0000\n"
@@ -0,0 +1,48 @@
+import numpy as np
+from .Fragments import Fragments
+from .Symmetry import find_symmetry_operations, get_nmer_orbits
+
+def make_ring(nwaters, radius=3.0):
+    """Returns Fragments of nwaters waters on a ring with C_n symmetry about z."""
+    water = np.array([[radius, 0.0, 0.3], [radius + 0.96, 0.0, 0.3], [radius - 0.24, 0.93, 0.3]])
+    coords = []
+    for i in range(nwaters):
+        angle = 2.0 * np.pi * i / nwaters
+        rotation = np.array([[np.cos(angle), -np.sin(angle), 0.0], [np.sin(angle), np.cos(angle), 0.0], [0.0, 0.0, 1.0]])
+        coords.append(water @ rotation.T)
+    fragments = Fragments.__new__(Fragments)
+    fragments.set_fragments([["O", "H", "H"]] * nwaters, coords, None)
+    return fragments
+
+def test_ring_operations_and_orbits():
+    fragments = make_ring(6)
+    coords = np.vstack(fragments.fragment_coords)
+    operations = find_symmetry_operations(fragments.flattened_atom_labels, coords, [3] * 6)
+    assert len(operations) == 6
+    for rotation, permutation, _ in operations:
+        assert np.allclose(rotation @ rotation.T, np.eye(3))
+        centered = coords - coords.mean(axis=0)
+        assert np.allclose(centered @ rotation.T, centered[permutation], atol=1e-6)
+
+    # the dimers of a 6-ring are first, second and third neighbors
+    orbits = get_nmer_orbits(fragments.get_fragment_combinations(2), operations)
+    assert len({representative for representative, _ in orbits.values()}) == 3
+    for combination, (representative, k) in orbits.items():
+        image = tuple(sorted(int(i) for i in operations[k][2][list(representative)]))
+        assert image == combination
+
+def test_symmetric_mbe_matches_mbe(toy_mbe):
+    mbe = toy_mbe(3, make_ring(6))
+    energy, forces = mbe.evaluate_on_fragments()
+    symmetric_energy, symmetric_forces = mbe.evaluate_on_fragments_symmetric()
+    assert np.isclose(symmetric_energy, energy, rtol=1e-10)
+    assert np.allclose(symmetric_forces, forces, atol=1e-8)
+    assert [mbe.symmetry_report[order]["evaluated"] for order in (1, 2, 3)] == [1, 3, 4]
+
+def test_no_symmetry_is_identity():
+    fragments = make_ring(4)
+    fragments.fragment_coords[0][0] += 0.1
+    coords = np.vstack(fragments.fragment_coords)
+    operations = find_symmetry_operations(fragments.flattened_atom_labels, coords, [3] * 4)
+    assert len(operations) == 1
+    assert np.allclose(operations[0][0], np.eye(3))
@@ -0,0 +1,47 @@
+import os
+import numpy as np
+from ase.calculators.calculator import Calculator, all_changes
+from .MBE_Potential import ASE_MBE_Potential
+from .Executors import serial_executor
+from .Warm_Start import NMer_Warm_Start
+
+class Toy_File_Calculator(Calculator):
+    """Evaluates its potential parameter like a file-based calculator: it leaves a database at its label,
+    and remembers whether each calculation was asked to restart."""
+    implemented_properties = ["energy", "forces"]
+
+    def __init__(self, label=None, perm=None, scratch=None, **parameters):
+        super().__init__(**parameters)
+        self.file_label = label
+        self.restart_kws = []
+
+    def calculate(self, atoms=None, properties=["energy"], system_changes=all_changes):
+        super().calculate(atoms, properties, system_changes)
+        energy, forces = self.parameters["potential"].evaluate(self.atoms.positions)
+        self.results = {"energy": energy, "forces": forces}
+        self.restart_kws.append(self.parameters.get("restart_kw"))
+        if self.file_label is not None:
+            open(self.file_label + ".db", "w").close()
+
+def test_warm_start_restarts_nmers_from_their_own_files(tmp_path, toy_potential, water_cluster, water_fragments):
+    _, coords = water_cluster(3)
+    geometries = [coords + np.random.default_rng(seed).normal(scale=0.05, size=coords.shape) for seed in range(2)]
+    warm_start = NMer_Warm_Start(Toy_File_Calculator(potential=toy_potential), tmp_path / "nmers")
+    warm = ASE_MBE_Potential(2, water_fragments(3), executor=serial_executor, warm_start=warm_start)
+    cold = ASE_MBE_Potential(2, water_fragments(3, Toy_File_Calculator(potential=toy_potential)), executor=serial_executor)
+
+    for geometry in geometries:
+        warm_energy, warm_forces = warm.evaluate_on_geometry(geometry)
+        cold_energy, cold_forces = cold.evaluate_on_geometry(geometry)
+        assert np.isclose(warm_energy, cold_energy, rtol=1e-12)
+        assert np.allclose(warm_forces, cold_forces, atol=1e-12)
+
+    # one calculator per n-mer, which started once and then restarted from the files at its label
+    assert len(warm_start.calculators) == 3 + 3
+    for combination, calculator in warm_start.calculators.items():
+        assert calculator.file_label == warm_start.get_label(combination)
+        assert calculator.restart_kws == ["start", "restart"]
+    assert warm_start.statistics == {"started": 6, "restarted": 6, "cleanups": 0}
+
+    warm_start.cleanup()
+    assert os.listdir(tmp_path / "nmers") == []